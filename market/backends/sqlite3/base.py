@@ -0,0 +1,100 @@
+"""
+Django's SQLite backend, tuned for serving many concurrent workers.
+
+Every new connection gets the pragmas in SQLITE_PRAGMAS (WAL, synchronous, mmap,
+cache and temp storage, busy timeout). Each pragma is read back after it is set;
+one that fails or does not take the asked-for value is logged when the connection
+opens and reported as a system check warning (market.W001) by `migrate`,
+`runserver` and `check --database`, instead of silently running with SQLite's
+defaults.
+
+The connection OPTIONS also accept Django 5.1's `transaction_mode`. With
+"IMMEDIATE", atomic blocks take the write lock when they begin, so a transaction
+that reads before it writes waits for busy_timeout instead of failing with
+"database is locked" when it tries to upgrade its lock.
+"""
+import logging
+
+from django.conf import settings
+from django.core import checks
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.base.validation import BaseDatabaseValidation
+from django.db.backends.sqlite3 import base
+
+logger = logging.getLogger(__name__)
+
+TRANSACTION_MODES = {'DEFERRED', 'IMMEDIATE', 'EXCLUSIVE'}
+
+# Pragmas that read back as numbers although they are set by name.
+PRAGMA_VALUES = {
+    'synchronous': {'off': 0, 'normal': 1, 'full': 2, 'extra': 3},
+    'temp_store': {'default': 0, 'file': 1, 'memory': 2},
+}
+
+# Properties of the database file, which an in-memory database does not have.
+FILE_PRAGMAS = {'journal_mode', 'mmap_size'}
+
+
+def expected_value(name, value):
+    value = str(value).lower()
+    return str(PRAGMA_VALUES.get(name, {}).get(value, value))
+
+
+def apply_pragmas(conn, pragmas, in_memory=False):
+    """
+    Set `pragmas` on a DB-API connection. Returns a message for every pragma that
+    failed or read back with a different value.
+    """
+    problems = []
+    for name, value in pragmas.items():
+        if in_memory and name in FILE_PRAGMAS:
+            continue
+        try:
+            conn.execute(f'PRAGMA {name} = {value}')
+            row = conn.execute(f'PRAGMA {name}').fetchone()
+        except base.Database.Error as error:
+            problems.append(f'PRAGMA {name} = {value} failed: {error}')
+            continue
+        actual = None if row is None else str(row[0]).lower()
+        if actual != expected_value(name, value):
+            problems.append(f'PRAGMA {name} = {value} did not apply; it is {actual}.')
+    return problems
+
+
+class DatabaseValidation(BaseDatabaseValidation):
+
+    def check(self, **kwargs):
+        issues = super().check(**kwargs)
+        self.connection.ensure_connection()
+        issues.extend(
+            checks.Warning(problem, obj=f'DATABASES[{self.connection.alias!r}]', id='market.W001')
+            for problem in self.connection.pragma_problems
+        )
+        return issues
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    validation_class = DatabaseValidation
+    pragma_problems = ()
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        self.transaction_mode = (params.pop('transaction_mode', None) or 'DEFERRED').upper()
+        if self.transaction_mode not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(
+                f"settings.DATABASES[{self.alias!r}]['OPTIONS']['transaction_mode'] must be one of "
+                f"{', '.join(sorted(TRANSACTION_MODES))}."
+            )
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        problems = apply_pragmas(conn, getattr(settings, 'SQLITE_PRAGMAS', {}), self.is_in_memory_db())
+        if problems and list(problems) != list(self.pragma_problems):
+            for problem in problems:
+                logger.warning('Database %r: %s', self.alias, problem)
+        self.pragma_problems = problems
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(f'BEGIN {self.transaction_mode}')
@@ -0,0 +1,175 @@
+"""
+Read/write splitting across the primary database and its read replicas.
+
+Writes, and reads by default, go to the primary ('default'). Views opt in to
+replica reads with ReplicaReadMixin, or `read_from_replicas` for function views;
+their safe requests then read from a random healthy replica in DATABASE_REPLICAS.
+
+A replica is healthy when it answers and its replication heartbeat is at most
+REPLICA_MAX_LAG seconds old; when none is, reads fall back to the primary.
+A client that wrote something reads from the primary for REPLICA_STICKY_SECONDS
+afterwards, so it sees its own writes: PrimaryAfterWriteMiddleware pins it by
+cookie, and by user id for token-authenticated clients that drop cookies.
+"""
+import asyncio
+import functools
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError
+from django.utils import timezone
+from rest_framework.permissions import SAFE_METHODS
+
+from market import metrics
+
+_use_replicas = ContextVar('use_replicas', default=False)
+
+_health = {}
+_health_lock = threading.Lock()
+
+
+def _pin_key(user_id):
+    return f'db-pin:{user_id}'
+
+
+def write_heartbeat():
+    from product.models import ReplicationHeartbeat
+    ReplicationHeartbeat.objects.update_or_create(id=1, defaults={'beat': timezone.now()})
+
+
+def replica_lag(alias):
+    """
+    Seconds since the replica at `alias` last received the primary's heartbeat.
+    """
+    from product.models import ReplicationHeartbeat
+    beat = ReplicationHeartbeat.objects.using(alias).values_list('beat', flat=True).first()
+    if beat is None:
+        return None
+    return (timezone.now() - beat).total_seconds()
+
+
+def _healthy(alias):
+    now = time.monotonic()
+    with _health_lock:
+        checked = _health.get(alias)
+        if checked is not None and now - checked[0] < settings.REPLICA_CHECK_INTERVAL:
+            return checked[1]
+    try:
+        lag = replica_lag(alias)
+    except DatabaseError:
+        lag = None
+    healthy = lag is not None and lag <= settings.REPLICA_MAX_LAG
+    with _health_lock:
+        _health[alias] = (now, healthy)
+    return healthy
+
+
+def healthy_replicas():
+    return [alias for alias in settings.DATABASE_REPLICAS if _healthy(alias)]
+
+
+def is_pinned(request, user=None):
+    if settings.REPLICA_PIN_COOKIE in request.COOKIES:
+        return True
+    return user is not None and user.is_authenticated and bool(cache.get(_pin_key(user.pk)))
+
+
+def pin_to_primary(request, response):
+    """
+    Send the client's reads to the primary for the next REPLICA_STICKY_SECONDS.
+    """
+    response.set_cookie(settings.REPLICA_PIN_COOKIE, '1', max_age=settings.REPLICA_STICKY_SECONDS,
+                        httponly=True, samesite='Lax')
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        cache.set(_pin_key(user.pk), True, settings.REPLICA_STICKY_SECONDS)
+
+
+@contextmanager
+def replica_reads(request, user=None):
+    """
+    Let the reads of a safe request that isn't pinned to the primary go to replicas.
+    """
+    allowed = bool(settings.DATABASE_REPLICAS) and request.method in SAFE_METHODS and not is_pinned(request, user)
+    token = _use_replicas.set(allowed)
+    try:
+        yield
+    finally:
+        _use_replicas.reset(token)
+
+
+def read_from_replicas(view):
+    """
+    Decorator routing the reads of a sync or async function view to replicas.
+    """
+    if asyncio.iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            with replica_reads(request):
+                return await view(request, *args, **kwargs)
+    else:
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            with replica_reads(request):
+                return view(request, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaReadMixin:
+    """
+    APIView mixin routing the view's reads to replicas. The decision is made once
+    the request is authenticated, so token-authenticated writers stay pinned.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self._replica_reads = replica_reads(request, request.user)
+        self._replica_reads.__enter__()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        replica_reads = getattr(self, '_replica_reads', None)
+        if replica_reads is not None:
+            self._replica_reads = None
+            replica_reads.__exit__(None, None, None)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class PrimaryAfterWriteMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if settings.DATABASE_REPLICAS and request.method not in SAFE_METHODS and response.status_code < 400:
+            pin_to_primary(request, response)
+        return response
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        if _use_replicas.get():
+            replicas = healthy_replicas()
+            if replicas:
+                return random.choice(replicas)
+            metrics.incr('db.replica_fallback')
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        # Replicas get their schema from the primary.
+        return db not in settings.DATABASE_REPLICAS
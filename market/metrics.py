@@ -0,0 +1,25 @@
+"""
+Process-wide counters kept in the default cache, for monitoring endpoints.
+"""
+from django.core.cache import cache
+
+KEY_PREFIX = 'metrics:'
+
+
+def incr(name, delta=1):
+    key = KEY_PREFIX + name
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        if not cache.add(key, delta, None):
+            cache.incr(key, delta)
+
+
+def snapshot(*names):
+    values = cache.get_many([KEY_PREFIX + name for name in names])
+    return {name: values.get(KEY_PREFIX + name, 0) for name in names}
+
+
+def hit_rate(hits, misses):
+    total = hits + misses
+    return hits / total if total else None
@@ -0,0 +1,77 @@
+"""
+JSON renderer that encodes with orjson when it is installed.
+
+orjson builds the response body as bytes in one pass, without the intermediate
+str of the stdlib encoder. Types it does not know (Decimal, lazy strings,
+querysets, ...) and datetimes are handed to DRF's own encoder, so the output
+matches ``rest_framework.renderers.JSONRenderer`` except for two differences:
+
+- floats in exponent notation are spelled without a sign or leading zero in
+  the exponent (``1e16`` and ``1e-7``, where the stdlib writes ``1e+16`` and
+  ``1e-07``); they decode to the same values;
+- NaN and infinity become null instead of raising ValueError.
+
+Anything orjson cannot produce (indentation, ASCII-only output, integers over
+64 bits) falls back to the stdlib path.
+"""
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# DRF escapes these for embedding in <script>; orjson leaves them as they are.
+LINE_SEPARATOR = '\u2028'.encode()
+PARAGRAPH_SEPARATOR = '\u2029'.encode()
+
+if orjson is not None:
+    # DRF's encoder formats datetimes with millisecond precision and a "Z" suffix; orjson would keep microseconds.
+    ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+
+def dumps(data, default=JSONEncoder().default):
+    """
+    Encode `data` to compact UTF-8 JSON bytes the way JSONRenderer does, or return
+    None when orjson is missing or cannot encode it.
+    """
+    if orjson is None:
+        return None
+    try:
+        body = orjson.dumps(data, default=default, option=ORJSON_OPTIONS)
+    except orjson.JSONEncodeError:
+        return None
+    if LINE_SEPARATOR in body or PARAGRAPH_SEPARATOR in body:
+        body = body.replace(LINE_SEPARATOR, b'\\u2028').replace(PARAGRAPH_SEPARATOR, b'\\u2029')
+    return body
+
+
+def write_json(data, buffer):
+    """
+    Write `data` as compact JSON into the binary file-like `buffer`. Without orjson,
+    the stdlib encoder's chunks are encoded and written as they are produced, so the
+    whole document never exists as one str.
+    """
+    body = dumps(data)
+    if body is not None:
+        buffer.write(body)
+        return
+    encoder = JSONEncoder(ensure_ascii=False, allow_nan=False, separators=(',', ':'))
+    for chunk in encoder.iterencode(data):
+        buffer.write(chunk.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029').encode())
+
+
+class FastJSONRenderer(JSONRenderer):
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        renderer_context = renderer_context or {}
+        if self.ensure_ascii or self.encoder_class is not JSONEncoder \
+                or self.get_indent(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+        body = dumps(data)
+        if body is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        return body
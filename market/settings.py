@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
 
@@ -32,6 +33,32 @@ ALLOWED_HOSTS = []
 STRIPE_PUBLIC_KEY = ('pk_test_51N2wH4Jo8IoqUbuO7DmUg5ZEQbxIsJfHyfeH1voYnqKXhIyPpgfz1ef8BHnp8r1pyu57mWjCKKHlPFbkHhHbBheQ005BAHaxMi')
 STRIPE_SECRET_KEY = ('sk_test_51N2wH4Jo8IoqUbuOIAYseQxztqS2l44slLi056FdGtTJggEcCnbJoYkUdry1SdLmCsZ6dOc8vj7BaFAD4i8Talb400ywYcOj5a')
 
+# Stripe API endpoint; point it at `manage.py fake_stripe` to run payments offline.
+STRIPE_API_BASE = os.environ.get('STRIPE_API_BASE', 'https://api.stripe.com')
+
+# Seconds to connect to / wait for a response from Stripe, and retries of failed network calls.
+STRIPE_TIMEOUT = (3.05, 10)
+STRIPE_MAX_NETWORK_RETRIES = 2
+
+# Stripe calls in flight per process, and seconds a request waits for a free slot
+# before its payment is queued instead.
+STRIPE_MAX_CONCURRENCY = 8
+STRIPE_SLOT_TIMEOUT = 0.5
+
+# Queue every payment instead of only those sent with "Prefer: respond-async".
+PAYMENTS_QUEUED = False
+
+# Seconds after which a payment claimed by a crashed worker may be claimed again.
+PAYMENT_CLAIM_TIMEOUT = 300
+
+# Outbox delivery (`manage.py process_outbox`): messages leased per batch, seconds a
+# lease lasts before another worker may take the message over, attempts before a
+# message is given up on, and the first and longest retry delay in seconds.
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_LEASE = 60
+OUTBOX_MAX_ATTEMPTS = 10
+OUTBOX_BACKOFF = (1, 600)
+
 
 # Application definition
 
@@ -59,6 +86,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'market.db_router.PrimaryAfterWriteMiddleware',
 ]
 
 ROOT_URLCONF = 'market.urls'
@@ -84,9 +112,9 @@ WSGI_APPLICATION = 'market.wsgi.application'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.BasicAuthentication',
+        'user.authentication.CachedBasicAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'user.authentication.ClaimsJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
@@ -94,8 +122,22 @@ REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': (
         'django_filters.rest_framework.DjangoFilterBackend',
     ),
+    # orjson-backed when orjson is installed, DRF's stdlib JSON otherwise.
+    'DEFAULT_RENDERER_CLASSES': (
+        'market.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'market.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
     'PAGE_SIZE': 2,
+    # Per-user rates of the views with a throttle_scope; the catalog export reads every product.
+    'DEFAULT_THROTTLE_RATES': {
+        'product_export': '30/hour',
+    },
 }
 
 
@@ -104,19 +146,119 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1)
 }
 
+# Seconds the is_active/token_version of a token's user stay cached, so claims-based
+# JWT authentication makes no query; 0 reads them on every request.
+JWT_USER_CACHE_TIMEOUT = 60
+
+# Seconds verified Basic-auth credentials are remembered, so the password hasher
+# runs once per client instead of once per request; 0 disables the cache.
+BASIC_AUTH_CACHE_TIMEOUT = 300
+
 AUTH_USER_MODEL = 'user.CustomUser'
 
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# market.backends.sqlite3 is Django's SQLite backend plus SQLITE_PRAGMAS and
+# Django 5.1's `transaction_mode` option. Connections are kept for CONN_MAX_AGE
+# seconds and checked before a request reuses them.
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'market.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE'},
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Applied to every new SQLite connection; see market.backends.sqlite3.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # KiB, i.e. 64 MiB per connection
+    'temp_store': 'memory',
+}
+
+# Read replicas: DATABASES aliases that serve the reads of the catalog and listing
+# views (see market.db_router). To try them locally, set DATABASE_REPLICAS to a
+# comma-separated list of SQLite files and keep them current with
+# `manage.py sync_replicas`. There are none by default; tests that need them set
+# DATABASE_REPLICAS with override_settings.
+DATABASE_REPLICAS = []
+for _index, _name in enumerate(filter(None, os.environ.get('DATABASE_REPLICAS', '').split(','))):
+    DATABASES[f'replica{_index + 1}'] = dict(DATABASES['default'], NAME=BASE_DIR / _name.strip())
+    DATABASE_REPLICAS.append(f'replica{_index + 1}')
+
+DATABASE_ROUTERS = ['market.db_router.ReplicaRouter']
+
+# Seconds a replica may lag behind the primary before reads skip it, and how often
+# each process re-checks that lag.
+REPLICA_MAX_LAG = 5
+REPLICA_CHECK_INTERVAL = 1
+
+# Seconds a client reads from the primary after a write, so it sees its own writes.
+# Keep it above REPLICA_MAX_LAG.
+REPLICA_STICKY_SECONDS = 10
+REPLICA_PIN_COOKIE = 'db_primary'
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Use a shared backend (Redis, Memcached) when running more than one worker process,
+# otherwise cached counts, product detail responses and their ETags are only
+# invalidated in the process that did the write; the others serve them until they
+# expire. `manage.py check --deploy` warns about a process-local backend (product.W001).
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Seconds a cached listing count may live without being invalidated by a write.
+COUNT_CACHE_TIMEOUT = 300
+
+# Unfiltered listings over tables with more rows than this report the statistics estimate.
+COUNT_ESTIMATE_THRESHOLD = 100000
+
+
+# Most of one product a cart holds; adds beyond it leave the quantity at it.
+CART_MAX_QUANTITY = 1000
+
+# Number of newest comments embedded in the product detail response.
+PRODUCT_DETAIL_COMMENTS = 5
+
+# Number of products per page of the vendor storefront (profile and detail) responses.
+VENDOR_PRODUCTS_PAGE_SIZE = 20
+
+# Number of purchases per page of the customer profile response, newest first.
+CUSTOMER_PURCHASES_PAGE_SIZE = 20
+
+# Seconds a rendered product detail response and its version (the ETag) stay cached;
+# writes invalidate them sooner.
+PRODUCT_DETAIL_CACHE_TIMEOUT = 3600
+
+# Rows validated and inserted per transaction by the bulk product upload.
+PRODUCT_BULK_CHUNK_SIZE = 1000
+
+# Per-row errors reported by one bulk upload; further failures are only counted.
+PRODUCT_BULK_MAX_ERRORS = 1000
+
+# Rows fetched from the database per round trip by the catalog export.
+PRODUCT_EXPORT_CHUNK_SIZE = 2000
+
+# Rows written per transaction by the bulk user import, per-row errors it reports,
+# processes hashing plain-text passwords in `manage.py import_users` (0 hashes in
+# the importing process) and threads hashing them for the import endpoint.
+USER_IMPORT_CHUNK_SIZE = 1000
+USER_IMPORT_MAX_ERRORS = 1000
+USER_IMPORT_HASH_WORKERS = os.cpu_count() or 1
+USER_IMPORT_HASH_THREADS = 4
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
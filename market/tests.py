@@ -0,0 +1,185 @@
+import datetime
+import io
+import sqlite3
+import tempfile
+import uuid
+from collections import OrderedDict
+from decimal import Decimal
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils.translation import gettext_lazy
+from rest_framework.renderers import JSONRenderer
+
+from product.models import Product
+from user.models import Customer
+from . import db_router, metrics
+from .backends.sqlite3.base import DatabaseWrapper, apply_pragmas
+from .parsers import FastJSONParser
+from .renderers import FastJSONRenderer, write_json
+
+
+class FastJSONTests(SimpleTestCase):
+    data = OrderedDict([
+        ('id', 1),
+        ('name', 'Lamp \u2028 «rouge»'),
+        ('price', Decimal('10.50')),
+        ('created', datetime.datetime(2024, 1, 2, 3, 4, 5, 678901, tzinfo=datetime.timezone.utc)),
+        ('day', datetime.date(2024, 1, 2)),
+        ('time', datetime.time(3, 4, 5, 678901)),
+        ('uuid', uuid.UUID(int=1)),
+        ('label', gettext_lazy('Product')),
+        ('counts', {1: 2}),
+        ('tags', ('a', 'b')),
+        ('huge', 2 ** 70),
+    ])
+
+    def test_renders_like_drf(self):
+        expected = JSONRenderer().render(self.data)
+        self.assertEqual(FastJSONRenderer().render(self.data), expected)
+        data = dict(self.data, huge=1)
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        buffer = io.BytesIO()
+        write_json(self.data, buffer)
+        self.assertEqual(buffer.getvalue(), expected)
+
+    def test_known_differences(self):
+        self.assertEqual(FastJSONRenderer().render({'big': 1e16, 'small': 1e-7}), b'{"big":1e16,"small":1e-7}')
+        self.assertEqual(JSONRenderer().render({'big': 1e16, 'small': 1e-7}), b'{"big":1e+16,"small":1e-07}')
+        self.assertEqual(FastJSONRenderer().render({'nan': float('nan')}), b'{"nan":null}')
+        with self.assertRaises(ValueError):
+            JSONRenderer().render({'nan': float('nan')})
+
+    def test_parses_like_drf(self):
+        body = '{"name": "Lamp «rouge»", "price": 10, "tags": [1.5, null, true]}'.encode()
+        self.assertEqual(FastJSONParser().parse(io.BytesIO(body)), {'name': 'Lamp «rouge»', 'price': 10,
+                                                                     'tags': [1.5, None, True]})
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRouterTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        db_router._health.clear()
+        self.router = db_router.ReplicaRouter()
+        self.get = RequestFactory().get('/')
+        lag = mock.patch('market.db_router.replica_lag', return_value=0.5)
+        self.replica_lag = lag.start()
+        self.addCleanup(lag.stop)
+
+    def test_only_opted_in_safe_reads_use_replicas(self):
+        self.assertEqual(self.router.db_for_read(Product), 'default')
+        with db_router.replica_reads(self.get):
+            self.assertEqual(self.router.db_for_read(Product), 'replica')
+            self.assertEqual(self.router.db_for_write(Product), 'default')
+        with db_router.replica_reads(RequestFactory().post('/')):
+            self.assertEqual(self.router.db_for_read(Product), 'default')
+
+    def test_lagging_or_broken_replicas_fall_back_to_primary(self):
+        for lag in ({'return_value': 60}, {'return_value': None}, {'side_effect': DatabaseError}):
+            db_router._health.clear()
+            self.replica_lag.configure_mock(**lag)
+            before = metrics.snapshot('db.replica_fallback')['db.replica_fallback']
+            with db_router.replica_reads(self.get):
+                self.assertEqual(self.router.db_for_read(Product), 'default')
+            self.assertEqual(metrics.snapshot('db.replica_fallback')['db.replica_fallback'], before + 1)
+
+    def test_health_checks_are_cached(self):
+        with db_router.replica_reads(self.get):
+            self.router.db_for_read(Product)
+            self.router.db_for_read(Product)
+        self.assertEqual(self.replica_lag.call_count, 1)
+
+    def test_writers_are_pinned_to_primary(self):
+        customer = Customer.objects.create(email='pinned@example.com', name='Customer', second_name='Test',
+                                           phone_number='0', card_number='4242', address='Street', post_code='0')
+        response = self.client.post('/api/product/create/category', {'name': 'Lamps'})
+        self.assertEqual(response.status_code, 201)
+        self.assertIn(settings.REPLICA_PIN_COOKIE, response.cookies)
+        # A cookie-less token client is pinned by user id.
+        request = RequestFactory().post('/')
+        request.user = customer
+        db_router.pin_to_primary(request, response)
+        with db_router.replica_reads(self.get, customer):
+            self.assertEqual(self.router.db_for_read(Product), 'default')
+
+    def test_catalog_views_opt_in(self):
+        self.replica_lag.return_value = 60
+        for path in ('/api/product/list/', '/api/product/list/category', '/api/user/vendor/list',
+                     '/api/async/product/list/'):
+            before = metrics.snapshot('db.replica_fallback')['db.replica_fallback']
+            self.assertEqual(self.client.get(path).status_code, 200)
+            self.assertGreater(metrics.snapshot('db.replica_fallback')['db.replica_fallback'], before, path)
+        self.client.cookies[settings.REPLICA_PIN_COOKIE] = '1'
+        before = metrics.snapshot('db.replica_fallback')['db.replica_fallback']
+        self.client.get('/api/product/list/')
+        self.assertEqual(metrics.snapshot('db.replica_fallback')['db.replica_fallback'], before)
+
+    def test_export_streams_from_the_replica_chosen_by_the_view(self):
+        customer = Customer.objects.create(email='export@example.com', name='Customer', second_name='Test',
+                                           phone_number='0', card_number='4242', address='Street', post_code='0')
+        self.client.force_login(customer)
+        with mock.patch('product.views.export_products', return_value=iter([b''])) as export_products:
+            self.assertEqual(self.client.get('/api/product/export/').status_code, 200)
+        self.assertEqual(export_products.call_args.args[0].db, 'replica')
+
+
+class SQLiteBackendTests(SimpleTestCase):
+    pragmas = {'journal_mode': 'wal', 'synchronous': 'normal', 'busy_timeout': 5000, 'cache_size': -2048,
+               'temp_store': 'memory'}
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = f'{directory.name}/db.sqlite3'
+
+    def test_pragmas_apply_and_read_back(self):
+        conn = sqlite3.connect(self.path)
+        self.addCleanup(conn.close)
+        self.assertEqual(apply_pragmas(conn, self.pragmas), [])
+        self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone(), ('wal',))
+        self.assertEqual(conn.execute('PRAGMA synchronous').fetchone(), (1,))
+
+    def test_failed_pragmas_are_reported(self):
+        conn = sqlite3.connect(self.path)
+        self.addCleanup(conn.close)
+        problems = apply_pragmas(conn, {'journal_mode': 'sideways', 'busy_timeout': 'soon', 'synchronous': 'full'})
+        self.assertEqual(len(problems), 2)
+        self.assertIn('journal_mode', problems[0])
+        self.assertIn('busy_timeout', problems[1])
+
+    def test_in_memory_databases_skip_file_pragmas(self):
+        conn = sqlite3.connect(':memory:')
+        self.addCleanup(conn.close)
+        self.assertEqual(apply_pragmas(conn, dict(self.pragmas, mmap_size=2 ** 20), in_memory=True), [])
+
+    def wrapper(self, **options):
+        wrapper = DatabaseWrapper(dict(connection.settings_dict, NAME=self.path, OPTIONS=options), alias='tuned')
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def test_connections_are_tuned_and_checked(self):
+        wrapper = self.wrapper()
+        with self.settings(SQLITE_PRAGMAS=self.pragmas):
+            self.assertEqual(wrapper.validation.check(), [])
+        with wrapper.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone(), ('wal',))
+        wrapper.close()
+        with self.settings(SQLITE_PRAGMAS={'temp_store': 'nowhere'}), self.assertLogs('market.backends', 'WARNING'):
+            issues = wrapper.validation.check()
+        self.assertEqual([issue.id for issue in issues], ['market.W001'])
+
+    def test_immediate_transactions_take_the_write_lock(self):
+        wrapper = self.wrapper(transaction_mode='immediate')
+        wrapper.ensure_connection()
+        wrapper._start_transaction_under_autocommit()
+        other = sqlite3.connect(self.path, timeout=0)
+        self.addCleanup(other.close)
+        with self.assertRaisesMessage(sqlite3.OperationalError, 'locked'):
+            other.execute('BEGIN IMMEDIATE')
+        wrapper.connection.rollback()
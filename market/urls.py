@@ -22,4 +22,7 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/user/', include('user.urls')),
     path('api/product/', include('product.urls')),
+    # Async variants of the read-only catalog views, for ASGI deployments.
+    path('api/async/user/', include('user.async_urls')),
+    path('api/async/product/', include('product.async_urls')),
 ]
@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class ProductConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'product'
+
+    def ready(self):
+        from . import checks, payments, signals  # noqa: F401  (system checks, outbox handlers, signal receivers)
+        from .search import ensure_search_index
+        post_migrate.connect(ensure_search_index, sender=self)
@@ -0,0 +1,9 @@
+from django.urls import path
+
+from .async_views import product_list, category_list, product_detail
+
+urlpatterns = [
+    path('list/', product_list, name='async-product-list'),
+    path('list/category', category_list, name='async-category-list'),
+    path('<int:id>/', product_detail, name='async-product-detail'),
+]
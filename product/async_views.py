@@ -0,0 +1,118 @@
+"""
+Async variants of the read-only catalog views, for deployments behind an ASGI server.
+
+DRF 3.14 views are sync only, so these are plain Django async views that return the
+same JSON as their APIView counterparts, rendered with FastJSONRenderer. Reads use
+the async ORM; the helpers that are shared with the sync views and hit the
+database or the cache (filter validation, pagination and its cached count, price
+stats, the detail cache) run through sync_to_async.
+"""
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotFound, ValidationError
+from rest_framework.request import Request
+from rest_framework.views import APIView
+
+from market import metrics
+from market.db_router import read_from_replicas
+from market.renderers import FastJSONRenderer
+from . import detail_cache
+from .models import Category, Product
+from .serializers import CategorySerializer, ProductSerializer
+from .views import (ProductFilter, ProductListAPIView, ProductListPagination, detail_comments, detail_data,
+                    price_stats)
+
+
+def json_response(data, status=status.HTTP_200_OK):
+    return HttpResponse(FastJSONRenderer().render(data), content_type='application/json', status=status)
+
+
+async def authentication_error(request):
+    """
+    Authenticate `request` as an APIView with the default authentication classes
+    does, and return the 401/403 response it gives an anonymous or rejected user,
+    or None once the user is authenticated.
+    """
+    view = APIView()
+    view.request = drf_request = view.initialize_request(request)
+    try:
+        user = await sync_to_async(lambda: drf_request.user)()
+        if user is not None and user.is_authenticated:
+            return None
+        view.permission_denied(drf_request)
+    except APIException as exc:
+        # A 401 with the authenticator's challenge, or a 403 when it has none.
+        error = view.handle_exception(exc)
+        response = json_response(error.data, error.status_code)
+        if error.has_header('WWW-Authenticate'):
+            response['WWW-Authenticate'] = error['WWW-Authenticate']
+        return response
+
+
+async def product_rows(queryset):
+    """
+    ``ProductSerializer(queryset, many=True).data``, fetched with async iteration.
+    """
+    columns = ProductSerializer(many=True).get_columns()
+    names = [name for name, _ in columns]
+    return [dict(zip(names, row)) async for row in queryset.values_list(*[attname for _, attname in columns])]
+
+
+@read_from_replicas
+async def product_list(request):
+    if request.GET.get('pagination') == 'cursor':
+        # Keyset pagination is sync only; serve it from the sync view in a worker thread.
+        return await sync_to_async(ProductListAPIView.as_view())(request)
+    filterset = ProductFilter(request.GET, queryset=Product.objects.all())
+    # Validating a category filter looks the category up.
+    if not await sync_to_async(filterset.is_valid)():
+        # ValidationError turns Django's ErrorList, a UserList that orjson sees as empty, into plain lists.
+        return json_response(ValidationError(filterset.errors).detail, status.HTTP_400_BAD_REQUEST)
+    queryset = filterset.qs
+
+    pagination = ProductListPagination()
+    # Counting the rows goes through the count cache and may hit the database.
+    try:
+        page = await sync_to_async(pagination.get_page)(queryset, Request(request))
+    except NotFound as exc:
+        return json_response({'detail': exc.detail}, status.HTTP_404_NOT_FOUND)
+    products = await product_rows(page.object_list)
+    price = await sync_to_async(price_stats)(filterset, queryset)
+    return json_response(pagination.get_paginated_response({'products': products, 'avg_price': price}).data)
+
+
+@read_from_replicas
+async def category_list(request):
+    categories = [category async for category in Category.objects.all()]
+    return json_response(CategorySerializer(categories, many=True).data)
+
+
+async def product_detail(request, id):
+    error = await authentication_error(request)
+    if error is not None:
+        return error
+    version = await sync_to_async(detail_cache.product_version)(id)
+    etag = detail_cache.product_etag(id, version)
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        metrics.incr('product_detail.not_modified')
+        response = HttpResponseNotModified()
+    else:
+        body = await sync_to_async(detail_cache.get_rendered)(id, version)
+        if body is None:
+            # Django 4.2's async ORM runs every query on one shared thread, so the two do not overlap.
+            product = await Product.objects.filter(id=id).afirst()
+            comments = await alist(detail_comments(id))
+            if product is None:
+                return json_response({'detail': 'Not found.'}, status.HTTP_404_NOT_FOUND)
+            body = FastJSONRenderer().render(detail_data(id, product, comments))
+            await sync_to_async(detail_cache.set_rendered)(id, version, body)
+        response = HttpResponse(body, content_type='application/json', status=status.HTTP_200_OK)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+async def alist(queryset):
+    return [item async for item in queryset]
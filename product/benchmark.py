@@ -0,0 +1,80 @@
+"""
+Helpers shared by the ``bench_*`` management commands. Benchmarks run against a
+throwaway test database, never against the configured one.
+"""
+import random
+import statistics
+import time
+from contextlib import contextmanager
+
+from django.db import connections, DEFAULT_DB_ALIAS
+
+from user.models import Vendor
+from .models import Category, Product
+
+WORDS = (
+    'red blue green black white steel wooden leather cotton wireless portable compact classic '
+    'vintage modern smart electric organic premium lightweight waterproof handmade shoe jacket '
+    'lamp chair table phone charger cable speaker headphones backpack bottle watch mug knife '
+    'pillow blanket camera keyboard mouse monitor desk shelf rug candle soap tea coffee'
+).split()
+
+# A long tail of made-up brand/model words, so searches are not all for a handful of common terms.
+SYLLABLES = 'ka lo mi ne ru sa ti vo ze bri dan fel gor hux jin kel mor nix pol qua rev sol tor vex'.split()
+TAIL_WORDS = [a + b + c for a in SYLLABLES for b in SYLLABLES for c in SYLLABLES][:10000]
+
+
+@contextmanager
+def benchmark_database(alias=DEFAULT_DB_ALIAS, verbosity=0):
+    connection = connections[alias]
+    old_name = connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity)
+
+
+def random_text(rng, words):
+    return ' '.join([rng.choice(TAIL_WORDS)] + [rng.choice(WORDS) for _ in range(words - 1)])
+
+
+def seed_catalog(products, categories=20, batch_size=5000, seed=0):
+    """
+    Grow the catalog to `products` rows of random products, spread over
+    `categories` categories and one vendor. Returns the category ids.
+    """
+    rng = random.Random(seed + Product.objects.count())
+    vendor = Vendor.objects.filter(email='bench@example.com').first() or Vendor.objects.create(
+        email='bench@example.com', name='Bench', second_name='Vendor', phone_number='0', description='bench'
+    )
+    category_ids = list(Category.objects.values_list('id', flat=True)[:categories])
+    for index in range(len(category_ids), categories):
+        category_ids.append(Category.objects.create(name=f'Category {index}').id)
+    missing = products - Product.objects.count()
+    while missing > 0:
+        batch = min(batch_size, missing)
+        Product.objects.bulk_create([
+            Product(
+                vendor=vendor,
+                category_id=rng.choice(category_ids),
+                name=random_text(rng, 3),
+                description=random_text(rng, 12),
+                price=rng.randint(1, 1000),
+            )
+            for _ in range(batch)
+        ])
+        missing -= batch
+    return category_ids
+
+
+def measure(func, repeat):
+    """
+    Call `func` `repeat` times and return (median, p95) wall time in milliseconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[min(len(timings) - 1, int(len(timings) * 0.95))]
@@ -0,0 +1,66 @@
+"""
+Cart contents, changed one item at a time.
+
+Every change is one statement on a CartItem row, never a rewrite of the cart.
+Quantities are changed with F() expressions in the UPDATE itself, so two
+requests adding the same product at once both count; only the first add of a
+product inserts its row, and an insert that loses the race to a concurrent one
+becomes an update. Adds stop at CART_MAX_QUANTITY of a product, in the UPDATE as
+well, so repeated adds cannot overflow the column.
+"""
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Coalesce, Least
+
+from .models import Cart, CartItem
+
+
+def cart_id_of(customer_id):
+    return Cart.objects.filter(customer_id=customer_id).values_list('id', flat=True).first()
+
+
+def _upsert(cart_id, product_id, quantity, value):
+    items = CartItem.objects.filter(cart_id=cart_id, product_id=product_id)
+    if items.update(quantity=value):
+        return
+    try:
+        with transaction.atomic():
+            CartItem.objects.create(cart_id=cart_id, product_id=product_id, quantity=quantity)
+    except IntegrityError:
+        # Inserted by a concurrent request since the update found nothing.
+        items.update(quantity=value)
+
+
+def add_item(cart_id, product_id, quantity=1):
+    quantity = min(quantity, settings.CART_MAX_QUANTITY)
+    _upsert(cart_id, product_id, quantity, Least(F('quantity') + quantity, settings.CART_MAX_QUANTITY))
+
+
+def set_quantity(cart_id, product_id, quantity):
+    """
+    Set how many of the product are in the cart; 0 removes it.
+    """
+    if not quantity:
+        remove_item(cart_id, product_id)
+        return
+    _upsert(cart_id, product_id, quantity, quantity)
+
+
+def remove_item(cart_id, product_id):
+    """
+    Take the product out of the cart. Returns whether it was in it.
+    """
+    deleted, _ = CartItem.objects.filter(cart_id=cart_id, product_id=product_id).delete()
+    return deleted > 0
+
+
+def cart_totals(cart_id):
+    """
+    The number of distinct products, of items and their total price, in one query.
+    """
+    return CartItem.objects.filter(cart_id=cart_id).aggregate(
+        products=Count('id'),
+        items=Coalesce(Sum('quantity'), 0),
+        total=Coalesce(Sum(F('quantity') * F('product__price')), 0),
+    )
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core import checks
+
+# Backends whose entries live in one process, so an invalidation does not reach the other workers.
+PROCESS_LOCAL_CACHES = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+@checks.register(checks.Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    The product detail versions and the listing counts are invalidated in the cache
+    by the process that writes, which only reaches the others through a shared cache.
+    """
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if backend not in PROCESS_LOCAL_CACHES:
+        return []
+    return [checks.Warning(
+        f'The default cache ({backend}) is not shared between worker processes.',
+        hint='Product detail responses and ETags, and listing counts, stay stale in every process but the '
+             'one that wrote, until they expire. Use a shared backend such as Redis or Memcached.',
+        obj="CACHES['default']",
+        id='product.W001',
+    )]
@@ -0,0 +1,90 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connections, router, transaction
+
+
+def _generation_key(model):
+    return f'count-generation:{model._meta.label_lower}'
+
+
+def _generation(model):
+    key = _generation_key(model)
+    generation = cache.get(key)
+    if generation is None:
+        # Seed from the clock so a generation lost to eviction never collides with an older one.
+        cache.add(key, time.time_ns(), None)
+        generation = cache.get(key)
+    return generation
+
+
+def invalidate(model):
+    """
+    Drop every cached count for `model` once the current transaction commits, so a
+    concurrent reader cannot cache a pre-commit count under the new generation.
+    Counts are keyed by a per-model generation, so bumping it orphans all old entries at once.
+    """
+    key = _generation_key(model)
+
+    def bump():
+        try:
+            cache.incr(key)
+        except ValueError:
+            pass
+
+    transaction.on_commit(bump)
+
+
+def cached_count(queryset):
+    """
+    Exact COUNT(*) for `queryset`, cached per (model, filter) until the next write to the model.
+    """
+    queryset = queryset.order_by()
+    sql, params = queryset.query.sql_with_params()
+    digest = hashlib.md5(f'{sql}|{params!r}'.encode()).hexdigest()
+    key = f'count:{queryset.model._meta.label_lower}:{_generation(queryset.model)}:{digest}'
+    count = cache.get(key)
+    if count is None:
+        # Counted on the primary: a lagging replica would cache a stale count under the new generation.
+        count = queryset.using(router.db_for_write(queryset.model)).count()
+        cache.set(key, count, settings.COUNT_CACHE_TIMEOUT)
+    return count
+
+
+def estimated_count(model):
+    """
+    Row count of `model`'s table from the database statistics, without scanning it.
+    Returns None when no estimate is available (e.g. SQLite before ANALYZE).
+    """
+    connection = connections[router.db_for_read(model)]
+    table = model._meta.db_table
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+            elif connection.vendor == 'sqlite':
+                cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table])
+            else:
+                return None
+            row = cursor.fetchone()
+    except DatabaseError:
+        return None
+    if row is None or row[0] is None:
+        return None
+    estimate = int(str(row[0]).split()[0])
+    return estimate if estimate >= 0 else None
+
+
+def row_count(queryset, estimated=False):
+    """
+    Count rows for a listing. With `estimated`, an unfiltered count over a table
+    larger than COUNT_ESTIMATE_THRESHOLD comes from the database statistics;
+    everything else is an exact, cached count.
+    """
+    if estimated and not queryset.query.where:
+        estimate = estimated_count(queryset.model)
+        if estimate is not None and estimate >= settings.COUNT_ESTIMATE_THRESHOLD:
+            return estimate
+    return cached_count(queryset)
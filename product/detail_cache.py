@@ -0,0 +1,62 @@
+"""
+Versioned cache for rendered product detail responses.
+
+Every product has a version number in the cache that is bumped whenever the product
+or one of its comments changes. The version doubles as a strong ETag, and rendered
+response bodies are cached under (product id, version), so a bump invalidates
+both at once and a hit needs neither the ORM nor the serializer.
+
+Bumps delete the version in the cache, so they reach other worker processes only
+through a shared cache backend; see the product.W001 deploy check.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from market import metrics
+
+
+def _version_key(product_id):
+    return f'product-version:{product_id}'
+
+
+def product_version(product_id):
+    key = _version_key(product_id)
+    version = cache.get(key)
+    if version is None:
+        # Seed from the clock so a version lost to eviction or expiry never repeats an older one.
+        # It expires with the bodies, which bounds how long a process that missed a bump serves them.
+        cache.add(key, time.time_ns(), settings.PRODUCT_DETAIL_CACHE_TIMEOUT)
+        version = cache.get(key)
+    return version
+
+
+def bump_versions(product_ids):
+    """
+    Invalidate the cached detail of `product_ids` once the current transaction
+    commits, so a concurrent reader cannot cache pre-commit data under the new version.
+    """
+    keys = [_version_key(product_id) for product_id in product_ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def product_etag(product_id, version):
+    return f'"{product_id}-{version}"'
+
+
+def get_rendered(product_id, version):
+    body = cache.get(f'product-detail:{product_id}:{version}')
+    metrics.incr('product_detail.hits' if body is not None else 'product_detail.misses')
+    return body
+
+
+def set_rendered(product_id, version, body):
+    cache.set(f'product-detail:{product_id}:{version}', body, settings.PRODUCT_DETAIL_CACHE_TIMEOUT)
+
+
+def cache_stats():
+    counters = metrics.snapshot('product_detail.hits', 'product_detail.misses', 'product_detail.not_modified')
+    counters['hit_rate'] = metrics.hit_rate(counters['product_detail.hits'], counters['product_detail.misses'])
+    return counters
@@ -0,0 +1,81 @@
+"""
+Streaming catalog export.
+
+Rows are read with ``values_list().iterator()`` and encoded in batches into blocks
+of bytes, optionally gzipped on the fly, so an export holds one batch in memory
+however large the catalog is.
+"""
+import csv
+import io
+import zlib
+from itertools import islice
+
+from django.conf import settings
+
+from market.renderers import write_json
+
+# Same keys and order as ProductSerializer.
+EXPORT_FIELDS = ('id', 'vendor', 'category', 'name', 'description', 'price', 'comment_count')
+EXPORT_COLUMNS = ('id', 'vendor_id', 'category_id', 'name', 'description', 'price', 'comment_count')
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+BATCH_SIZE = 1000
+
+
+def _batches(rows):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, BATCH_SIZE))
+        if not batch:
+            return
+        yield batch
+
+
+def csv_blocks(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for batch in _batches(rows):
+        writer.writerows(batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def ndjson_blocks(rows):
+    buffer = io.BytesIO()
+    for batch in _batches(rows):
+        for row in batch:
+            write_json(dict(zip(EXPORT_FIELDS, row)), buffer)
+            buffer.write(b'\n')
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def gzip_blocks(blocks, level=1):
+    # Level 1 compresses catalog text several times faster than the default 6, for 25-40% larger output.
+    compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for block in blocks:
+        data = compressor.compress(block)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_products(queryset, output='csv', compress=False, chunk_size=None):
+    """
+    Encode the products of `queryset`, in its ordering, as CSV or NDJSON. Returns an
+    iterator of bytes; nothing is read from the database until it is consumed.
+    """
+    rows = queryset.values_list(*EXPORT_COLUMNS).iterator(chunk_size=chunk_size or settings.PRODUCT_EXPORT_CHUNK_SIZE)
+    blocks = csv_blocks(rows) if output == 'csv' else ndjson_blocks(rows)
+    return gzip_blocks(blocks) if compress else blocks
+
+
+def export_filename(output, compress=False):
+    return f'products.{output}' + ('.gz' if compress else '')
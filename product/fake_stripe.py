@@ -0,0 +1,100 @@
+"""
+A local stand-in for the part of the Stripe API the payment flow uses, so payments
+can be exercised and load-tested offline. It answers POST /v1/payment_intents with
+Stripe-shaped objects, honours Idempotency-Key like Stripe does, and can add
+latency and random server errors.
+"""
+import json
+import random
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+
+class FakeStripeHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so clients can reuse connections as they do with Stripe.
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, data, replayed=False):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Request-Id', 'req_' + secrets.token_hex(8))
+        if replayed:
+            self.send_header('Idempotent-Replayed', 'true')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+        if self.path != '/v1/payment_intents':
+            self.send_json(404, {'error': {'type': 'invalid_request_error', 'message': f'Unrecognized request URL '
+                                                                                       f'(POST: {self.path}).'}})
+            return
+        server = self.server
+        key = self.headers.get('Idempotency-Key')
+        with server.lock:
+            stored = server.responses.get(key) if key else None
+        if stored is not None:
+            self.send_json(*stored, replayed=True)
+            return
+        time.sleep(server.latency)
+        if server.rng.random() < server.failure_rate:
+            # Like Stripe, server errors are not stored under the idempotency key.
+            self.send_json(500, {'error': {'type': 'api_error', 'message': 'Simulated server error.'}})
+            return
+        params = dict(parse_qsl(body))
+        intent_id = 'pi_' + secrets.token_hex(12)
+        intent = {
+            'id': intent_id,
+            'object': 'payment_intent',
+            'amount': int(params.get('amount', 0)),
+            'currency': params.get('currency', 'usd'),
+            'status': 'requires_payment_method',
+            'client_secret': f'{intent_id}_secret_{secrets.token_hex(12)}',
+            'livemode': False,
+            'metadata': {name[len('metadata['):-1]: value for name, value in params.items()
+                         if name.startswith('metadata[')},
+        }
+        with server.lock:
+            if key:
+                server.responses.setdefault(key, (200, intent))
+                status, intent = server.responses[key]
+            server.created += 1
+        self.send_json(200, intent)
+
+
+class FakeStripeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, failure_rate=0.0, seed=None, verbose=False):
+        super().__init__(address, FakeStripeHandler)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.responses = {}
+        self.created = 0
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+
+def start_fake_stripe(host='127.0.0.1', port=0, **options):
+    """
+    Serve a FakeStripeServer from a daemon thread. Call ``shutdown()`` and
+    ``server_close()`` on the returned server to stop it.
+    """
+    server = FakeStripeServer((host, port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
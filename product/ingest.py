@@ -0,0 +1,358 @@
+"""
+Streaming bulk ingestion and update of products.
+
+Rows are decoded one at a time from an NDJSON or JSON-array request body,
+validated and inserted in chunks, so memory is bounded by the chunk size rather
+than the size of the upload.
+"""
+import codecs
+import json
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from rest_framework.exceptions import ValidationError
+from rest_framework.serializers import as_serializer_error
+
+from . import counts, detail_cache
+from .models import Category, Product
+from .serializers import ProductBulkPatchSerializer, ProductBulkRowSerializer
+from .stats import apply_price_changes, apply_vendor_price_changes
+
+READ_SIZE = 64 * 1024
+MAX_ROW_SIZE = 1024 * 1024
+
+
+class RowError(ValueError):
+    pass
+
+
+def _read_text(stream):
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='strict')
+    while True:
+        chunk = stream.read(READ_SIZE)
+        if not chunk:
+            tail = decoder.decode(b'', final=True)
+            if tail:
+                yield tail
+            return
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+
+
+def _ndjson_rows(buffer, texts):
+    while True:
+        newline = buffer.find('\n')
+        oversized = False
+        while newline == -1:
+            if len(buffer) > MAX_ROW_SIZE:
+                # Drop what was read of the row and skip to its end.
+                oversized, buffer = True, ''
+            text = next(texts, None)
+            if text is None:
+                break
+            buffer += text
+            newline = buffer.find('\n')
+        line, buffer = (buffer, '') if newline == -1 else (buffer[:newline], buffer[newline + 1:])
+        if oversized or len(line) > MAX_ROW_SIZE:
+            yield RowError(f'Row longer than {MAX_ROW_SIZE} characters.')
+        elif line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError as error:
+                yield RowError(f'Invalid JSON: {error}')
+        if newline == -1:
+            return
+
+
+def _skip_item(buffer, position, texts):
+    """
+    Skip the array item that starts at `position` without decoding it, for items
+    too long to buffer. Returns the buffer and the position of the "," or "]" after it.
+    """
+    depth, in_string, escaped = 0, False, False
+    while True:
+        for index in range(position, len(buffer)):
+            char = buffer[index]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == '\\':
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+            elif char == '"':
+                in_string = True
+            elif char in '[{':
+                depth += 1
+            elif char in ']}':
+                if not depth:
+                    return buffer, index
+                depth -= 1
+            elif char == ',' and not depth:
+                return buffer, index
+        text = next(texts, None)
+        if text is None:
+            raise RowError('Unterminated JSON array.')
+        buffer, position = text, 0
+
+
+def _array_rows(buffer, texts):
+    decoder = json.JSONDecoder()
+    position = 1
+    expect_value = True
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n':
+            position += 1
+        if position >= len(buffer):
+            text = next(texts, None)
+            if text is None:
+                raise RowError('Unterminated JSON array.')
+            buffer, position = buffer[position:] + text, 0
+            continue
+        if buffer[position] == ']':
+            return
+        if not expect_value:
+            if buffer[position] != ',':
+                raise RowError('Expected "," between array items.')
+            position, expect_value = position + 1, True
+            continue
+        try:
+            row, end = decoder.raw_decode(buffer, position)
+        except ValueError:
+            if len(buffer) - position > MAX_ROW_SIZE:
+                buffer, position = _skip_item(buffer, position, texts)
+                expect_value = False
+                yield RowError(f'Row longer than {MAX_ROW_SIZE} characters.')
+                continue
+            text = next(texts, None)
+            if text is None:
+                raise RowError('Invalid JSON array item.')
+            buffer, position = buffer[position:] + text, 0
+            continue
+        # A number at the very end of the buffer may continue in the next read.
+        if end == len(buffer) and not isinstance(row, (dict, list, str)):
+            text = next(texts, None)
+            if text is not None:
+                buffer, position = buffer[position:] + text, 0
+                continue
+        yield row
+        buffer, position, expect_value = buffer[end:], 0, False
+
+
+def iter_rows(stream):
+    """
+    Yield the rows of an NDJSON body, or of a body holding one JSON array. A row
+    that cannot be decoded or is longer than MAX_ROW_SIZE is yielded as a
+    RowError; a body whose structure is broken raises RowError.
+    """
+    texts = _read_text(stream)
+    buffer = ''
+    for text in texts:
+        buffer += text
+        if buffer.strip():
+            break
+    buffer = buffer.lstrip()
+    if not buffer:
+        return
+    if buffer[0] == '[':
+        yield from _array_rows(buffer, texts)
+    else:
+        yield from _ndjson_rows(buffer, texts)
+
+
+class BulkResult:
+
+    def __init__(self, action, max_errors):
+        self.action = action
+        self.done = 0
+        self.failed = 0
+        self.errors = []
+        self.max_errors = max_errors
+
+    def add_error(self, row, errors, **extra):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append(dict(row=row, **extra, errors=errors))
+
+    def as_dict(self):
+        return {
+            self.action: self.done,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+        }
+
+
+def process_rows(stream, validator, process_chunk, result, chunk_size):
+    """
+    Validate the rows of `stream` with `validator` and hand them to `process_chunk`
+    as lists of (row number, validated data), `chunk_size` rows at a time.
+    """
+    chunk = []
+    try:
+        for row, data in enumerate(iter_rows(stream), start=1):
+            if isinstance(data, RowError):
+                result.add_error(row, {'non_field_errors': [str(data)]})
+                continue
+            try:
+                chunk.append((row, validator.run_validation(data)))
+            except ValidationError as error:
+                result.add_error(row, as_serializer_error(error))
+                continue
+            if len(chunk) >= chunk_size:
+                process_chunk(chunk, result)
+                chunk = []
+    except (RowError, UnicodeDecodeError) as error:
+        result.add_error(None, {'non_field_errors': [str(error)]})
+    if chunk:
+        process_chunk(chunk, result)
+
+
+def _known_categories(category_ids):
+    return set(Category.objects.filter(id__in=category_ids).values_list('id', flat=True))
+
+
+def _category_error(category_id):
+    return {'category': [f'Invalid pk "{category_id}" - object does not exist.']}
+
+
+def _insert_chunk(chunk, vendor_id, result):
+    known = _known_categories({data['category'] for _, data in chunk})
+    rows, products = [], []
+    for row, data in chunk:
+        if data['category'] not in known:
+            result.add_error(row, _category_error(data['category']))
+            continue
+        rows.append(row)
+        products.append(Product(
+            vendor_id=vendor_id,
+            category_id=data['category'],
+            name=data['name'],
+            description=data['description'],
+            price=data['price'],
+        ))
+    if not products:
+        return
+    try:
+        with transaction.atomic():
+            Product.objects.bulk_create(products)
+            apply_price_changes(added=[(product.category_id, product.price) for product in products])
+            apply_vendor_price_changes(added=[(vendor_id, product.price) for product in products])
+    except DatabaseError as error:
+        for row in rows:
+            result.add_error(row, {'non_field_errors': [str(error)]})
+        return
+    result.done += len(products)
+
+
+def ingest_products(stream, vendor_id, chunk_size=None, max_errors=None):
+    """
+    Validate and insert every row of `stream` for `vendor_id`. Invalid rows are
+    reported and skipped; each chunk of valid rows is inserted in its own transaction.
+    Rows are numbered from 1.
+    """
+    result = BulkResult('created', settings.PRODUCT_BULK_MAX_ERRORS if max_errors is None else max_errors)
+    # One serializer validates every row: building its fields is most of the cost of a fresh instance.
+    process_rows(stream, ProductBulkRowSerializer(), lambda chunk, result: _insert_chunk(chunk, vendor_id, result),
+                 result, chunk_size or settings.PRODUCT_BULK_CHUNK_SIZE)
+    if result.done:
+        counts.invalidate(Product)
+    return result
+
+
+class IdBitmap:
+    """
+    A set of non-negative ids, one bit each, so its size is bounded by the largest id
+    added rather than by how many rows an upload has.
+    """
+
+    def __init__(self):
+        self.bits = bytearray()
+
+    def __contains__(self, id):
+        byte = id >> 3
+        return 0 <= byte < len(self.bits) and bool(self.bits[byte] >> (id & 7) & 1)
+
+    def add(self, id):
+        byte = id >> 3
+        if byte >= len(self.bits):
+            self.bits.extend(bytes(byte + 1 - len(self.bits)))
+        self.bits[byte] |= 1 << (id & 7)
+
+
+def _update_chunk(chunk, vendor_id, seen, result):
+    patches = {}
+    for row, data in chunk:
+        # `seen` holds the existing ids of earlier chunks, so a repeat in a later chunk is caught too.
+        if data['id'] in patches or data['id'] in seen:
+            result.add_error(row, {'id': [f'Product {data["id"]} is patched more than once in this upload.']},
+                             id=data['id'], conflict=True)
+            continue
+        patches[data['id']] = (row, data)
+    fields = sorted({field for _, data in patches.values() for field in data if field != 'id'})
+    products, checked = [], False
+    try:
+        # The stored owner, category and price are read in the write transaction, so no
+        # write can land between the checks and deltas computed from them and the update.
+        with transaction.atomic():
+            # Ownership, existence and the values the patches replace, for the whole chunk in one query.
+            stored = Product.objects.filter(id__in=patches).only('id', 'vendor_id', 'category_id', 'price', *fields)
+            stored = {product.id: product for product in stored}
+            known = _known_categories({data['category'] for _, data in patches.values() if 'category' in data})
+            for product_id in stored:
+                seen.add(product_id)
+            added, removed, repriced = [], [], []
+            for product_id, (row, data) in patches.items():
+                product = stored.get(product_id)
+                if product is None:
+                    result.add_error(row, {'id': [f'Product {product_id} does not exist.']}, id=product_id)
+                    continue
+                if product.vendor_id != vendor_id:
+                    result.add_error(row, {'id': [f'Product {product_id} belongs to another vendor.']},
+                                     id=product_id, conflict=True)
+                    continue
+                if 'category' in data and data['category'] not in known:
+                    result.add_error(row, _category_error(data['category']), id=product_id)
+                    continue
+                old = (product.category_id, product.price)
+                for field, value in data.items():
+                    setattr(product, 'category_id' if field == 'category' else field, value)
+                if (product.category_id, product.price) != old:
+                    removed.append(old)
+                    added.append((product.category_id, product.price))
+                if product.price != old[1]:
+                    repriced.append((old[1], product.price))
+                products.append(product)
+            checked = True
+            if products and fields:
+                Product.objects.bulk_update(products, fields)
+                apply_price_changes(added=added, removed=removed)
+                apply_vendor_price_changes(added=[(vendor_id, new) for _, new in repriced],
+                                           removed=[(vendor_id, old) for old, _ in repriced])
+                detail_cache.bump_versions([product.id for product in products])
+    except DatabaseError as error:
+        for product_id in [product.id for product in products] if checked else patches:
+            row, _ = patches[product_id]
+            result.add_error(row, {'non_field_errors': [str(error)]}, id=product_id)
+        return
+    result.done += len(products)
+
+
+def update_products(stream, vendor_id, chunk_size=None, max_errors=None):
+    """
+    Apply the partial updates in `stream`, each an object with an "id" and any of
+    "name", "description", "price" and "category", to products of `vendor_id`.
+    Each chunk is written with one bulk UPDATE in its own transaction. Unknown ids,
+    products of other vendors and ids patched twice are reported, not applied.
+    Ids already patched are remembered in a bitmap, one bit per id up to the largest
+    product id, however long the upload.
+    """
+    result = BulkResult('updated', settings.PRODUCT_BULK_MAX_ERRORS if max_errors is None else max_errors)
+    seen = IdBitmap()
+    process_rows(stream, ProductBulkPatchSerializer(partial=True),
+                 lambda chunk, result: _update_chunk(chunk, vendor_id, seen, result),
+                 result, chunk_size or settings.PRODUCT_BULK_CHUNK_SIZE)
+    if result.done:
+        counts.invalidate(Product)
+    return result
@@ -0,0 +1,53 @@
+import time
+from base64 import b64encode
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from product.benchmark import benchmark_database, seed_catalog
+from product.models import Product, Purchase
+from user.authentication import basic_auth_stats
+from user.models import Customer
+
+
+class Command(BaseCommand):
+    help = 'Compare requests/s of a Basic-authenticated endpoint with and without the verified-credential cache.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50)
+        parser.add_argument('--clients', type=int, default=5, help='Distinct credentials, each used in turn.')
+
+    def handle(self, *args, **options):
+        with benchmark_database(), override_settings(ALLOWED_HOSTS=['testserver']):
+            seed_catalog(1)
+            product = Product.objects.get()
+            paths, headers = [], []
+            for index in range(options['clients']):
+                customer = Customer.objects.create(email=f'client{index}@example.com', name='Client',
+                                                   second_name='Bench', phone_number='0', card_number='4242',
+                                                   address='Street', post_code='0')
+                customer.set_password('integration-secret')
+                customer.save()
+                paths.append(f'/api/product/purchase/{Purchase.objects.create(customer=customer, product=product).id}/')
+                credentials = b64encode(f'{customer.email}:integration-secret'.encode()).decode()
+                headers.append(f'Basic {credentials}')
+            client = APIClient()
+            for label, timeout in (('no cache', 0), ('cached', 300)):
+                with override_settings(BASIC_AUTH_CACHE_TIMEOUT=timeout):
+                    # One request per client first, so the cached run measures its steady state.
+                    for path, header in zip(paths, headers):
+                        client.get(path, HTTP_AUTHORIZATION=header)
+                    before = basic_auth_stats()
+                    started = time.perf_counter()
+                    for index in range(options['requests']):
+                        client_index = index % options['clients']
+                        response = client.get(paths[client_index], HTTP_AUTHORIZATION=headers[client_index])
+                        assert response.status_code == 200, response.content
+                    seconds = time.perf_counter() - started
+                    after = basic_auth_stats()
+                hits = after['basic_auth.hits'] - before['basic_auth.hits']
+                self.stdout.write(
+                    f'{label:<9} {options["requests"] / seconds:8.1f} req/s  '
+                    f'{seconds / options["requests"] * 1000:7.2f} ms/request  cache hits {hits}'
+                )
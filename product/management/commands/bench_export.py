@@ -0,0 +1,39 @@
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from product.benchmark import benchmark_database, seed_catalog
+from product.export import export_products
+from product.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Measure catalog export throughput and peak memory on a seeded test database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[100000, 1000000])
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            for size in sorted(options['sizes']):
+                seed_catalog(size)
+                for output in ('csv', 'ndjson'):
+                    for compress in (False, True):
+                        started = time.perf_counter()
+                        written = export_size(output, compress)
+                        seconds = time.perf_counter() - started
+                        # A second, traced pass: tracing slows the export down too much to time it.
+                        tracemalloc.start()
+                        export_size(output, compress)
+                        peak = tracemalloc.get_traced_memory()[1]
+                        tracemalloc.stop()
+                        self.stdout.write(
+                            f'{size:>9} products  {output:<6} {"gzip" if compress else "plain":<5} '
+                            f'{size / seconds:9.0f} rows/s  {written / 2 ** 20:8.1f} MiB  '
+                            f'peak python memory {peak / 2 ** 20:6.1f} MiB'
+                        )
+
+
+def export_size(output, compress):
+    return sum(len(block) for block in export_products(Product.objects.order_by('id'), output, compress))
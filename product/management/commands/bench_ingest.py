@@ -0,0 +1,55 @@
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from product.benchmark import benchmark_database, random_text, seed_catalog
+from product.models import Product
+from user.models import Vendor
+
+
+class Command(BaseCommand):
+    help = 'Compare one-request-per-product creates and updates with the bulk endpoints on a test database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=20000)
+        parser.add_argument('--single-rows', type=int, default=200)
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        with benchmark_database(), override_settings(ALLOWED_HOSTS=['testserver']):
+            category_ids = seed_catalog(0)
+            vendor = Vendor.objects.get(email='bench@example.com')
+            client = APIClient()
+            client.force_authenticate(vendor)
+
+            def row():
+                return {'category': rng.choice(category_ids), 'name': random_text(rng, 3),
+                        'description': random_text(rng, 12), 'price': rng.randrange(1, 100000)}
+
+            started = time.perf_counter()
+            for _ in range(options['single_rows']):
+                client.post('/api/product/create/', dict(row(), vendor=vendor.id), format='json')
+            self.report('create', options['single_rows'], time.perf_counter() - started)
+
+            body = '\n'.join(json.dumps(row()) for _ in range(options['rows']))
+            started = time.perf_counter()
+            response = client.post('/api/product/create/bulk/', body, content_type='application/x-ndjson')
+            self.report('bulk create', response.json()['created'], time.perf_counter() - started)
+
+            ids = list(Product.objects.filter(vendor=vendor).values_list('id', flat=True))
+            started = time.perf_counter()
+            for product_id in ids[:options['single_rows']]:
+                client.put(f'/api/product/{product_id}/update/', dict(row(), vendor=vendor.id), format='json')
+            self.report('update', options['single_rows'], time.perf_counter() - started)
+
+            body = '\n'.join(json.dumps({'id': product_id, 'price': rng.randrange(1, 100000)}) for product_id in ids)
+            started = time.perf_counter()
+            response = client.patch('/api/product/update/bulk/', body, content_type='application/x-ndjson')
+            self.report('bulk update', response.json()['updated'], time.perf_counter() - started)
+
+    def report(self, label, rows, seconds):
+        self.stdout.write(f'{label:<12} {rows:>7} rows  {seconds:7.2f} s  {rows / seconds:9.0f} rows/s')
@@ -0,0 +1,39 @@
+import io
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from market.parsers import FastJSONParser
+from market.renderers import FastJSONRenderer, orjson
+from product.benchmark import benchmark_database, measure, seed_catalog
+from product.models import Product
+from product.serializers import ProductSerializer
+
+
+class Command(BaseCommand):
+    help = 'Compare render and parse throughput of the DRF and fast JSON renderers on product list payloads.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[20, 1000, 10000])
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        if orjson is None:
+            self.stdout.write('orjson is not installed; the fast renderer is measuring the stdlib fallback.')
+        with benchmark_database():
+            seed_catalog(max(options['rows']))
+            for rows in options['rows']:
+                data = {'products': ProductSerializer(Product.objects.order_by('id')[:rows], many=True).data}
+                body = JSONRenderer().render(data)
+                if FastJSONRenderer().render(data) != body:
+                    raise CommandError('The renderers produced different output.')
+                for label, renderer, parser in (('drf', JSONRenderer(), JSONParser()),
+                                                ('fast', FastJSONRenderer(), FastJSONParser())):
+                    render, _ = measure(lambda: renderer.render(data), options['repeat'])
+                    parse, _ = measure(lambda: parser.parse(io.BytesIO(body)), options['repeat'])
+                    self.stdout.write(
+                        f'{rows:>6} products  {len(body) / 1024:8.1f} KiB  {label:<4}  '
+                        f'render {render:8.3f} ms ({len(body) / render / 1000:7.1f} MB/s)  '
+                        f'parse {parse:8.3f} ms'
+                    )
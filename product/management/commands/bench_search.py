@@ -0,0 +1,41 @@
+import random
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from product.benchmark import TAIL_WORDS, WORDS, benchmark_database, measure, seed_catalog
+from product.models import Product
+from product.search import search_products
+
+
+class Command(BaseCommand):
+    help = 'Compare FTS5 product search with icontains filtering on a seeded test database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[100000, 1000000])
+        parser.add_argument('--queries', type=int, default=50)
+        parser.add_argument('--page-size', type=int, default=20)
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        page_size = options['page_size']
+        with benchmark_database():
+            for size in sorted(options['sizes']):
+                seed_catalog(size)
+                for kind, pool in (('common', WORDS), ('rare', TAIL_WORDS)):
+                    terms = [rng.choice(pool) for _ in range(options['queries'])]
+                    for label, func in (('fts5', search_fts), ('icontains', search_icontains)):
+                        queries = iter(terms)
+                        median, p95 = measure(lambda: func(next(queries), page_size), len(terms))
+                        self.stdout.write(
+                            f'{size:>9} products  {kind:<6} terms  {label:<10} '
+                            f'median {median:8.2f} ms  p95 {p95:8.2f} ms'
+                        )
+
+
+def search_fts(term, page_size):
+    search_products(term, limit=page_size)
+
+
+def search_icontains(term, page_size):
+    list(Product.objects.filter(Q(name__icontains=term) | Q(description__icontains=term)).order_by('id')[:page_size])
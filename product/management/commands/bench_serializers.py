@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.serializers import ListSerializer
+
+from product.benchmark import benchmark_database, measure, seed_catalog
+from product.models import Product
+from product.serializers import ProductSerializer
+
+
+class Command(BaseCommand):
+    help = 'Compare per-row cost of ModelSerializer lists with the values()-based product list path.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=10)
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        renderer = JSONRenderer()
+        with benchmark_database():
+            seed_catalog(rows)
+
+            def queryset():
+                # A fresh queryset per call, so neither path is served from a result cache.
+                return Product.objects.order_by('id')[:rows]
+
+            instances = list(queryset())
+            cases = (
+                ('queryset', 'model serializer', lambda: ListSerializer(queryset(), child=ProductSerializer()).data),
+                ('queryset', 'values list', lambda: ProductSerializer(queryset(), many=True).data),
+                ('instances', 'model serializer', lambda: ListSerializer(instances, child=ProductSerializer()).data),
+                ('instances', 'values list', lambda: ProductSerializer(instances, many=True).data),
+            )
+            rendered = {renderer.render(func()) for _, _, func in cases}
+            if len(rendered) != 1:
+                raise CommandError('The serializers rendered different output.')
+            for source, label, func in cases:
+                median, p95 = measure(func, options['repeat'])
+                self.stdout.write(
+                    f'{rows:>7} rows from {source:<9}  {label:<16}  median {median:8.2f} ms  '
+                    f'{median * 1000 / rows:6.2f} us/row  p95 {p95:8.2f} ms'
+                )
@@ -0,0 +1,120 @@
+import multiprocessing
+import random
+import statistics
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, OperationalError, close_old_connections, connection, connections, transaction
+from django.test.utils import override_settings
+
+from product.benchmark import benchmark_database, seed_catalog
+from product.models import Comment, Product
+from user.models import Customer
+
+CONFIGURATIONS = (
+    # label, pragmas, transaction mode, CONN_MAX_AGE
+    ('defaults', {'journal_mode': 'delete'}, 'DEFERRED', 0),
+    ('tuned, reconnecting', None, 'IMMEDIATE', 0),
+    ('tuned, persistent', None, 'IMMEDIATE', 600),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure mixed read/write throughput of worker processes sharing one SQLite file, with SQLite '
+        'and Django defaults and with SQLITE_PRAGMAS, immediate transactions and persistent connections.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=20000)
+        parser.add_argument('--workers', type=int, default=8, help='Worker processes, like gunicorn workers.')
+        parser.add_argument('--seconds', type=float, default=5)
+        parser.add_argument('--write-ratio', type=float, default=0.2, help='Share of requests that write.')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            connection.settings_dict['TEST']['NAME'] = f'{directory}/bench.sqlite3'
+            with benchmark_database():
+                category_ids = seed_catalog(options['products'])
+                customer_ids = [
+                    Customer.objects.create(email=f'bench{index}@example.com', name='Bench', second_name='Customer',
+                                            phone_number='0', card_number='4242', address='Street',
+                                            post_code='0').id
+                    for index in range(50)
+                ]
+                product_ids = list(Product.objects.values_list('id', flat=True))
+                for label, pragmas, mode, max_age in CONFIGURATIONS:
+                    pragmas = settings.SQLITE_PRAGMAS if pragmas is None else pragmas
+                    with override_settings(SQLITE_PRAGMAS=pragmas):
+                        connection.settings_dict['OPTIONS'] = dict(connection.settings_dict['OPTIONS'],
+                                                                   transaction_mode=mode)
+                        connection.settings_dict['CONN_MAX_AGE'] = max_age
+                        # Pragmas such as journal_mode persist in the file; set them before the workers start.
+                        connections.close_all()
+                        connection.ensure_connection()
+                        connections.close_all()
+                        results = run_workers(options, category_ids, product_ids, customer_ids)
+                    self.report(label, options['seconds'], results)
+
+    def report(self, label, seconds, results):
+        latencies = sorted(latency for result in results for latency in result['latencies'])
+        reads, writes = sum(r['reads'] for r in results), sum(r['writes'] for r in results)
+        errors = sum(r['errors'] for r in results)
+        self.stdout.write(
+            f'{label:<20} {reads / seconds:8.0f} reads/s  {writes / seconds:7.0f} writes/s  '
+            f'p50 {statistics.median(latencies):6.2f} ms  p99 {latencies[int(len(latencies) * 0.99)]:7.2f} ms  '
+            f'locked errors {errors}'
+        )
+
+
+def run_workers(options, category_ids, product_ids, customer_ids):
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    workers = [
+        context.Process(target=work, args=(queue, seed, options, category_ids, product_ids, customer_ids))
+        for seed in range(options['workers'])
+    ]
+    for worker in workers:
+        worker.start()
+    results = [queue.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    return results
+
+
+def work(queue, seed, options, category_ids, product_ids, customer_ids):
+    rng = random.Random(seed)
+    result = {'reads': 0, 'writes': 0, 'errors': 0, 'latencies': []}
+    deadline = time.perf_counter() + options['seconds']
+    while time.perf_counter() < deadline:
+        write = rng.random() < options['write_ratio']
+        started = time.perf_counter()
+        # What Django does around every request: reuse or drop the connection per CONN_MAX_AGE.
+        close_old_connections()
+        try:
+            if write:
+                comment(rng, product_ids, customer_ids)
+            else:
+                product_page(rng, category_ids)
+        except OperationalError:
+            result['errors'] += 1
+        else:
+            result['writes' if write else 'reads'] += 1
+        close_old_connections()
+        result['latencies'].append((time.perf_counter() - started) * 1000)
+    connections[DEFAULT_DB_ALIAS].close()
+    queue.put(result)
+
+
+def product_page(rng, category_ids):
+    products = Product.objects.filter(category_id=rng.choice(category_ids)).order_by('price', 'id')
+    list(products.values('id', 'name', 'price')[:20])
+
+
+def comment(rng, product_ids, customer_ids):
+    # Reads the product, then writes: under deferred transactions this is the lock upgrade that fails.
+    with transaction.atomic():
+        product = Product.objects.get(id=rng.choice(product_ids))
+        Comment.objects.create(comment='bench', customer_id=rng.choice(customer_ids), product=product)
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from product.stats import find_comment_count_drift
+
+
+class Command(BaseCommand):
+    help = 'Check the comment count stored on every product against the comment table.'
+
+    def handle(self, *args, **options):
+        drift = find_comment_count_drift()
+        for product_id, (stored, expected) in sorted(drift.items()):
+            self.stderr.write(f'product {product_id}: stored comment count = {stored}, expected {expected}')
+        if drift:
+            raise CommandError(
+                f'Comment counts drifted for {len(drift)} products; run "manage.py rebuild_comment_counts".'
+            )
+        self.stdout.write(self.style.SUCCESS('Comment counts are consistent.'))
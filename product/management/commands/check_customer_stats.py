@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from product.stats import find_customer_stats_drift
+
+
+class Command(BaseCommand):
+    help = 'Check the per-customer purchase summaries against the purchase table.'
+
+    def handle(self, *args, **options):
+        drift = find_customer_stats_drift()
+        for customer_id, (stored, expected) in sorted(drift.items()):
+            self.stderr.write(
+                f'customer {customer_id}: stored (purchases, total spent) = {stored}, expected {expected}'
+            )
+        if drift:
+            raise CommandError(
+                f'Customer stats drifted for {len(drift)} customers; run "manage.py rebuild_customer_stats".'
+            )
+        self.stdout.write(self.style.SUCCESS('Customer stats are consistent.'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from product.stats import find_price_stats_drift
+
+
+class Command(BaseCommand):
+    help = 'Check the per-category price stats table against the product table.'
+
+    def handle(self, *args, **options):
+        drift = find_price_stats_drift()
+        for category_id, (stored, expected) in sorted(drift.items()):
+            self.stderr.write(
+                f'category {category_id}: stored (count, sum, min, max) = {stored}, expected {expected}'
+            )
+        if drift:
+            raise CommandError(
+                f'Price stats drifted for {len(drift)} categories; run "manage.py rebuild_price_stats".'
+            )
+        self.stdout.write(self.style.SUCCESS('Price stats are consistent.'))
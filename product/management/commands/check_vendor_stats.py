@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from product.stats import find_vendor_stats_drift
+
+
+class Command(BaseCommand):
+    help = 'Check the per-vendor storefront stats against the product, purchase and comment tables.'
+
+    def handle(self, *args, **options):
+        drift = find_vendor_stats_drift()
+        for vendor_id, (stored, expected) in sorted(drift.items()):
+            self.stderr.write(
+                f'vendor {vendor_id}: stored (count, sum, min, max, purchases, comments) = {stored}, '
+                f'expected {expected}'
+            )
+        if drift:
+            raise CommandError(f'Vendor stats drifted for {len(drift)} vendors; run "manage.py rebuild_vendor_stats".')
+        self.stdout.write(self.style.SUCCESS('Vendor stats are consistent.'))
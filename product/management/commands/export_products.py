@@ -0,0 +1,47 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.http import QueryDict
+
+from product.export import EXPORT_FORMATS, export_products
+from product.models import Product
+from product.views import ProductExportFilter
+
+
+class Command(BaseCommand):
+    help = 'Stream the product catalog to a file or stdout as CSV or NDJSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', default='-', help='Output path; "-" writes to stdout.')
+        parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--vendor', type=int)
+        parser.add_argument('--filter', action='append', default=[], metavar='NAME=VALUE',
+                            help='A product list filter, e.g. category=3 or price_max=100. Repeatable.')
+        parser.add_argument('--chunk-size', type=int)
+
+    def handle(self, *args, **options):
+        params = QueryDict(mutable=True)
+        for item in options['filter']:
+            name, sep, value = item.partition('=')
+            if not sep:
+                raise CommandError(f'Filters are NAME=VALUE, got "{item}".')
+            params.appendlist(name, value)
+        if options['vendor'] is not None:
+            params['vendor'] = options['vendor']
+        filterset = ProductExportFilter(params, queryset=Product.objects.all())
+        if not filterset.is_valid():
+            raise CommandError(filterset.errors.as_text())
+
+        blocks = export_products(filterset.qs, options['format'], options['gzip'], options['chunk_size'])
+        out = sys.stdout.buffer if options['file'] == '-' else open(options['file'], 'wb')
+        try:
+            size = 0
+            for block in blocks:
+                out.write(block)
+                size += len(block)
+        finally:
+            if out is not sys.stdout.buffer:
+                out.close()
+        if options['file'] != '-':
+            self.stdout.write(self.style.SUCCESS(f'Wrote {size} bytes to {options["file"]}.'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from product.fake_stripe import FakeStripeServer
+
+
+class Command(BaseCommand):
+    help = 'Serve a local stand-in for the Stripe payment intents API; set STRIPE_API_BASE to its URL.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=12111)
+        parser.add_argument('--latency', type=float, default=0, help='Milliseconds added to every new intent.')
+        parser.add_argument('--failure-rate', type=float, default=0, help='Share of requests answered with a 500.')
+
+    def handle(self, *args, **options):
+        server = FakeStripeServer((options['host'], options['port']), latency=options['latency'] / 1000,
+                                  failure_rate=options['failure_rate'], verbose=options['verbosity'] > 1)
+        self.stdout.write(f'Fake Stripe API listening on {server.url}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,166 @@
+import asyncio
+import io
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.test.utils import override_settings
+
+from product.benchmark import benchmark_database, seed_catalog
+from product.models import Category, Product
+from user.models import Vendor
+from user.serializers import MyTokenObtainPairSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        'Load-test the catalog endpoints in one process: sync views behind a threaded WSGI worker, '
+        'sync views behind ASGI, and the async views behind ASGI.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[8, 64, 256])
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--threads', type=int, default=8, help='Worker threads of the WSGI process.')
+        parser.add_argument('--client-latency', type=float, default=100,
+                            help='Milliseconds each client waits between its requests, outside the server.')
+
+    def handle(self, *args, **options):
+        with benchmark_database(), override_settings(DEBUG=False, ALLOWED_HOSTS=['testserver']):
+            paths = self.seed(options['products'])
+            vendor = Vendor.objects.get(email='bench@example.com')
+            token = str(MyTokenObtainPairSerializer.get_token(vendor).access_token)
+            headers = [(b'authorization', f'Bearer {token}'.encode())]
+            total, threads, latency = options['requests'], options['threads'], options['client_latency'] / 1000
+            for concurrency in options['concurrency']:
+                for label, run in (
+                    (f'wsgi x{threads} sync',
+                     lambda: run_wsgi(paths('/api/'), headers, concurrency, total, threads, latency)),
+                    ('asgi sync',
+                     lambda: asyncio.run(run_asgi(paths('/api/'), headers, concurrency, total, latency))),
+                    ('asgi async',
+                     lambda: asyncio.run(run_asgi(paths('/api/async/'), headers, concurrency, total, latency))),
+                ):
+                    started = time.perf_counter()
+                    latencies, errors = run()
+                    self.report(label, concurrency, time.perf_counter() - started, latencies, errors)
+
+    def seed(self, products):
+        category_ids = seed_catalog(products)
+        vendor = Vendor.objects.create(email='small@example.com', name='Small', second_name='Vendor',
+                                       phone_number='0', description='small')
+        Product.objects.bulk_create([
+            Product(vendor=vendor, category_id=category_ids[0], name=f'Small {index}', description='small', price=index)
+            for index in range(20)
+        ])
+        product_ids = list(Product.objects.values_list('id', flat=True))
+        categories = Category.objects.count()
+
+        def paths(prefix):
+            rng = random.Random(0)
+
+            def path():
+                return rng.choice((
+                    lambda: f'{prefix}product/list/?page_size={rng.randint(1, 50)}',
+                    lambda: f'{prefix}product/list/?category={rng.randint(1, categories)}&ordering=price',
+                    lambda: f'{prefix}product/list/category',
+                    lambda: f'{prefix}product/{rng.choice(product_ids)}/',
+                    lambda: f'{prefix}user/vendor/profile/{vendor.id}',
+                ))()
+            return path
+        return paths
+
+    def report(self, label, concurrency, seconds, latencies, errors):
+        latencies.sort()
+        self.stdout.write(
+            f'{label:<16} {concurrency:>4} clients  {len(latencies) / seconds:8.1f} req/s  '
+            f'p50 {statistics.median(latencies):8.1f} ms  p95 {latencies[int(len(latencies) * 0.95)]:8.1f} ms  '
+            f'errors {errors}'
+        )
+
+
+def split(total, concurrency):
+    # Each client sends its share of the requests back to back.
+    return [total // concurrency + (index < total % concurrency) for index in range(concurrency)]
+
+
+def run_wsgi(next_path, headers, concurrency, total, threads, latency):
+    application = get_wsgi_application()
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def serve(path):
+        path, _, query = path.partition('?')
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SERVER_NAME': 'testserver',
+            'SERVER_PORT': '80', 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(), 'wsgi.errors': io.StringIO(),
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+        }
+        for name, value in headers:
+            environ['HTTP_' + name.decode().upper().replace('-', '_')] = value.decode()
+        status = []
+        body = application(environ, lambda code, response_headers: status.append(code))
+        b''.join(body)
+        body.close()
+        return status[0]
+
+    with ThreadPoolExecutor(threads) as workers:
+        def client(count):
+            for _ in range(count):
+                # Slept by the client for both servers, so it holds neither a worker thread nor the event loop.
+                time.sleep(latency)
+                with lock:
+                    path = next_path()
+                started = time.perf_counter()
+                status = workers.submit(serve, path).result()
+                with lock:
+                    latencies.append((time.perf_counter() - started) * 1000)
+                    if not status.startswith('2'):
+                        errors.append(status)
+
+        with ThreadPoolExecutor(concurrency) as clients:
+            list(clients.map(client, split(total, concurrency)))
+    return latencies, len(errors)
+
+
+async def run_asgi(next_path, headers, concurrency, total, latency):
+    application = get_asgi_application()
+    latencies, errors = [], []
+
+    async def serve(path):
+        path, _, query = path.partition('?')
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'root_path': '',
+            'headers': [(b'host', b'testserver')] + headers, 'client': ('127.0.0.1', 0),
+            'server': ('testserver', 80),
+        }
+        status = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+
+        await application(scope, receive, send)
+        return status[0]
+
+    async def client(count):
+        for _ in range(count):
+            await asyncio.sleep(latency)
+            started = time.perf_counter()
+            status = await serve(next_path())
+            latencies.append((time.perf_counter() - started) * 1000)
+            if status >= 300:
+                errors.append(status)
+
+    await asyncio.gather(*(client(count) for count in split(total, concurrency)))
+    return latencies, len(errors)
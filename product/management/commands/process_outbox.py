@@ -0,0 +1,39 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from product.outbox import deliver, lease_batch
+
+
+class Command(BaseCommand):
+    help = 'Deliver outbox messages: payment intents, cart clearing and stats updates.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Deliver until nothing is due, then exit.')
+        parser.add_argument('--batch-size', type=int, default=settings.OUTBOX_BATCH_SIZE)
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to sleep when nothing is due.')
+        parser.add_argument('--concurrency', type=int, default=settings.STRIPE_MAX_CONCURRENCY)
+
+    def handle(self, *args, **options):
+        with ThreadPoolExecutor(options['concurrency']) as workers:
+            # With a concurrency of 1, messages are delivered on this thread and its connection.
+            run = map if options['concurrency'] == 1 else workers.map
+            while True:
+                batch = lease_batch(options['batch_size'])
+                delivered = sum(run(process, batch))
+                if options['verbosity'] > 1 and batch:
+                    self.stdout.write(f'Delivered {delivered} of {len(batch)} messages')
+                if not batch:
+                    if options['once']:
+                        break
+                    time.sleep(options['interval'])
+
+
+def process(message):
+    try:
+        return deliver(message)
+    finally:
+        close_old_connections()
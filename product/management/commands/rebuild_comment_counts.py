@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from product.stats import rebuild_comment_counts
+
+
+class Command(BaseCommand):
+    help = 'Recount the comments of every product whose stored comment count drifted.'
+
+    def handle(self, *args, **options):
+        products = rebuild_comment_counts()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt comment counts for {products} products.'))
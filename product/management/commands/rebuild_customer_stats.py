@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from product.stats import rebuild_customer_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the per-customer purchase summaries from the purchase table.'
+
+    def handle(self, *args, **options):
+        customers = rebuild_customer_stats()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt stats for {customers} customers.'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from product.stats import rebuild_price_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the per-category price stats table from the product table.'
+
+    def handle(self, *args, **options):
+        categories = rebuild_price_stats()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt price stats for {categories} categories.'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from product.search import install_search_index, rebuild_search_index, search_supported
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the product full-text search index in primary-key batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if not search_supported(connection):
+            raise CommandError('Product search needs the SQLite FTS5 backend.')
+        install_search_index(connection)
+        indexed = 0
+        for indexed in rebuild_search_index(batch_size=options['batch_size'], using=connection):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'Indexed {indexed} products')
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} products.'))
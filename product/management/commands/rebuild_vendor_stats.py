@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from product.stats import rebuild_vendor_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the per-vendor storefront stats from the product, purchase and comment tables.'
+
+    def handle(self, *args, **options):
+        vendors = rebuild_vendor_stats()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt stats for {vendors} vendors.'))
@@ -0,0 +1,42 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from market.db_router import write_heartbeat
+
+
+class Command(BaseCommand):
+    help = (
+        'Stamp the replication heartbeat on the primary, then copy the primary SQLite database over '
+        'each SQLite replica in DATABASE_REPLICAS. With real replication, run it with --heartbeat-only.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Sync once, then exit.')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds between syncs.')
+        parser.add_argument('--heartbeat-only', action='store_true',
+                            help='Only stamp the heartbeat; the database replicates itself.')
+
+    def handle(self, *args, **options):
+        primary = connections[DEFAULT_DB_ALIAS]
+        if not options['heartbeat_only'] and primary.vendor != 'sqlite':
+            raise CommandError('Only SQLite databases can be copied; use --heartbeat-only.')
+        while True:
+            started = time.perf_counter()
+            write_heartbeat()
+            if not options['heartbeat_only']:
+                primary.ensure_connection()
+                for alias in settings.DATABASE_REPLICAS:
+                    replica = sqlite3.connect(connections[alias].settings_dict['NAME'])
+                    try:
+                        primary.connection.backup(replica)
+                    finally:
+                        replica.close()
+            if options['verbosity'] > 1:
+                self.stdout.write(f'Synced in {(time.perf_counter() - started) * 1000:.1f} ms')
+            if options['once']:
+                break
+            time.sleep(options['interval'])
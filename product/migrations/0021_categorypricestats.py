@@ -0,0 +1,35 @@
+# Generated by Django 4.2 on 2026-10-18 02:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, Max, Min, Sum
+
+
+def populate_price_stats(apps, schema_editor):
+    Product = apps.get_model('product', 'Product')
+    CategoryPriceStats = apps.get_model('product', 'CategoryPriceStats')
+    rows = Product.objects.values('category_id').annotate(
+        count=Count('id'), price_sum=Sum('price'), price_min=Min('price'), price_max=Max('price')
+    ).order_by()
+    CategoryPriceStats.objects.bulk_create([CategoryPriceStats(**row) for row in rows])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0020_purchase'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryPriceStats',
+            fields=[
+                ('category', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='price_stats', serialize=False, to='product.category')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('price_sum', models.BigIntegerField(default=0)),
+                ('price_min', models.IntegerField(null=True)),
+                ('price_max', models.IntegerField(null=True)),
+            ],
+        ),
+        migrations.RunPython(populate_price_stats, migrations.RunPython.noop),
+    ]
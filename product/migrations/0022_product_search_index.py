@@ -0,0 +1,62 @@
+from django.db import migrations
+
+# The DDL is a snapshot of product.search at the time of this migration, so later
+# changes to that module do not change what the migration does.
+CREATE_SEARCH_TABLE = """
+CREATE VIRTUAL TABLE IF NOT EXISTS product_product_fts USING fts5(
+    name, description,
+    content='product_product', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+)
+"""
+
+CREATE_SEARCH_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS product_product_fts_insert AFTER INSERT ON product_product BEGIN
+        INSERT INTO product_product_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS product_product_fts_delete AFTER DELETE ON product_product BEGIN
+        INSERT INTO product_product_fts(product_product_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS product_product_fts_update AFTER UPDATE OF name, description ON product_product BEGIN
+        INSERT INTO product_product_fts(product_product_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO product_product_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    """,
+)
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(CREATE_SEARCH_TABLE)
+    for statement in CREATE_SEARCH_TRIGGERS:
+        schema_editor.execute(statement)
+    schema_editor.execute(
+        'INSERT INTO product_product_fts(rowid, name, description) SELECT id, name, description FROM product_product'
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for trigger in ('insert', 'delete', 'update'):
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS product_product_fts_{trigger}')
+    schema_editor.execute('DROP TABLE IF EXISTS product_product_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0021_categorypricestats'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.2 on 2026-10-18 02:56
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+import django.utils.timezone
+
+
+def populate_comment_counts(apps, schema_editor):
+    Product = apps.get_model('product', 'Product')
+    Comment = apps.get_model('product', 'Comment')
+    counts = Comment.objects.filter(product=OuterRef('pk')).order_by().values('product').annotate(
+        count=Count('id')
+    ).values('count')
+    Product.objects.update(comment_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0024_product_category_idx'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='comment',
+            name='comment_product_idx',
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='created',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['product', 'created', 'id'], name='comment_product_created_idx'),
+        ),
+        migrations.RunPython(populate_comment_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 4.2 on 2026-10-18 03:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0025_comment_created'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='purchase',
+            name='amount',
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='card_last4',
+            field=models.CharField(blank=True, max_length=4),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='client_secret',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='idempotency_key',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='payment_intent_id',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('created', 'Payment intent created'), ('failed', 'Failed')], default='created', max_length=16),
+        ),
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['status', 'id'], name='purchase_status_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='purchase',
+            constraint=models.UniqueConstraint(condition=models.Q(('idempotency_key__isnull', False)), fields=('customer', 'idempotency_key'), name='purchase_idempotency_key_uniq'),
+        ),
+    ]
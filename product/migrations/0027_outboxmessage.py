@@ -0,0 +1,48 @@
+# Generated by Django 4.2 on 2026-10-18 03:32
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def enqueue_pending_purchases(apps, schema_editor):
+    # Purchases left for the removed process_payments command are now delivered through the outbox.
+    Purchase = apps.get_model('product', 'Purchase')
+    OutboxMessage = apps.get_model('product', 'OutboxMessage')
+    purchase_ids = Purchase.objects.filter(status__in=['pending', 'processing']).values_list('id', flat=True)
+    OutboxMessage.objects.bulk_create([
+        OutboxMessage(topic='purchase.create_intent', payload={'purchase': purchase_id})
+        for purchase_id in purchase_ids
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0026_purchase_payment_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('topic', models.CharField(max_length=64)),
+                ('payload', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now, null=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('lease', models.CharField(blank=True, max_length=32)),
+                ('locked_until', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='outboxmessage',
+            index=models.Index(fields=['available_at', 'id'], name='outbox_available_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='outboxmessage',
+            index=models.Index(fields=['lease'], name='outbox_lease_idx'),
+        ),
+        migrations.RunPython(enqueue_pending_purchases, migrations.RunPython.noop),
+    ]
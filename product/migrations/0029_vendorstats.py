@@ -0,0 +1,48 @@
+# Generated by Django 4.2 on 2026-10-18 03:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, Max, Min, Sum
+
+
+def populate_vendor_stats(apps, schema_editor):
+    Product = apps.get_model('product', 'Product')
+    Purchase = apps.get_model('product', 'Purchase')
+    Comment = apps.get_model('product', 'Comment')
+    VendorStats = apps.get_model('product', 'VendorStats')
+    purchases = dict(Purchase.objects.filter(status='created').values('product__vendor_id').annotate(
+        count=Count('id')).order_by().values_list('product__vendor_id', 'count'))
+    comments = dict(Comment.objects.values('product__vendor_id').annotate(
+        count=Count('id')).order_by().values_list('product__vendor_id', 'count'))
+    rows = Product.objects.values('vendor_id').annotate(
+        count=Count('id'), price_sum=Sum('price'), price_min=Min('price'), price_max=Max('price')
+    ).order_by()
+    VendorStats.objects.bulk_create([
+        VendorStats(purchase_count=purchases.get(row['vendor_id'], 0),
+                    comment_count=comments.get(row['vendor_id'], 0), **row)
+        for row in rows
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0004_customuser_token_version'),
+        ('product', '0028_replicationheartbeat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VendorStats',
+            fields=[
+                ('vendor', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='user.vendor')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('price_sum', models.BigIntegerField(default=0)),
+                ('price_min', models.IntegerField(null=True)),
+                ('price_max', models.IntegerField(null=True)),
+                ('purchase_count', models.PositiveIntegerField(default=0)),
+                ('comment_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(populate_vendor_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.2 on 2026-10-18 03:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+from django.db.models import Count, Sum
+from django.db.models.functions import Coalesce
+
+
+def populate_customer_stats(apps, schema_editor):
+    Purchase = apps.get_model('product', 'Purchase')
+    CustomerStats = apps.get_model('product', 'CustomerStats')
+    rows = Purchase.objects.filter(status='created').values('customer_id').annotate(
+        purchase_count=Count('id'), total_spent=Coalesce(Sum('amount'), 0)
+    ).order_by()
+    CustomerStats.objects.bulk_create([CustomerStats(**row) for row in rows])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0004_customuser_token_version'),
+        ('product', '0029_vendorstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerStats',
+            fields=[
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='user.customer')),
+                ('purchase_count', models.PositiveIntegerField(default=0)),
+                ('total_spent', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='purchase',
+            name='purchase_customer_idx',
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['customer', 'created_at', 'id'], name='purchase_customer_created_idx'),
+        ),
+        migrations.RunPython(populate_customer_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.2 on 2026-10-18 04:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0030_purchase_created_at'),
+    ]
+
+    operations = [
+        # The auto-created through table of Cart.product becomes CartItem as it is: only
+        # the table is renamed, its rows and its unique (cart, product) index are kept.
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    sql='ALTER TABLE "product_cart_product" RENAME TO "product_cartitem"',
+                    reverse_sql='ALTER TABLE "product_cartitem" RENAME TO "product_cart_product"',
+                ),
+            ],
+            state_operations=[
+                migrations.CreateModel(
+                    name='CartItem',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('cart', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='product.cart')),
+                        ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='product.product')),
+                    ],
+                    options={
+                        'unique_together': {('cart', 'product')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='cart',
+                    name='product',
+                    field=models.ManyToManyField(through='product.CartItem', to='product.product'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='cartitem',
+            name='quantity',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from user.models import Vendor, Customer
 
 
@@ -10,36 +11,177 @@ class Category(models.Model):
 
 
 class Product(models.Model):
-    vendor = models.ForeignKey(Vendor, on_delete=models.CASCADE)
-    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    vendor = models.ForeignKey(Vendor, on_delete=models.CASCADE, db_index=False)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, db_index=False)
     name = models.CharField(max_length=255, null=False, blank=False)
     description = models.TextField()
     price = models.IntegerField(null=False, blank=False)
+    # Kept up to date by product.signals; after writing comments in bulk, run rebuild_comment_counts.
+    comment_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        # The composite indexes lead with the foreign keys, so the FKs' own indexes are left out.
+        indexes = [
+            models.Index(fields=['category', 'id'], name='product_category_idx'),
+            models.Index(fields=['category', 'name'], name='product_category_name_idx'),
+            models.Index(fields=['category', 'price', 'id'], name='product_category_price_idx'),
+            models.Index(fields=['vendor', 'id'], name='product_vendor_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_idx'),
+            models.Index(fields=['name'], name='product_name_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
 
+class CategoryPriceStats(models.Model):
+    category = models.OneToOneField(Category, primary_key=True, on_delete=models.CASCADE, related_name='price_stats')
+    count = models.PositiveIntegerField(default=0)
+    price_sum = models.BigIntegerField(default=0)
+    price_min = models.IntegerField(null=True)
+    price_max = models.IntegerField(null=True)
+
+    def __str__(self):
+        return f"{self.category} price stats"
+
+
+class VendorStats(models.Model):
+    """
+    Storefront figures of a vendor, kept up to date by product.signals: its
+    products (count and prices, like CategoryPriceStats), the purchases of them
+    that were paid for and the comments on them. There is no row for a vendor
+    without products.
+    """
+    vendor = models.OneToOneField(Vendor, primary_key=True, on_delete=models.CASCADE, related_name='stats')
+    count = models.PositiveIntegerField(default=0)
+    price_sum = models.BigIntegerField(default=0)
+    price_min = models.IntegerField(null=True)
+    price_max = models.IntegerField(null=True)
+    purchase_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.vendor} stats"
+
+
+class CustomerStats(models.Model):
+    """
+    Lifetime purchase summary of a customer: the number of paid purchases and the
+    amount spent on them, kept up to date by product.signals. There is no row for
+    a customer who has not paid for anything.
+    """
+    customer = models.OneToOneField(Customer, primary_key=True, on_delete=models.CASCADE, related_name='stats')
+    purchase_count = models.PositiveIntegerField(default=0)
+    total_spent = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.customer} stats"
+
+
 class Comment(models.Model):
     id = models.AutoField(primary_key=True)
     comment = models.TextField(null=False, blank=False)
     customer = models.ForeignKey(Customer, null=False, blank=False, on_delete=models.CASCADE)
-    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, db_index=False)
+    created = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'created', 'id'], name='comment_product_created_idx'),
+        ]
 
 
 class Purchase(models.Model):
-    customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    CREATED = 'created'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (CREATED, 'Payment intent created'),
+        (FAILED, 'Failed'),
+    ]
+
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, db_index=False)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    amount = models.PositiveIntegerField(null=True)
+    idempotency_key = models.CharField(max_length=255, null=True, blank=True)
+    card_last4 = models.CharField(max_length=4, blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=CREATED)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    payment_intent_id = models.CharField(max_length=255, blank=True)
+    client_secret = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer', 'created_at', 'id'], name='purchase_customer_created_idx'),
+            models.Index(fields=['status', 'id'], name='purchase_status_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['customer', 'idempotency_key'], name='purchase_idempotency_key_uniq',
+                                    condition=models.Q(idempotency_key__isnull=False)),
+        ]
+
+
+class OutboxMessage(models.Model):
+    """
+    A side effect to run after the transaction that wrote it commits; see product.outbox.
+    """
+    topic = models.CharField(max_length=64)
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(default=timezone.now)
+    # When the message is next due; null once it has failed OUTBOX_MAX_ATTEMPTS times.
+    available_at = models.DateTimeField(null=True, default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    lease = models.CharField(max_length=32, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['available_at', 'id'], name='outbox_available_idx'),
+            models.Index(fields=['lease'], name='outbox_lease_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.topic} #{self.pk}"
+
+
+class ReplicationHeartbeat(models.Model):
+    """
+    One row, stamped on the primary by `manage.py sync_replicas`; its age on a
+    replica is how far that replica lags behind.
+    """
+    beat = models.DateTimeField()
 
 
 class Cart(models.Model):
     customer = models.OneToOneField(Customer, on_delete=models.CASCADE)
-    product = models.ManyToManyField(Product)
+    product = models.ManyToManyField(Product, through='CartItem')
 
     def __str__(self):
         return f"{self.customer.email}'s cart"
 
 
+class CartItem(models.Model):
+    """
+    A product in a cart, with how many of it. Formerly the auto-created through
+    table of Cart.product, whose unique (cart, product) index it keeps.
+    """
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        unique_together = [('cart', 'product')]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} in cart {self.cart_id}"
+
+
 
 
 
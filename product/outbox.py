@@ -0,0 +1,105 @@
+"""
+Transactional outbox.
+
+Side effects of a write (calling Stripe, clearing carts, updating stats) are stored
+as OutboxMessage rows in the same transaction as the write itself, and run later by
+`manage.py process_outbox`. A message is therefore delivered if and only if the
+write committed, and requests never wait on downstream systems.
+
+Workers lease a batch of due messages by stamping them with a random token in one
+conditional UPDATE, which is safe on SQLite; databases that support it also skip
+rows another worker has locked. Delivery is at least once: a handler that raises
+is retried with exponential backoff, and a worker that dies leaves its lease to
+expire after OUTBOX_LEASE seconds, so handlers must be idempotent. Messages that
+fail OUTBOX_MAX_ATTEMPTS times are kept with `available_at` cleared.
+"""
+import logging
+import random
+import secrets
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from market import metrics
+from .models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+
+
+def handler(topic):
+    """
+    Register the decorated function as the handler of `topic`. It is called with
+    the message payload as keyword arguments.
+    """
+    def register(function):
+        HANDLERS[topic] = function
+        return function
+    return register
+
+
+def enqueue(topic, **payload):
+    """
+    Store a message. Call it inside the transaction of the write it belongs to.
+    """
+    return OutboxMessage.objects.create(topic=topic, payload=payload)
+
+
+def due(now):
+    return OutboxMessage.objects.filter(
+        Q(locked_until__isnull=True) | Q(locked_until__lt=now),
+        available_at__lte=now,
+    )
+
+
+def lease_batch(limit):
+    """
+    Lease up to `limit` due messages to this worker, oldest first.
+    """
+    now = timezone.now()
+    token = secrets.token_hex(16)
+    with transaction.atomic():
+        candidates = due(now).order_by('available_at', 'id')
+        if connection.features.has_select_for_update_skip_locked:
+            candidates = candidates.select_for_update(skip_locked=True)
+        ids = list(candidates.values_list('id', flat=True)[:limit])
+        # Re-checking the condition makes the lease safe where rows cannot be locked.
+        due(now).filter(id__in=ids).update(
+            lease=token,
+            locked_until=now + timedelta(seconds=settings.OUTBOX_LEASE),
+            attempts=F('attempts') + 1,
+        )
+    return list(OutboxMessage.objects.filter(lease=token).order_by('available_at', 'id'))
+
+
+def backoff(attempts):
+    base, ceiling = settings.OUTBOX_BACKOFF
+    return min(ceiling, base * 2 ** (attempts - 1)) * random.uniform(0.5, 1)
+
+
+def deliver(message):
+    """
+    Run the handler of a leased message. Returns True when it succeeded.
+    """
+    try:
+        HANDLERS[message.topic](**message.payload)
+    except Exception as error:
+        logger.warning('Outbox message %s (%s) failed on attempt %s', message.id, message.topic,
+                       message.attempts, exc_info=True)
+        if message.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+            available_at = None
+            metrics.incr('outbox.dead')
+        else:
+            available_at = timezone.now() + timedelta(seconds=backoff(message.attempts))
+            metrics.incr('outbox.retried')
+        OutboxMessage.objects.filter(id=message.id, lease=message.lease).update(
+            available_at=available_at, lease='', locked_until=None, last_error=f'{type(error).__name__}: {error}',
+        )
+        return False
+    OutboxMessage.objects.filter(id=message.id, lease=message.lease).delete()
+    metrics.incr('outbox.delivered')
+    return True
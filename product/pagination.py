@@ -0,0 +1,289 @@
+import base64
+import binascii
+import datetime
+import heapq
+import json
+from collections import OrderedDict
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .counts import row_count
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """
+    Keeps datetimes at full precision; DjangoJSONEncoder rounds them to milliseconds,
+    which would make a position fall between rows.
+    """
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(position, reverse=False):
+    payload = json.dumps({'p': list(position), 'r': int(reverse)}, cls=CursorEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(encoded):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+        return list(payload['p']), bool(payload['r'])
+    except (TypeError, ValueError, KeyError, binascii.Error):
+        raise NotFound(KeysetPagination.invalid_cursor_message)
+
+
+def ordering_fields(model, ordering):
+    """
+    The model fields `ordering` sorts `model` by, a foreign key standing for the field it points to.
+    """
+    fields = []
+    for field in ordering:
+        name = field.lstrip('-')
+        model_field = model._meta.pk if name == 'pk' else model._meta.get_field(name)
+        fields.append(model_field.target_field if model_field.is_relation else model_field)
+    return fields
+
+
+def clean_position(fields, position):
+    """
+    Convert a decoded cursor position to the types of `fields`, so a tampered
+    cursor is a 404 instead of a database error.
+    """
+    if len(position) != len(fields):
+        raise NotFound(KeysetPagination.invalid_cursor_message)
+    values = []
+    for field, value in zip(fields, position):
+        try:
+            value = field.to_python(value)
+        except (ValidationError, TypeError, ValueError):
+            raise NotFound(KeysetPagination.invalid_cursor_message)
+        # Integers that do not fit a 64-bit column make the database driver raise.
+        if value is None or isinstance(value, int) and not -2 ** 63 <= value < 2 ** 63:
+            raise NotFound(KeysetPagination.invalid_cursor_message)
+        values.append(value)
+    return values
+
+
+def keyset_filter(ordering, position):
+    """
+    Build the predicate selecting rows strictly after `position` in `ordering`,
+    i.e. the row-value comparison (a, b) > (x, y) spelled out as
+    a > x OR (a = x AND b > y), which the database can answer from an index on (a, b).
+    """
+    query = Q()
+    for index, field in enumerate(ordering):
+        name = field.lstrip('-')
+        lookup = '__lt' if field.startswith('-') else '__gt'
+        condition = Q(**{name + lookup: position[index]})
+        for previous_field, value in zip(ordering[:index], position[:index]):
+            condition &= Q(**{previous_field.lstrip('-'): value})
+        query |= condition
+    return query
+
+
+def reverse_ordering(ordering):
+    return tuple(field[1:] if field.startswith('-') else '-' + field for field in ordering)
+
+
+def row_value(row, field):
+    name = field.lstrip('-')
+    if isinstance(row, dict):
+        return row[name]
+    return getattr(row, name)
+
+
+def cursor_page(request, queryset, ordering, page_size):
+    """
+    The `page_size` rows of `queryset` in `ordering` that the request's cursor
+    points at, plus one row more to tell whether there is a next page. For pages
+    embedded in a larger response, which only link forwards; see cursor_next_link.
+    """
+    queryset = queryset.order_by(*ordering)
+    encoded = request.GET.get(KeysetPagination.cursor_query_param)
+    if encoded:
+        position, reverse = decode_cursor(encoded)
+        if reverse:
+            raise NotFound(KeysetPagination.invalid_cursor_message)
+        position = clean_position(ordering_fields(queryset.model, ordering), position)
+        queryset = queryset.filter(keyset_filter(ordering, position))
+    return queryset[:page_size + 1]
+
+
+def cursor_next_link(url, rows, ordering, page_size):
+    """
+    `url` with the cursor of the page after `rows`, as fetched by cursor_page, or None.
+    """
+    if len(rows) <= page_size:
+        return None
+    position = [row_value(rows[page_size - 1], field) for field in ordering]
+    return replace_query_param(url, KeysetPagination.cursor_query_param, encode_cursor(position))
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Django paginator whose total comes from the count service instead of a COUNT(*) per request.
+    """
+
+    @cached_property
+    def count(self):
+        return row_count(self.object_list, estimated=True)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Opaque-cursor pagination over a stable, indexed ordering.
+
+    Instead of OFFSET, each page seeks past the boundary row of the previous one,
+    so every page costs the same however deep it is. The ordering is taken from the
+    queryset's order_by() when it has one, else from `ordering`; its last field must
+    be unique (normally the primary key). The total count is skipped unless the
+    client asks for it with ``?count=true``.
+
+    When `partitions` is set, each page is fetched as one index range scan per value
+    of `partition_field` and merged, instead of one query that sorts every row in
+    the requested partitions.
+    """
+    cursor_query_param = 'cursor'
+    page_size = 20
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    count_query_param = 'count'
+    ordering = ('id',)
+    partition_field = None
+    partitions = None
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.count = self.get_count(queryset) if self.count_requested(request) else None
+
+        encoded = request.query_params.get(self.cursor_query_param)
+        position, reverse = decode_cursor(encoded) if encoded else (None, False)
+        if position is not None:
+            position = clean_position(ordering_fields(queryset.model, self.ordering), position)
+
+        ordering = reverse_ordering(self.ordering) if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(keyset_filter(ordering, position))
+
+        rows = self.fetch(queryset, ordering, self.page_size + 1)
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+            has_next, has_previous = position is not None, has_more
+        else:
+            has_next, has_previous = has_more, position is not None
+
+        self.next_position = self.previous_position = None
+        if has_next:
+            self.next_position = self.get_position(rows[-1]) if rows else position
+        if has_previous:
+            self.previous_position = self.get_position(rows[0]) if rows else position
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_ordering(self, request, queryset, view):
+        return tuple(queryset.query.order_by) or self.ordering
+
+    def fetch(self, queryset, ordering, limit):
+        descending = {field.startswith('-') for field in ordering}
+        if not self.partitions or len(descending) > 1:
+            return list(queryset[:limit])
+        partitions = [
+            queryset.filter(**{self.partition_field: value})[:limit]
+            for value in self.partitions
+        ]
+        merged = heapq.merge(
+            *partitions,
+            key=lambda row: [row_value(row, field) for field in ordering],
+            reverse=descending.pop()
+        )
+        return list(islice(merged, limit))
+
+    def count_requested(self, request):
+        return request.query_params.get(self.count_query_param, '').lower() in ('1', 'true', 'yes')
+
+    def get_count(self, queryset):
+        return row_count(queryset, estimated=True)
+
+    def get_position(self, row):
+        return [row_value(row, field) for field in self.ordering]
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, encode_cursor(self.next_position))
+
+    def get_previous_link(self):
+        if self.previous_position is None:
+            return None
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, encode_cursor(self.previous_position, reverse=True)
+        )
+
+    def get_paginated_response(self, data):
+        response = OrderedDict()
+        if self.count is not None:
+            response['count'] = self.count
+        response['next'] = self.get_next_link()
+        response['previous'] = self.get_previous_link()
+        response['results'] = data
+        return Response(response)
+
+
+class SearchPagination(KeysetPagination):
+    """
+    Forward-only keyset pagination over ranked search results, keyed on (rank, id).
+    """
+    ordering = ('rank', 'id')
+    # The rank is a BM25 score, not a model field.
+    position_fields = (models.FloatField(), models.BigIntegerField())
+
+    def paginate_search(self, search, request):
+        """
+        `search` is called with the (rank, id) position to continue after (None for the
+        first page) and the number of rows to fetch.
+        """
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.count = None
+
+        encoded = request.query_params.get(self.cursor_query_param)
+        position, reverse = decode_cursor(encoded) if encoded else (None, False)
+        if reverse:
+            raise NotFound(self.invalid_cursor_message)
+        if position is not None:
+            position = clean_position(self.position_fields, position)
+
+        rows = search(position, self.page_size + 1)
+        self.next_position = self.get_position(rows[self.page_size - 1]) if len(rows) > self.page_size else None
+        self.previous_position = None
+        return rows[:self.page_size]
@@ -0,0 +1,186 @@
+"""
+Payment intent creation for purchases.
+
+Stripe is called through one process-wide gateway that bounds the number of calls
+in flight, applies connect/read timeouts and network retries, and reuses pooled
+connections. Every purchase is written before Stripe is called and passes its own
+id as Stripe's idempotency key, so a retried request or a retried worker never
+creates a second intent for the same purchase.
+
+Each purchase is recorded together with an outbox message that creates its intent,
+so a payment that the request could not or did not complete is finished by
+`manage.py process_outbox`. Creating the intent in turn enqueues the purchase's
+follow-ups: clearing the product from the customer's cart and updating stats.
+"""
+import threading
+from datetime import timedelta
+
+import requests
+import stripe
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.dispatch import receiver
+from django.utils import timezone
+
+from market import metrics
+from . import outbox
+from .models import CartItem, Purchase
+
+
+class GatewayBusy(Exception):
+    """Every Stripe slot stayed taken for STRIPE_SLOT_TIMEOUT seconds."""
+
+
+class IdempotencyConflict(Exception):
+    """An idempotency key was reused for a different purchase."""
+
+
+class PaymentNotFinished(Exception):
+    """Another request or worker is creating the intent, or Stripe failed."""
+
+
+class StripeGateway:
+
+    def __init__(self):
+        stripe.api_key = settings.STRIPE_SECRET_KEY
+        stripe.api_base = settings.STRIPE_API_BASE
+        stripe.max_network_retries = settings.STRIPE_MAX_NETWORK_RETRIES
+        session = requests.Session()
+        # One pooled connection per slot, shared by every thread.
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=settings.STRIPE_MAX_CONCURRENCY)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        stripe.default_http_client = stripe.RequestsClient(timeout=settings.STRIPE_TIMEOUT, session=session)
+        self.slots = threading.BoundedSemaphore(settings.STRIPE_MAX_CONCURRENCY)
+
+    def create_payment_intent(self, wait, **params):
+        if not self.slots.acquire(timeout=wait):
+            raise GatewayBusy()
+        try:
+            return stripe.PaymentIntent.create(**params)
+        finally:
+            self.slots.release()
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def gateway():
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = StripeGateway()
+        return _gateway
+
+
+@receiver(setting_changed)
+def reset_gateway(setting, **kwargs):
+    global _gateway
+    if setting.startswith('STRIPE_'):
+        with _gateway_lock:
+            _gateway = None
+
+
+def start_purchase(customer, product, amount, card_number, idempotency_key=None):
+    """
+    Record a pending purchase and the outbox message that creates its intent, or
+    return the purchase already recorded for (customer, idempotency_key). Returns
+    (purchase, created). Only the last four digits of the card are kept.
+    """
+    fields = {'customer': customer, 'product': product, 'amount': amount, 'card_last4': card_number[-4:],
+              'idempotency_key': idempotency_key, 'status': Purchase.PENDING}
+    try:
+        with transaction.atomic():
+            purchase = Purchase.objects.create(**fields)
+            outbox.enqueue('purchase.create_intent', purchase=purchase.id)
+        return purchase, True
+    except IntegrityError:
+        if idempotency_key is None:
+            raise
+        purchase = Purchase.objects.get(customer=customer, idempotency_key=idempotency_key)
+    if purchase.product_id != product.id or purchase.amount != amount:
+        raise IdempotencyConflict()
+    return purchase, False
+
+
+def claim(purchase):
+    """
+    Move a pending, failed or abandoned purchase to processing. Returns False when
+    another request or worker holds it, or its intent already exists.
+    """
+    now = timezone.now()
+    claimed = Purchase.objects.filter(
+        Q(status__in=[Purchase.PENDING, Purchase.FAILED])
+        | Q(status=Purchase.PROCESSING, claimed_at__lt=now - timedelta(seconds=settings.PAYMENT_CLAIM_TIMEOUT)),
+        id=purchase.id,
+    ).update(status=Purchase.PROCESSING, claimed_at=now)
+    if claimed:
+        purchase.status, purchase.claimed_at = Purchase.PROCESSING, now
+    return bool(claimed)
+
+
+def create_intent(purchase, wait=None):
+    """
+    Create the Stripe payment intent of a claimed purchase and store the outcome.
+    Raises GatewayBusy, leaving the purchase pending, when no Stripe slot frees up
+    within `wait` seconds.
+    """
+    product = purchase.product
+    try:
+        intent = gateway().create_payment_intent(
+            settings.STRIPE_SLOT_TIMEOUT if wait is None else wait,
+            amount=purchase.amount,
+            currency='usd',
+            payment_method_types=['card'],
+            metadata={'integration_check': 'accept_a_payment',
+                      'product_name': product.name,
+                      'product_description': product.description,
+                      'card_last4': purchase.card_last4,
+                      'purchase': purchase.id,
+                      },
+            idempotency_key=f'purchase-{purchase.id}',
+        )
+    except GatewayBusy:
+        Purchase.objects.filter(id=purchase.id).update(status=Purchase.PENDING, claimed_at=None)
+        purchase.status = Purchase.PENDING
+        raise
+    except stripe.StripeError as error:
+        purchase.status, purchase.error = Purchase.FAILED, error.user_message or str(error)
+    else:
+        purchase.status, purchase.error = Purchase.CREATED, ''
+        purchase.payment_intent_id, purchase.client_secret = intent.id, intent.client_secret
+    with transaction.atomic():
+        purchase.save(update_fields=['status', 'error', 'payment_intent_id', 'client_secret'])
+        if purchase.status == Purchase.CREATED:
+            outbox.enqueue('cart.remove_product', customer=purchase.customer_id, product=purchase.product_id)
+            outbox.enqueue('stats.purchase_created', purchase=purchase.id)
+    return purchase
+
+
+@outbox.handler('purchase.create_intent')
+def finish_purchase(purchase):
+    purchase = Purchase.objects.select_related('product').filter(id=purchase).first()
+    if purchase is None or purchase.status == Purchase.CREATED:
+        return
+    if not claim(purchase):
+        raise PaymentNotFinished('The purchase is being processed.')
+    # A worker can wait for a Stripe slot; only requests must not.
+    create_intent(purchase, wait=settings.STRIPE_TIMEOUT[1])
+    if purchase.status == Purchase.FAILED:
+        raise PaymentNotFinished(purchase.error)
+
+
+@outbox.handler('cart.remove_product')
+def remove_from_cart(customer, product):
+    CartItem.objects.filter(cart__customer_id=customer, product_id=product).delete()
+
+
+@outbox.handler('stats.purchase_created')
+def count_purchase(purchase):
+    # At least once: a retried message may count a purchase twice.
+    amount = Purchase.objects.filter(id=purchase).values_list('amount', flat=True).first()
+    metrics.incr('purchases.created')
+    metrics.incr('purchases.amount', amount or 0)
@@ -0,0 +1,140 @@
+import re
+
+from django.db import connection, connections
+
+from .models import Product
+
+SEARCH_TABLE = 'product_product_fts'
+
+CREATE_SEARCH_TABLE = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+    name, description,
+    content='product_product', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+)
+"""
+
+# External-content FTS5 tables are kept in sync by triggers on the content table, so
+# bulk_create/bulk_update/queryset.update are indexed too. SQLite drops triggers when a
+# migration remakes product_product, which is why install_search_index() runs after every migrate.
+CREATE_SEARCH_TRIGGERS = (
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_insert AFTER INSERT ON product_product BEGIN
+        INSERT INTO {SEARCH_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_delete AFTER DELETE ON product_product BEGIN
+        INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_update AFTER UPDATE OF name, description ON product_product BEGIN
+        INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO {SEARCH_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    """,
+)
+
+
+def search_supported(using=connection):
+    return using.vendor == 'sqlite'
+
+
+def search_index_exists(using=connection):
+    with using.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [SEARCH_TABLE])
+        return cursor.fetchone() is not None
+
+
+def install_search_index(using=connection):
+    with using.cursor() as cursor:
+        cursor.execute(CREATE_SEARCH_TABLE)
+        for statement in CREATE_SEARCH_TRIGGERS:
+            cursor.execute(statement)
+
+
+def rebuild_search_index(batch_size=5000, using=connection):
+    """
+    Re-index every product in primary-key batches so memory and the length of
+    each write stay bounded. Yields the number of rows indexed so far.
+    """
+    with using.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('delete-all')")
+        last_id, indexed = 0, 0
+        while True:
+            cursor.execute(
+                "SELECT MAX(id), COUNT(*) FROM "
+                "(SELECT id FROM product_product WHERE id > %s ORDER BY id LIMIT %s)",
+                [last_id, batch_size]
+            )
+            batch_last_id, batch_count = cursor.fetchone()
+            if not batch_count:
+                break
+            cursor.execute(
+                f"INSERT INTO {SEARCH_TABLE}(rowid, name, description) "
+                "SELECT id, name, description FROM product_product WHERE id > %s AND id <= %s",
+                [last_id, batch_last_id]
+            )
+            last_id, indexed = batch_last_id, indexed + batch_count
+            yield indexed
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('optimize')")
+
+
+def match_expression(text):
+    """
+    Turn free text into an FTS5 query: every word must match, and the last one
+    also matches as a prefix so partially typed queries still find results.
+    Returns None when the text has no searchable words.
+    """
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    terms = ['"%s"' % word for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search_products(text, after=None, limit=20, categories=(), price_min=None, price_max=None):
+    """
+    Products matching `text`, best BM25 match first (lower rank is better), ties broken by id.
+    `after` is the (rank, id) of the last row of the previous page. Each returned
+    Product carries its score as `.rank`.
+    """
+    expression = match_expression(text)
+    if expression is None:
+        return []
+    conditions, params = [f'{SEARCH_TABLE} MATCH %s'], [expression]
+    if categories:
+        conditions.append('product_product.category_id IN (%s)' % ', '.join(['%s'] * len(categories)))
+        params.extend(categories)
+    if price_min is not None:
+        conditions.append('product_product.price >= %s')
+        params.append(price_min)
+    if price_max is not None:
+        conditions.append('product_product.price <= %s')
+        params.append(price_max)
+    if after is not None:
+        conditions.append(
+            f'(bm25({SEARCH_TABLE}) > %s OR (bm25({SEARCH_TABLE}) = %s AND product_product.id > %s))'
+        )
+        params.extend([after[0], after[0], after[1]])
+    params.append(limit)
+    return list(Product.objects.raw(
+        f'SELECT product_product.*, bm25({SEARCH_TABLE}) AS rank '
+        f'FROM {SEARCH_TABLE} JOIN product_product ON product_product.id = {SEARCH_TABLE}.rowid '
+        f'WHERE {" AND ".join(conditions)} '
+        'ORDER BY rank, product_product.id LIMIT %s',
+        params
+    ))
+
+
+def ensure_search_index(sender, using, **kwargs):
+    """
+    post_migrate hook: put the sync triggers back if a migration remade product_product.
+    """
+    target = connections[using]
+    if search_supported(target) and search_index_exists(target):
+        install_search_index(target)
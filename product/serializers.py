@@ -1,6 +1,45 @@
 from rest_framework import serializers
-from .models import Product, Category, Cart, Comment, Purchase
-from django.db.models import Max, Avg, Min
+from .models import Product, Category, CartItem, Comment, Purchase
+from django.db.models import Max, Avg, Min, Manager, QuerySet
+from django.conf import settings
+
+
+class ModelValuesListSerializer(serializers.ListSerializer):
+    """
+    Read path for ``many=True`` lists of a ModelSerializer whose fields all map
+    straight onto model columns. Rows are built as plain dicts from ``values_list()``
+    (or from instance attributes, for lists that are already fetched) instead of
+    running every field's to_representation per row; the output is the same as
+    the child serializer's. Other children fall back to the regular ListSerializer.
+    """
+    plain_fields = (serializers.IntegerField, serializers.CharField, serializers.PrimaryKeyRelatedField)
+
+    def get_columns(self):
+        model = self.child.Meta.model
+        columns = []
+        for name, field in self.child.fields.items():
+            if field.write_only:
+                continue
+            if type(field) not in self.plain_fields or '.' in field.source or field.source == '*':
+                return None
+            model_field = model._meta.get_field(field.source)
+            if not model_field.concrete or model_field.many_to_many:
+                return None
+            columns.append((name, model_field.attname))
+        return columns
+
+    def to_representation(self, data):
+        columns = self.get_columns()
+        if columns is None:
+            return super().to_representation(data)
+        names = [name for name, _ in columns]
+        if isinstance(data, Manager):
+            data = data.all()
+        if isinstance(data, QuerySet):
+            rows = data.values_list(*[attname for _, attname in columns])
+        else:
+            rows = [[getattr(item, attname) for _, attname in columns] for item in data]
+        return [dict(zip(names, row)) for row in rows]
 
 
 class ProductSerializer(serializers.ModelSerializer):
@@ -8,6 +47,44 @@ class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
         fields = "__all__"
+        read_only_fields = ["comment_count"]
+        list_serializer_class = ModelValuesListSerializer
+
+    def update(self, instance, validated_data):
+        # Save only the submitted fields so counters maintained with F() are never overwritten.
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        instance.save(update_fields=list(validated_data))
+        return instance
+
+
+class ProductBulkRowSerializer(serializers.ModelSerializer):
+    # Categories are checked once per chunk by the ingester instead of one query per row.
+    category = serializers.IntegerField()
+
+    class Meta:
+        model = Product
+        fields = ["category", "name", "description", "price"]
+
+
+class ProductBulkPatchSerializer(ProductBulkRowSerializer):
+    id = serializers.IntegerField()
+
+    class Meta(ProductBulkRowSerializer.Meta):
+        fields = ["id"] + ProductBulkRowSerializer.Meta.fields
+
+    def validate(self, attrs):
+        # Used with partial=True, which skips the required check on the id as well.
+        if 'id' not in attrs:
+            raise serializers.ValidationError({'id': ['This field is required.']})
+        return attrs
+
+
+class ProductSearchQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=255)
+    category = serializers.ListField(child=serializers.IntegerField(), required=False, max_length=50)
+    price_min = serializers.IntegerField(required=False)
+    price_max = serializers.IntegerField(required=False)
 
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -17,17 +94,29 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = ["name"]
 
 
-class CartSerializer(serializers.ModelSerializer):
+class CartItemSerializer(serializers.ModelSerializer):
+    product = ProductSerializer(read_only=True)
 
     class Meta:
-        model = Cart
-        fields = '__all__'
+        model = CartItem
+        fields = ['product', 'quantity']
+
+
+class CartItemAddSerializer(serializers.Serializer):
+    product = serializers.PrimaryKeyRelatedField(queryset=Product.objects.only('id'))
+    quantity = serializers.IntegerField(min_value=1, max_value=settings.CART_MAX_QUANTITY, default=1)
+
+
+class CartItemQuantitySerializer(serializers.Serializer):
+    product = serializers.PrimaryKeyRelatedField(queryset=Product.objects.only('id'))
+    quantity = serializers.IntegerField(min_value=0, max_value=settings.CART_MAX_QUANTITY)
 
 
 class CommentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Comment
-        fields = ["comment", "customer"]
+        fields = ["comment", "customer", "created"]
+        read_only_fields = ["created"]
 
 
 class PurchaseSerializer(serializers.ModelSerializer):
@@ -35,5 +124,10 @@ class PurchaseSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Purchase
-        fields = '__all__'
+        exclude = ['idempotency_key', 'claimed_at', 'client_secret']
+
+
+class PaymentSerializer(serializers.Serializer):
+    amount = serializers.IntegerField(min_value=1)
+    card_number = serializers.CharField(max_length=32)
 
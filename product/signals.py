@@ -0,0 +1,107 @@
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import counts, detail_cache
+from .models import Category, Comment, Product, Purchase
+from .stats import apply_price_changes, apply_vendor_price_changes, count_customer_purchase, count_vendor_activity, \
+    recompute_vendor_stats
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_price(sender, instance, raw=False, **kwargs):
+    instance._stored_price = None
+    if instance.pk and not raw:
+        instance._stored_price = Product.objects.filter(pk=instance.pk).values_list(
+            'category_id', 'vendor_id', 'price'
+        ).first()
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    current = (int(instance.category_id), int(instance.vendor_id), int(instance.price))
+    stored = getattr(instance, '_stored_price', None)
+    if stored == current:
+        return
+    category, vendor, price = current
+    if stored is None:
+        apply_price_changes(added=[(category, price)])
+        apply_vendor_price_changes(added=[(vendor, price)])
+        return
+    stored_category, stored_vendor, stored_price = stored
+    if (stored_category, stored_price) != (category, price):
+        apply_price_changes(added=[(category, price)], removed=[(stored_category, stored_price)])
+    if stored_vendor != vendor:
+        # The product's purchases and comments move with it.
+        recompute_vendor_stats(stored_vendor, vendor)
+    elif stored_price != price:
+        apply_vendor_price_changes(added=[(vendor, price)], removed=[(vendor, stored_price)])
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    apply_price_changes(removed=[(int(instance.category_id), int(instance.price))])
+    apply_vendor_price_changes(removed=[(int(instance.vendor_id), int(instance.price))])
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_counts(sender, **kwargs):
+    counts.invalidate(sender)
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        Product.objects.filter(pk=instance.product_id).update(comment_count=F('comment_count') + 1)
+        count_vendor_activity(instance.product_id, comments=1)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    Product.objects.filter(pk=instance.product_id, comment_count__gt=0).update(
+        comment_count=F('comment_count') - 1
+    )
+    count_vendor_activity(instance.product_id, comments=-1)
+
+
+@receiver(pre_save, sender=Purchase)
+def remember_purchase_status(sender, instance, raw=False, update_fields=None, **kwargs):
+    instance._stored_status = None
+    if instance.pk and not raw and (update_fields is None or 'status' in update_fields):
+        instance._stored_status = Purchase.objects.filter(pk=instance.pk).values_list('status', flat=True).first()
+
+
+@receiver(post_save, sender=Purchase)
+def purchase_saved(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    # Only paid purchases count; a purchase is usually saved as pending and paid later.
+    if raw or not (created or update_fields is None or 'status' in update_fields):
+        return
+    paid = instance.status == Purchase.CREATED
+    was_paid = getattr(instance, '_stored_status', None) == Purchase.CREATED
+    if paid != was_paid:
+        count_vendor_activity(instance.product_id, purchases=1 if paid else -1)
+        count_customer_purchase(instance.customer_id, instance.amount, purchases=1 if paid else -1)
+
+
+@receiver(post_delete, sender=Purchase)
+def purchase_deleted(sender, instance, **kwargs):
+    if instance.status == Purchase.CREATED:
+        count_vendor_activity(instance.product_id, purchases=-1)
+        count_customer_purchase(instance.customer_id, instance.amount, purchases=-1)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_detail(sender, instance, **kwargs):
+    detail_cache.bump_versions([instance.pk])
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_commented_product_detail(sender, instance, **kwargs):
+    detail_cache.bump_versions([instance.product_id])
@@ -0,0 +1,344 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Min, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, Greatest, Least
+
+from . import detail_cache
+from .models import CategoryPriceStats, Comment, CustomerStats, Product, Purchase, VendorStats
+
+
+def _recompute_category(category_id):
+    totals = Product.objects.filter(category_id=category_id).aggregate(
+        count=Count('id'), price_sum=Sum('price'), price_min=Min('price'), price_max=Max('price')
+    )
+    if not totals['count']:
+        CategoryPriceStats.objects.filter(category_id=category_id).delete()
+        return
+    CategoryPriceStats.objects.update_or_create(
+        category_id=category_id,
+        defaults={
+            'count': totals['count'],
+            'price_sum': totals['price_sum'],
+            'price_min': totals['price_min'],
+            'price_max': totals['price_max'],
+        }
+    )
+
+
+def _recompute_vendor(vendor_id):
+    totals = Product.objects.filter(vendor_id=vendor_id).aggregate(
+        count=Count('id'), price_sum=Sum('price'), price_min=Min('price'), price_max=Max('price')
+    )
+    if not totals['count']:
+        VendorStats.objects.filter(vendor_id=vendor_id).delete()
+        return
+    VendorStats.objects.update_or_create(
+        vendor_id=vendor_id,
+        defaults={
+            'count': totals['count'],
+            'price_sum': totals['price_sum'],
+            'price_min': totals['price_min'],
+            'price_max': totals['price_max'],
+            'purchase_count': Purchase.objects.filter(product__vendor_id=vendor_id, status=Purchase.CREATED).count(),
+            'comment_count': Comment.objects.filter(product__vendor_id=vendor_id).count(),
+        }
+    )
+
+
+def recompute_vendor_stats(*vendor_ids):
+    with transaction.atomic():
+        for vendor_id in vendor_ids:
+            _recompute_vendor(vendor_id)
+
+
+def _recompute_customer(customer_id):
+    totals = Purchase.objects.filter(customer_id=customer_id, status=Purchase.CREATED).aggregate(
+        purchase_count=Count('id'), total_spent=Coalesce(Sum('amount'), 0)
+    )
+    if not totals['purchase_count']:
+        CustomerStats.objects.filter(customer_id=customer_id).delete()
+        return
+    CustomerStats.objects.update_or_create(customer_id=customer_id, defaults=totals)
+
+
+def _fold_prices(model, key, recompute, added, removed):
+    deltas = defaultdict(lambda: {'count': 0, 'sum': 0, 'low': None, 'high': None, 'removed': set()})
+    for value, price in added:
+        delta = deltas[value]
+        delta['count'] += 1
+        delta['sum'] += price
+        delta['low'] = price if delta['low'] is None else min(delta['low'], price)
+        delta['high'] = price if delta['high'] is None else max(delta['high'], price)
+    for value, price in removed:
+        delta = deltas[value]
+        delta['count'] -= 1
+        delta['sum'] -= price
+        delta['removed'].add(price)
+
+    with transaction.atomic():
+        for value, delta in deltas.items():
+            changes = {
+                'count': F('count') + delta['count'],
+                'price_sum': F('price_sum') + delta['sum'],
+            }
+            if delta['low'] is not None:
+                changes['price_min'] = Least(Coalesce(F('price_min'), delta['low']), delta['low'])
+                changes['price_max'] = Greatest(Coalesce(F('price_max'), delta['high']), delta['high'])
+            stats = model.objects.filter(**{key: value})
+            if not stats.update(**changes):
+                recompute(value)
+                continue
+            if delta['removed']:
+                current = stats.values('count', 'price_min', 'price_max').first()
+                if current['count'] <= 0 or current['price_min'] in delta['removed'] \
+                        or current['price_max'] in delta['removed']:
+                    recompute(value)
+
+
+def apply_price_changes(added=(), removed=()):
+    """
+    Fold product rows into the per-category stats. `added` and `removed` are
+    iterables of (category_id, price) pairs, already applied to the product table.
+
+    Counts and sums are adjusted with F() expressions. Min/max only move outwards
+    on insert; when a removed price was the current extreme, the category's
+    min/max are recomputed from its products.
+    """
+    _fold_prices(CategoryPriceStats, 'category_id', _recompute_category, added, removed)
+
+
+def apply_vendor_price_changes(added=(), removed=()):
+    """
+    apply_price_changes for the per-vendor stats, from (vendor_id, price) pairs.
+    """
+    _fold_prices(VendorStats, 'vendor_id', _recompute_vendor, added, removed)
+
+
+def count_vendor_activity(product_id, purchases=0, comments=0):
+    """
+    Add to the purchase and comment counts of the vendor selling `product_id`.
+    """
+    changes = {}
+    if purchases:
+        changes['purchase_count'] = F('purchase_count') + purchases
+    if comments:
+        changes['comment_count'] = F('comment_count') + comments
+    if changes:
+        vendor = Product.objects.filter(pk=product_id).values('vendor_id')[:1]
+        VendorStats.objects.filter(vendor_id=Subquery(vendor)).update(**changes)
+
+
+def price_summary(category_ids=None):
+    """
+    Max/min/avg price over the given categories, or the whole catalog, read from the
+    stats table. Keys match ``Product.objects.aggregate(Max('price'), Min('price'), Avg('price'))``.
+    """
+    stats = CategoryPriceStats.objects.all()
+    if category_ids is not None:
+        stats = stats.filter(category_id__in=category_ids)
+    totals = stats.aggregate(count=Sum('count'), price_sum=Sum('price_sum'), low=Min('price_min'),
+                             high=Max('price_max'))
+    count = totals['count'] or 0
+    return {
+        'price__max': totals['high'] if count else None,
+        'price__min': totals['low'] if count else None,
+        'price__avg': totals['price_sum'] / count if count else None,
+    }
+
+
+def _expected_stats():
+    rows = Product.objects.values('category_id').annotate(
+        count=Count('id'), price_sum=Sum('price'), price_min=Min('price'), price_max=Max('price')
+    ).order_by()
+    return {
+        row['category_id']: (row['count'], row['price_sum'], row['price_min'], row['price_max'])
+        for row in rows
+    }
+
+
+def rebuild_price_stats():
+    with transaction.atomic():
+        expected = _expected_stats()
+        CategoryPriceStats.objects.all().delete()
+        CategoryPriceStats.objects.bulk_create([
+            CategoryPriceStats(category_id=category_id, count=count, price_sum=price_sum,
+                               price_min=price_min, price_max=price_max)
+            for category_id, (count, price_sum, price_min, price_max) in expected.items()
+        ])
+    return len(expected)
+
+
+def find_price_stats_drift():
+    """
+    Compare the stats table with a fresh aggregate over products. Returns a dict of
+    category_id -> (stored, expected) tuples for every category that disagrees.
+    """
+    expected = _expected_stats()
+    stored = {
+        row[0]: tuple(row[1:])
+        for row in CategoryPriceStats.objects.values_list(
+            'category_id', 'count', 'price_sum', 'price_min', 'price_max'
+        )
+    }
+    return {
+        category_id: (stored.get(category_id), expected.get(category_id))
+        for category_id in stored.keys() | expected.keys()
+        if stored.get(category_id) != expected.get(category_id)
+    }
+
+
+def _comment_counts():
+    return Coalesce(Subquery(
+        Comment.objects.filter(product=OuterRef('pk')).order_by().values('product').annotate(count=Count('id'))
+        .values('count')
+    ), 0)
+
+
+def find_comment_count_drift():
+    """
+    find_price_stats_drift for Product.comment_count: product_id -> (stored, expected)
+    for every product whose count disagrees with its comments.
+    """
+    rows = Product.objects.annotate(expected=_comment_counts()).exclude(comment_count=F('expected'))
+    return {
+        product_id: (stored, expected)
+        for product_id, stored, expected in rows.values_list('id', 'comment_count', 'expected')
+    }
+
+
+def rebuild_comment_counts():
+    """
+    Recount the comments of every product whose comment_count drifted, e.g. after
+    comments were written with bulk_create or raw SQL, which skip the signals.
+    Returns the number of products corrected.
+    """
+    with transaction.atomic():
+        stale = list(find_comment_count_drift())
+        Product.objects.filter(pk__in=stale).update(comment_count=_comment_counts())
+        detail_cache.bump_versions(stale)
+    return len(stale)
+
+
+def count_customer_purchase(customer_id, amount, purchases=1):
+    """
+    Add `purchases` paid purchases of `amount` each (-1 to take one back) to the
+    lifetime summary of `customer_id`.
+    """
+    stats = CustomerStats.objects.filter(customer_id=customer_id)
+    if not stats.update(purchase_count=F('purchase_count') + purchases,
+                        total_spent=F('total_spent') + purchases * (amount or 0)):
+        _recompute_customer(customer_id)
+    elif purchases < 0:
+        stats.filter(purchase_count__lte=0).delete()
+
+
+def vendor_summary(stats):
+    """
+    The storefront figures of a VendorStats row, or of a vendor without products
+    when `stats` is None.
+    """
+    count = stats.count if stats else 0
+    return {
+        'product_count': count,
+        'price_min': stats.price_min if count else None,
+        'price_max': stats.price_max if count else None,
+        'price_avg': stats.price_sum / count if count else None,
+        'purchase_count': stats.purchase_count if stats else 0,
+        'comment_count': stats.comment_count if stats else 0,
+    }
+
+
+def _expected_vendor_stats():
+    purchases = dict(
+        Purchase.objects.filter(status=Purchase.CREATED).values('product__vendor_id').annotate(count=Count('id'))
+        .order_by().values_list('product__vendor_id', 'count')
+    )
+    comments = dict(
+        Comment.objects.values('product__vendor_id').annotate(count=Count('id'))
+        .order_by().values_list('product__vendor_id', 'count')
+    )
+    rows = Product.objects.values('vendor_id').annotate(
+        count=Count('id'), price_sum=Sum('price'), price_min=Min('price'), price_max=Max('price')
+    ).order_by()
+    return {
+        row['vendor_id']: (row['count'], row['price_sum'], row['price_min'], row['price_max'],
+                           purchases.get(row['vendor_id'], 0), comments.get(row['vendor_id'], 0))
+        for row in rows
+    }
+
+
+def rebuild_vendor_stats():
+    with transaction.atomic():
+        expected = _expected_vendor_stats()
+        VendorStats.objects.all().delete()
+        VendorStats.objects.bulk_create([
+            VendorStats(vendor_id=vendor_id, count=count, price_sum=price_sum, price_min=price_min,
+                        price_max=price_max, purchase_count=purchase_count, comment_count=comment_count)
+            for vendor_id, (count, price_sum, price_min, price_max, purchase_count, comment_count)
+            in expected.items()
+        ])
+    return len(expected)
+
+
+def find_vendor_stats_drift():
+    """
+    find_price_stats_drift for the per-vendor stats.
+    """
+    expected = _expected_vendor_stats()
+    stored = {
+        row[0]: tuple(row[1:])
+        for row in VendorStats.objects.values_list(
+            'vendor_id', 'count', 'price_sum', 'price_min', 'price_max', 'purchase_count', 'comment_count'
+        )
+    }
+    return {
+        vendor_id: (stored.get(vendor_id), expected.get(vendor_id))
+        for vendor_id in stored.keys() | expected.keys()
+        if stored.get(vendor_id) != expected.get(vendor_id)
+    }
+
+
+def customer_summary(stats):
+    """
+    The lifetime purchase summary of a CustomerStats row, or of a customer who has
+    not paid for anything when `stats` is None.
+    """
+    return {
+        'purchase_count': stats.purchase_count if stats else 0,
+        'total_spent': stats.total_spent if stats else 0,
+    }
+
+
+def _expected_customer_stats():
+    rows = Purchase.objects.filter(status=Purchase.CREATED).values('customer_id').annotate(
+        purchase_count=Count('id'), total_spent=Coalesce(Sum('amount'), 0)
+    ).order_by()
+    return {row['customer_id']: (row['purchase_count'], row['total_spent']) for row in rows}
+
+
+def rebuild_customer_stats():
+    with transaction.atomic():
+        expected = _expected_customer_stats()
+        CustomerStats.objects.all().delete()
+        CustomerStats.objects.bulk_create([
+            CustomerStats(customer_id=customer_id, purchase_count=purchase_count, total_spent=total_spent)
+            for customer_id, (purchase_count, total_spent) in expected.items()
+        ])
+    return len(expected)
+
+
+def find_customer_stats_drift():
+    """
+    find_price_stats_drift for the per-customer purchase summaries.
+    """
+    expected = _expected_customer_stats()
+    stored = {
+        row[0]: tuple(row[1:])
+        for row in CustomerStats.objects.values_list('customer_id', 'purchase_count', 'total_spent')
+    }
+    return {
+        customer_id: (stored.get(customer_id), expected.get(customer_id))
+        for customer_id in stored.keys() | expected.keys()
+        if stored.get(customer_id) != expected.get(customer_id)
+    }
@@ -1,3 +1,884 @@
-from django.test import TestCase
+import base64
+import gzip
+import json
+import re
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from io import BytesIO, StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import stripe
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.serializers import ListSerializer
+from rest_framework.test import APITestCase
+from rest_framework.throttling import ScopedRateThrottle
+
+from user.models import Vendor, Customer
+from . import counts
+from .checks import check_shared_cache
+from .fake_stripe import start_fake_stripe
+from .ingest import ingest_products, update_products
+from .models import Product, Category, CategoryPriceStats, Cart, Comment, OutboxMessage, Purchase, VendorStats
+from .outbox import lease_batch
+from .pagination import CachedCountPaginator
+from .payments import create_intent
+from .serializers import ProductSerializer
+from .stats import find_comment_count_drift, find_customer_stats_drift, find_price_stats_drift, \
+    find_vendor_stats_drift, rebuild_comment_counts, rebuild_customer_stats, rebuild_price_stats, rebuild_vendor_stats
+
+SCAN = re.compile(r'^SCAN (\w+)$')
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class QueryPlanTestCase(APITestCase):
+    """
+    Calls an endpoint, then runs EXPLAIN QUERY PLAN for every statement it issued
+    and fails if any of them reads a whole table instead of using an index, or
+    sorts every matching row to return one LIMITed page.
+
+    The tables are deliberately not ANALYZEd: without statistics SQLite plans as if
+    every table were large, which is the catalog size these plans have to hold up at.
+    Reads stay on the primary even when the environment configures read replicas.
+    """
+    # Tables that hold one row per category and are meant to be read whole.
+    small_tables = {'product_category', 'product_categorypricestats'}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendors = [
+            Vendor.objects.create(email=f'vendor{index}@example.com', name='Vendor', second_name='Test',
+                                  phone_number='0', description='test')
+            for index in range(3)
+        ]
+        cls.customers = [
+            Customer.objects.create(email=f'customer{index}@example.com', name='Customer', second_name='Test',
+                                    phone_number='0', card_number='4242', address='Street', post_code='0',
+                                    is_Vendor=False)
+            for index in range(3)
+        ]
+        for user in cls.vendors + cls.customers:
+            user.set_password('secret-password')
+            user.save()
+        cls.categories = [Category.objects.create(name=f'Category {index}') for index in range(5)]
+        Product.objects.bulk_create([
+            Product(vendor=cls.vendors[index % 3], category=cls.categories[index % 5],
+                    name=f'Product {index}', description=f'red lamp number {index}', price=index % 97)
+            for index in range(300)
+        ])
+        cls.products = list(Product.objects.order_by('id'))
+        rebuild_price_stats()
+        Comment.objects.bulk_create([
+            Comment(comment=f'Comment {index}', customer=cls.customers[index % 3], product=cls.products[index % 50])
+            for index in range(200)
+        ])
+        rebuild_comment_counts()
+        Purchase.objects.bulk_create([
+            Purchase(customer=cls.customers[index % 3], product=cls.products[index])
+            for index in range(100)
+        ])
+        rebuild_vendor_stats()
+        rebuild_customer_stats()
+        for customer in cls.customers:
+            Cart.objects.create(customer=customer).product.set(cls.products[:5])
+
+    def setUp(self):
+        cache.clear()
+
+    def explain(self, sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def full_scans(self, sql, params, allow, allow_sort):
+        plan = self.explain(sql, params)
+        sorted_page = ' LIMIT ' in sql and any('TEMP B-TREE FOR ORDER BY' in step for step in plan)
+        # A LIMIT without OFFSET that needs no sort stops after a page of rows.
+        bounded = ' LIMIT ' in sql and ' OFFSET ' not in sql and not sorted_page
+        scans = []
+        for step in plan:
+            match = SCAN.match(step)
+            if match and match.group(1) not in self.small_tables | set(allow) and not bounded:
+                scans.append(f'{step}\n    {sql}')
+        if sorted_page and not allow_sort:
+            scans.append(f'USE TEMP B-TREE FOR ORDER BY\n    {sql}')
+        return scans
+
+    @contextmanager
+    def recordStatements(self):
+        statements = []
+
+        def record(execute, sql, params, many, context):
+            statements.append((sql, params, many))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            yield statements
+
+    def assertStatementsUseIndexes(self, statements, allow=(), allow_sort=False):
+        scans = []
+        for sql, params, many in statements:
+            if many or not sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')) or 'sqlite_' in sql:
+                continue
+            scans.extend(self.full_scans(sql, params, allow, allow_sort))
+        self.assertFalse(scans, 'Full table scans:\n' + '\n'.join(scans))
+
+    def assertNoFullScans(self, method, path, data=None, user=None, allow=(), allow_sort=False, **extra):
+        self.client.force_authenticate(user)
+        with self.recordStatements() as statements:
+            response = getattr(self.client, method)(path, data, format='json', **extra)
+            if response.streaming:
+                # Streamed bodies query the database as they are consumed.
+                response.streaming_content = [b''.join(response.streaming_content)]
+        self.assertLess(response.status_code, 400, getattr(response, 'content', None))
+        self.assertStatementsUseIndexes(statements, allow, allow_sort)
+        return response
+
+
+class ProductViewQueryPlanTests(QueryPlanTestCase):
+
+    def test_product_list(self):
+        self.assertNoFullScans('get', '/api/product/list/')
+
+    def test_product_list_filtered(self):
+        category = self.categories[1].id
+        self.assertNoFullScans('get', f'/api/product/list/?category={category}')
+        self.assertNoFullScans('get', '/api/product/list/?name=Product%2010')
+        self.assertNoFullScans('get', f'/api/product/list/?category={category}&name=Product%2011')
+
+    def test_product_list_cursor(self):
+        response = self.assertNoFullScans('get', '/api/product/list/?pagination=cursor&ordering=price&limit=5&count=1')
+        self.assertNoFullScans('get', response.data['next'])
+        category = self.categories[2].id
+        self.assertNoFullScans('get', f'/api/product/list/?pagination=cursor&category={category}&ordering=price')
+
+    def test_product_list_price_filters(self):
+        categories = ','.join(str(category.id) for category in self.categories[:3])
+        for query in (
+            'price_min=10&price_max=50',
+            'price_max=50&ordering=-price',
+            f'category={self.categories[0].id}&price_min=10&ordering=-price',
+            f'category__in={categories}&ordering=price',
+            f'category__in={categories}&price_max=50&ordering=-price',
+            f'category__in={categories}',
+        ):
+            response = self.assertNoFullScans('get', f'/api/product/list/?pagination=cursor&limit=5&{query}')
+            self.assertNoFullScans('get', response.data['next'])
+        category = self.categories[0].id
+        for query in (
+            'price_min=10&price_max=50',
+            'price_max=50&ordering=-price',
+            f'category={category}&price_min=10&ordering=-price',
+            f'category__in={category}&ordering=price',
+            f'category={category}&category__in={categories}&ordering=price',
+            'name=Product%2010&price_max=50',
+        ):
+            with self.subTest(query=query):
+                self.assertNoFullScans('get', f'/api/product/list/?{query}')
+
+    def test_product_list_rejects_unindexed_orderings(self):
+        categories = ','.join(str(category.id) for category in self.categories[:2])
+        for query in (
+            'ordering=name',
+            'price_min=10&ordering=id',
+            'name=Product%2010&ordering=price',
+            f'category={self.categories[0].id}&name=Product%2010&ordering=-price',
+            f'category__in={categories}',
+            f'category__in={categories}&ordering=price',
+            'pagination=cursor&name=Product%2010&ordering=price',
+        ):
+            with self.subTest(query=query):
+                self.assertEqual(self.client.get(f'/api/product/list/?{query}').status_code, 400)
+
+    def test_product_search(self):
+        category = self.categories[0].id
+        # Ranking needs every match scored before the best page is known, so the sort is inherent.
+        self.assertNoFullScans('get', f'/api/product/search/?q=lamp&category={category}&price_min=10&limit=5',
+                               allow_sort=True)
+
+    def test_product_export(self):
+        vendor, category = self.vendors[1], self.categories[2]
+        customer = self.customers[0]
+        # An unfiltered export reads the whole catalog by design, in primary-key order.
+        response = self.assertNoFullScans('get', '/api/product/export/', user=customer, allow={'product_product'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'id,vendor,category,name,description,price,comment_count')
+        self.assertEqual(len(lines), 301)
+
+        response = self.assertNoFullScans('get', f'/api/product/export/?output=ndjson&vendor={vendor.id}',
+                                          user=customer)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(rows[0], ProductSerializer(Product.objects.filter(vendor=vendor).first()).data)
+        self.assertEqual(len(rows), 100)
+
+        response = self.assertNoFullScans(
+            'get', f'/api/product/export/?output=ndjson&compress=gzip&category={category.id}&price_max=10',
+            user=customer
+        )
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        rows = gzip.decompress(b''.join(response.streaming_content)).splitlines()
+        self.assertEqual(len(rows), Product.objects.filter(category=category, price__lte=10).count())
+
+        categories = self.categories[:2]
+        response = self.assertNoFullScans(
+            'get', f'/api/product/export/?output=ndjson&category__in={categories[0].id},{categories[1].id}'
+            f'&ordering=-price', user=customer
+        )
+        rows = [json.loads(line)['id'] for line in b''.join(response.streaming_content).splitlines()]
+        expected = Product.objects.filter(category__in=categories).order_by('-category', '-price', '-id')
+        self.assertEqual(rows, list(expected.values_list('id', flat=True)))
+
+    def test_product_export_is_for_signed_in_users_and_throttled(self):
+        self.assertEqual(self.client.get('/api/product/export/').status_code, 401)
+        self.client.force_authenticate(self.customers[0])
+        path = f'/api/product/export/?vendor={self.vendors[0].id}'
+        with mock.patch.object(ScopedRateThrottle, 'THROTTLE_RATES', {'product_export': '2/hour'}):
+            statuses = [self.client.get(path).status_code for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+
+    def test_category_list(self):
+        self.assertNoFullScans('get', '/api/product/list/category')
+
+    def test_product_detail(self):
+        self.assertNoFullScans('get', f'/api/product/{self.products[0].id}/', user=self.customers[0])
+
+    def test_product_comments(self):
+        customer, product = self.customers[0], self.products[-1]
+        for index in range(7):
+            Comment.objects.create(comment=f'Comment {index}', customer=customer, product=product)
+        detail = self.assertNoFullScans('get', f'/api/product/{product.id}/', user=customer).json()
+        self.assertEqual(detail['product']['comment_count'], 7)
+        # The body is cached for every host, so its link carries none.
+        self.assertTrue(detail['comments_next'].startswith(f'/api/product/{product.id}/comments/?cursor='))
+        with self.settings(ALLOWED_HOSTS=['b.example']):
+            cached = self.client.get(f'/api/product/{product.id}/', HTTP_HOST='b.example').json()
+        self.assertEqual(cached['comments_next'], detail['comments_next'])
+        self.assertEqual([comment['comment'] for comment in detail['comments']],
+                         ['Comment 6', 'Comment 5', 'Comment 4', 'Comment 3', 'Comment 2'])
+        response = self.assertNoFullScans('get', detail['comments_next'], user=customer)
+        self.assertEqual([comment['comment'] for comment in response.data['results']], ['Comment 1', 'Comment 0'])
+        self.assertNoFullScans('get', response.data['previous'], user=customer)
+
+    def test_product_detail_conditional_get(self):
+        customer, product = self.customers[0], self.products[2]
+        self.client.force_authenticate(customer)
+        response = self.client.get(f'/api/product/{product.id}/')
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(f'/api/product/{product.id}/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            self.assertEqual(self.client.get(f'/api/product/{product.id}/').content, response.content)
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(comment='New', customer=customer, product=product)
+        response = self.client.get(f'/api/product/{product.id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['comments'][0]['comment'], 'New')
+        # A version that a process missed the bump of expires with the bodies cached under it.
+        etag = response['ETag']
+        with mock.patch('time.time', return_value=time.time() + settings.PRODUCT_DETAIL_CACHE_TIMEOUT + 1):
+            response = self.client.get(f'/api/product/{product.id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_process_local_cache_is_reported_on_deploy(self):
+        self.assertEqual([issue.id for issue in check_shared_cache(None)], ['product.W001'])
+        with self.settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache'}}):
+            self.assertEqual(check_shared_cache(None), [])
+
+    def test_product_create(self):
+        self.assertNoFullScans('post', '/api/product/create/', {
+            'vendor': self.vendors[0].id, 'category': self.categories[0].id,
+            'name': 'New product', 'description': 'new', 'price': 10,
+        })
+
+    def test_product_bulk_create(self):
+        vendor, category = self.vendors[2], self.categories[0]
+        rows = [{'category': category.id, 'name': f'Bulk {index}', 'description': 'bulk', 'price': 500 + index}
+                for index in range(5)]
+        response = self.assertNoFullScans('post', '/api/product/create/bulk/', rows + [{'name': 'No price'}],
+                                          user=vendor)
+        self.assertEqual(response.data['created'], 5)
+        self.assertEqual([error['row'] for error in response.data['errors']], [6])
+
+        body = '\n'.join(['{"category": %d, "name": "Line", "description": "ndjson", "price": 1}' % category.id,
+                           '{not json', '{"category": 0, "name": "Lost", "description": "x", "price": 1}', ''])
+        response = self.client.post('/api/product/create/bulk/', body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['created'], response.data['failed']), (1, 2))
+        self.assertEqual(Product.objects.filter(vendor=vendor, name__startswith='Bulk').count(), 5)
+        self.assertEqual(category.price_stats.price_max, 504)
+        self.assertEqual(find_vendor_stats_drift(), {})
+
+    def test_product_bulk_update(self):
+        vendor, category = self.vendors[0], self.categories[4]
+        owned, other = self.products[0], self.products[1]
+        self.assertEqual(owned.vendor, vendor)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.assertNoFullScans('patch', '/api/product/update/bulk/', [
+                {'id': owned.id, 'price': 1000, 'category': category.id},
+                {'id': self.products[3].id, 'name': 'Renamed'},
+                {'id': other.id, 'price': 1},
+                {'id': 0, 'price': 1},
+                {'id': owned.id, 'price': 2},
+                {'price': 3},
+            ], user=vendor)
+        self.assertEqual((response.data['updated'], response.data['failed']), (2, 4))
+        self.assertEqual([(error['row'], error.get('conflict', False)) for error in response.data['errors']],
+                         [(6, False), (5, True), (3, True), (4, False)])
+        owned.refresh_from_db()
+        self.assertEqual((owned.price, owned.category, owned.name), (1000, category, 'Product 0'))
+        self.assertEqual(Product.objects.get(id=self.products[3].id).name, 'Renamed')
+        self.assertEqual(category.price_stats.price_max, 1000)
+        self.assertEqual(find_vendor_stats_drift(), {})
+
+    def test_product_update(self):
+        product = self.products[10]
+        self.assertNoFullScans('put', f'/api/product/{product.id}/update/', {
+            'vendor': product.vendor_id, 'category': self.categories[3].id,
+            'name': 'Renamed product', 'description': 'renamed', 'price': 0,
+        }, user=self.vendors[0])
+
+    def test_product_delete(self):
+        self.assertNoFullScans('delete', f'/api/product/{self.products[1].id}/delete/')
+        self.assertEqual(find_vendor_stats_drift(), {})
+
+    def test_comment_create(self):
+        customer = self.customers[0]
+        self.assertNoFullScans('post', f'/api/product/{customer.id}/comment/', {
+            'comment': 'Nice', 'customer': customer.id,
+        }, user=customer)
+        self.assertEqual(find_vendor_stats_drift(), {})
+
+    def test_category_create_update_delete(self):
+        self.assertNoFullScans('post', '/api/product/create/category', {'name': 'New category'})
+        category = self.categories[4].id
+        self.assertNoFullScans('put', f'/api/product/{category}/update/category', {'name': 'Renamed'})
+        self.assertNoFullScans('delete', f'/api/product/{category}/delete/category')
+
+    @mock.patch('stripe.PaymentIntent.create', return_value=SimpleNamespace(id='pi_1', client_secret='secret'))
+    def test_payment(self, create_intent):
+        customer = self.customers[1]
+        self.assertNoFullScans('post', f'/api/product/payment/{self.products[7].id}/', {
+            'amount': 100, 'card_number': '4242',
+        }, user=customer)
+        self.assertEqual(find_vendor_stats_drift(), {})
+        self.assertEqual(find_customer_stats_drift(), {})
+        self.assertEqual(customer.stats.total_spent, 100)
+
+    @mock.patch('stripe.PaymentIntent.create', return_value=SimpleNamespace(id='pi_1', client_secret='secret'))
+    def test_payment_idempotency(self, create_intent):
+        customer = self.customers[1]
+        self.client.force_authenticate(customer)
+        path, data = f'/api/product/payment/{self.products[7].id}/', {'amount': 100, 'card_number': '4242424242424242'}
+        first = self.client.post(path, data, format='json', HTTP_IDEMPOTENCY_KEY='order-1')
+        retry = self.client.post(path, data, format='json', HTTP_IDEMPOTENCY_KEY='order-1')
+        self.assertEqual((first.status_code, retry.status_code), (200, 200))
+        self.assertEqual(first.data, retry.data)
+        self.assertEqual(create_intent.call_count, 1)
+        self.assertEqual(create_intent.call_args.kwargs['idempotency_key'], f'purchase-{first.data["purchase"]}')
+        self.assertEqual(create_intent.call_args.kwargs['metadata']['card_last4'], '4242')
+        self.assertEqual(Purchase.objects.filter(idempotency_key='order-1').count(), 1)
+        response = self.client.post(path, dict(data, amount=200), format='json', HTTP_IDEMPOTENCY_KEY='order-1')
+        self.assertEqual(response.status_code, 422)
+        # Keys are scoped to the customer: another customer's identical request is a payment of their own.
+        other = self.customers[2]
+        self.client.force_authenticate(other)
+        response = self.client.post(path, data, format='json', HTTP_IDEMPOTENCY_KEY='order-1')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.data['purchase'], first.data['purchase'])
+        self.assertEqual(Purchase.objects.get(id=response.data['purchase']).customer_id, other.id)
+        self.assertEqual(self.client.get(f'/api/product/purchase/{first.data["purchase"]}/').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/product/purchase/{response.data["purchase"]}/').status_code, 200)
+
+    @mock.patch('stripe.PaymentIntent.create', return_value=SimpleNamespace(id='pi_1', client_secret='secret'))
+    def test_payment_queued(self, create_intent):
+        customer = self.customers[1]
+        response = self.assertNoFullScans('post', f'/api/product/payment/{self.products[4].id}/', {
+            'amount': 100, 'card_number': '4242',
+        }, user=customer, HTTP_PREFER='respond-async')
+        self.assertEqual((response.status_code, response.data['status']), (202, Purchase.PENDING))
+        self.assertFalse(create_intent.called)
+        with self.recordStatements() as statements:
+            call_command('process_outbox', once=True, concurrency=1)
+        self.assertStatementsUseIndexes(statements)
+        response = self.assertNoFullScans('get', response['Location'], user=customer)
+        self.assertEqual((response.data['status'], response.data['client_secret']), (Purchase.CREATED, 'secret'))
+        self.assertFalse(Cart.objects.filter(customer=customer, product=self.products[4]).exists())
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_payment_against_fake_stripe(self):
+        server = start_fake_stripe()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        customer = self.customers[1]
+        self.client.force_authenticate(customer)
+        with self.settings(STRIPE_API_BASE=server.url, STRIPE_MAX_NETWORK_RETRIES=0):
+            response = self.client.post(f'/api/product/payment/{self.products[7].id}/', {
+                'amount': 100, 'card_number': '4242',
+            }, format='json')
+            self.assertEqual(response.status_code, 200)
+            purchase = Purchase.objects.get(id=response.data['purchase'])
+            self.assertTrue(response.data['client_secret'].startswith(purchase.payment_intent_id + '_secret_'))
+            # A lost response makes the worker ask again; Stripe replays the stored intent.
+            Purchase.objects.filter(id=purchase.id).update(status=Purchase.PENDING)
+            self.assertEqual(create_intent(Purchase.objects.get(id=purchase.id)).payment_intent_id,
+                             purchase.payment_intent_id)
+        self.assertEqual(server.created, 1)
+
+
+class PriceStatsTests(QueryPlanTestCase):
+
+    def stats(self, category):
+        stats = CategoryPriceStats.objects.filter(category=category)
+        return stats.values_list('count', 'price_sum', 'price_min', 'price_max').first()
+
+    def create(self, category, *prices):
+        return [Product.objects.create(vendor=self.vendors[0], category=category, name='Priced',
+                                       description='priced', price=price) for price in prices]
+
+    def test_deleting_the_current_extremes(self):
+        category = Category.objects.create(name='Extremes')
+        low, middle, high, also_high = self.create(category, 5, 10, 20, 20)
+        self.assertEqual(self.stats(category), (4, 55, 5, 20))
+        low.delete()
+        self.assertEqual(self.stats(category), (3, 50, 10, 20))
+        # Another product still has the highest price.
+        high.delete()
+        self.assertEqual(self.stats(category), (2, 30, 10, 20))
+        also_high.delete()
+        self.assertEqual(self.stats(category), (1, 10, 10, 10))
+        middle.delete()
+        self.assertIsNone(self.stats(category))
+        self.assertEqual(find_price_stats_drift(), {})
+
+    def test_repricing_and_moving_products(self):
+        source, target = Category.objects.create(name='Source'), Category.objects.create(name='Target')
+        cheap, dear = self.create(source, 3, 30)
+        self.create(target, 15)
+        dear.price = 1
+        dear.save()
+        self.assertEqual(self.stats(source), (2, 4, 1, 3))
+        cheap.category, cheap.price = target, 40
+        cheap.save()
+        self.assertEqual(self.stats(source), (1, 1, 1, 1))
+        self.assertEqual(self.stats(target), (2, 55, 15, 40))
+        dear.category = target
+        dear.save()
+        self.assertIsNone(self.stats(source))
+        self.assertEqual(self.stats(target), (3, 56, 1, 40))
+        Product.objects.filter(category=target, price=40).delete()
+        self.assertEqual(self.stats(target), (2, 16, 1, 15))
+        self.assertEqual(find_price_stats_drift(), {})
+
+    def test_check_and_rebuild_commands(self):
+        call_command('check_price_stats', stdout=StringIO())
+        CategoryPriceStats.objects.filter(category=self.categories[0]).update(price_max=1000)
+        # Written without signals, like a raw import.
+        Product.objects.filter(id=self.products[1].id).update(price=500)
+        stderr = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('check_price_stats', stdout=StringIO(), stderr=stderr)
+        self.assertEqual(len(stderr.getvalue().splitlines()), 2)
+        call_command('rebuild_price_stats', stdout=StringIO())
+        call_command('check_price_stats', stdout=StringIO())
+        self.assertEqual(self.categories[1].price_stats.price_max, 500)
+
+
+class CountServiceTests(QueryPlanTestCase):
+
+    def create_product(self):
+        return Product.objects.create(vendor=self.vendors[0], category=self.categories[0], name='Counted',
+                                      description='counted', price=1)
+
+    def test_cached_count_is_invalidated_on_commit(self):
+        products = Product.objects.filter(category=self.categories[0])
+        self.assertEqual(counts.cached_count(products), 60)
+        with self.assertNumQueries(0):
+            self.assertEqual(counts.cached_count(products), 60)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.create_product()
+            # Until the write commits, readers keep the count they cached before it.
+            self.assertEqual(counts.cached_count(products), 60)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(counts.cached_count(products), 61)
+        self.assertEqual(counts.cached_count(Product.objects.all()), 301)
+
+    def test_estimate_above_the_threshold(self):
+        self.assertIsNone(counts.estimated_count(Product))
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE product_product')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_product()
+        self.assertEqual(counts.estimated_count(Product), 300)
+        with self.settings(COUNT_ESTIMATE_THRESHOLD=300):
+            self.assertEqual(counts.row_count(Product.objects.all(), estimated=True), 300)
+            self.assertEqual(counts.row_count(Product.objects.all()), 301)
+            # Filtered counts are always exact.
+            self.assertEqual(counts.row_count(Product.objects.filter(price=1), estimated=True), 5)
+        with self.settings(COUNT_ESTIMATE_THRESHOLD=301):
+            self.assertEqual(counts.row_count(Product.objects.all(), estimated=True), 301)
+
+    def test_paginator(self):
+        paginator = CachedCountPaginator(Product.objects.filter(vendor=self.vendors[1]).order_by('id'), 30)
+        self.assertEqual((paginator.count, paginator.num_pages), (100, 4))
+        self.assertEqual(len(paginator.page(4)), 10)
+        with self.assertNumQueries(0):
+            self.assertEqual(CachedCountPaginator(paginator.object_list, 30).count, 100)
+        response = self.client.get('/api/product/list/?page_size=last')
+        self.assertEqual(response.data['count'], 300)
+        self.assertEqual(len(response.data['results']['products']), 2)
+        self.assertIsNone(response.data['next'])
+
+
+class SearchTests(QueryPlanTestCase):
+
+    def search(self, query):
+        response = self.client.get('/api/product/search/', {'limit': 100, **query})
+        self.assertEqual(response.status_code, 200)
+        return [product['id'] for product in response.data['results']]
+
+    def create(self, name, description, price=10, category=0):
+        return Product.objects.create(vendor=self.vendors[0], category=self.categories[category], name=name,
+                                      description=description, price=price).id
+
+    def test_ranking(self):
+        often = self.create('Brass lamp', 'brass base, brass shade, brass chain')
+        named = self.create('Brass hook', 'a hook for coats')
+        described = self.create('Coat hook', 'a sturdy hook for coats and hats, finished in brass')
+        self.assertEqual(self.search({'q': 'brass'}), [often, named, described])
+        self.assertEqual(self.search({'q': 'brass hook'}), [named, described])
+        # The last word also matches as a prefix.
+        self.assertEqual(self.search({'q': 'bra'}), [often, named, described])
+        self.assertEqual(self.search({'q': 'brass', 'price_max': 5}), [])
+        self.assertEqual(self.search({'q': 'brass', 'category': self.categories[1].id}), [])
+        self.assertEqual(self.search({'q': '!!'}), [])
+
+    def walk(self, path):
+        ids = []
+        while path:
+            response = self.client.get(path)
+            ids.extend(product['id'] for product in response.data['results'])
+            path = response.data['next']
+        return ids
+
+    def test_pages(self):
+        ids = self.walk('/api/product/search/?q=lamp&limit=7')
+        self.assertEqual(sorted(ids), [product.id for product in self.products])
+        self.assertEqual(ids, self.walk('/api/product/search/?q=lamp&limit=100'))
+
+    def test_index_follows_writes(self):
+        product = self.create('Walnut stool', 'a three legged stool')
+        self.assertEqual(self.search({'q': 'walnut'}), [product])
+        Product.objects.filter(id=product).update(name='Oak stool')
+        self.assertEqual(self.search({'q': 'walnut'}), [])
+        self.assertEqual(self.search({'q': 'oak'}), [product])
+        # Price changes leave the text index alone.
+        Product.objects.filter(id=product).update(price=99)
+        self.assertEqual(self.search({'q': 'oak', 'price_min': 99}), [product])
+        Product.objects.filter(id=product).delete()
+        self.assertEqual(self.search({'q': 'oak'}), [])
+        Product.objects.bulk_create([
+            Product(vendor=self.vendors[1], category=self.categories[0], name=f'Teak {index}',
+                    description='bulk', price=1)
+            for index in range(3)
+        ])
+        self.assertEqual(len(self.search({'q': 'teak'})), 3)
+
+
+class KeysetPaginationTests(QueryPlanTestCase):
+
+    def walk(self, path, link):
+        pages = []
+        while path:
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 200)
+            pages.append([product['id'] for product in response.data['results']['products']])
+            path = response.data[link]
+        return pages
+
+    def assertWalksBothWays(self, query, expected):
+        pages = self.walk(f'/api/product/list/?pagination=cursor&limit=7&{query}', 'next')
+        self.assertEqual([product for page in pages for product in page], expected)
+        self.assertTrue(all(len(page) == 7 for page in pages[:-1]))
+        # Back from the last page, every page comes out as it did going forwards.
+        last = self.client.get(f'/api/product/list/?pagination=cursor&limit=7&{query}')
+        while last.data['next']:
+            last = self.client.get(last.data['next'])
+        self.assertEqual(self.walk(last.data['previous'], 'previous'), pages[-2::-1])
+
+    def test_pages_neither_skip_nor_repeat_rows(self):
+        products = Product.objects.filter(category__in=self.categories[:2], price__lte=30)
+        categories = f'{self.categories[0].id},{self.categories[1].id}'
+        for query, ordering in (
+            ('', ('id',)),
+            # Prices repeat, so pages often end inside a run of equal prices.
+            ('ordering=price', ('price', 'id')),
+            ('ordering=-price', ('-price', '-id')),
+            (f'category__in={categories}&price_max=30&ordering=price', ('price', 'id')),
+        ):
+            queryset = products if 'category__in' in query else Product.objects.all()
+            with self.subTest(query=query):
+                self.assertWalksBothWays(query, list(queryset.order_by(*ordering).values_list('id', flat=True)))
+
+    def test_malformed_cursors_are_not_found(self):
+        for position in (['abc'], [{'a': 1}], [None], [1, 2], [10 ** 30]):
+            cursor = base64.urlsafe_b64encode(json.dumps({'p': position, 'r': 0}).encode()).decode()
+            with self.subTest(position=position):
+                response = self.client.get(f'/api/product/list/?pagination=cursor&cursor={cursor}')
+                self.assertEqual(response.status_code, 404)
+                response = self.client.get(f'/api/user/vendor/profile/{self.vendors[0].id}?cursor={cursor}')
+                self.assertEqual(response.status_code, 404)
+        cursor = base64.urlsafe_b64encode(b'{"p":["best",1],"r":0}').decode()
+        self.assertEqual(self.client.get(f'/api/product/search/?q=lamp&cursor={cursor}').status_code, 404)
+
+
+class OutboxTests(QueryPlanTestCase):
+
+    def pay(self, customer):
+        self.client.force_authenticate(customer)
+        response = self.client.post(f'/api/product/payment/{self.products[4].id}/',
+                                    {'amount': 100, 'card_number': '4242'},
+                                    format='json', HTTP_PREFER='respond-async')
+        self.assertEqual(response.status_code, 202)
+        return Purchase.objects.get(id=response.data['purchase'])
+
+    def test_purchase_and_message_are_written_together(self):
+        with mock.patch('product.outbox.OutboxMessage.objects.create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.pay(self.customers[1])
+        self.assertFalse(Purchase.objects.filter(customer=self.customers[1], amount=100).exists())
+
+    @mock.patch('stripe.PaymentIntent.create', side_effect=stripe.APIConnectionError('Stripe is down'))
+    def test_failed_delivery_is_retried_with_backoff(self, create):
+        purchase = self.pay(self.customers[1])
+        with self.assertLogs('product.outbox', 'WARNING'):
+            call_command('process_outbox', once=True, concurrency=1)
+        message = OutboxMessage.objects.get()
+        self.assertEqual((message.attempts, message.lease, message.locked_until), (1, '', None))
+        self.assertGreater(message.available_at, timezone.now())
+        self.assertIn('Stripe is down', message.last_error)
+        # Not due yet.
+        call_command('process_outbox', once=True, concurrency=1)
+        self.assertEqual(create.call_count, 1)
+
+        OutboxMessage.objects.update(available_at=timezone.now())
+        create.side_effect, create.return_value = None, SimpleNamespace(id='pi_1', client_secret='secret')
+        call_command('process_outbox', once=True, concurrency=1)
+        purchase.refresh_from_db()
+        self.assertEqual(purchase.status, Purchase.CREATED)
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    @mock.patch('stripe.PaymentIntent.create', side_effect=stripe.APIConnectionError('Stripe is down'))
+    def test_message_is_given_up_after_max_attempts(self, create):
+        self.pay(self.customers[1])
+        with self.settings(OUTBOX_MAX_ATTEMPTS=1), self.assertLogs('product.outbox', 'WARNING'):
+            call_command('process_outbox', once=True, concurrency=1)
+        message = OutboxMessage.objects.get()
+        self.assertIsNone(message.available_at)
+
+    def test_leases_are_exclusive_until_they_expire(self):
+        self.pay(self.customers[1])
+        self.pay(self.customers[2])
+        with self.recordStatements() as statements:
+            first = lease_batch(1)
+        self.assertStatementsUseIndexes(statements)
+        self.assertEqual(len(first), 1)
+        self.assertEqual([message.id for message in lease_batch(10)],
+                         list(OutboxMessage.objects.exclude(id=first[0].id).values_list('id', flat=True)))
+        self.assertEqual(lease_batch(10), [])
+        OutboxMessage.objects.filter(id=first[0].id).update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual([(message.id, message.attempts) for message in lease_batch(10)], [(first[0].id, 2)])
+
+
+class IngestTests(QueryPlanTestCase):
+
+    def row(self, name, category=None, description='bulk'):
+        category = self.categories[0].id if category is None else category
+        return {'category': category, 'name': name, 'description': description, 'price': 1}
+
+    @mock.patch('product.ingest.MAX_ROW_SIZE', 200)
+    @mock.patch('product.ingest.READ_SIZE', 64)
+    def test_oversized_rows_are_skipped(self):
+        vendor = self.vendors[0].id
+        rows = [self.row('First'), self.row('Long', description='x' * 500), self.row('Last')]
+        body = '\n'.join(json.dumps(row) for row in rows).encode()
+        result = ingest_products(BytesIO(body), vendor)
+        self.assertEqual((result.done, result.failed), (2, 1))
+        self.assertEqual(result.errors[0]['row'], 2)
+        rows[1]['description'] = '"[{,]}' * 100
+        result = ingest_products(BytesIO(json.dumps(rows).encode()), vendor)
+        self.assertEqual((result.done, result.failed), (2, 1))
+        self.assertEqual(result.errors[0]['row'], 2)
+        self.assertEqual(Product.objects.filter(name__in=['First', 'Last']).count(), 4)
+        result = ingest_products(BytesIO(json.dumps(rows[:2]).encode()), vendor)
+        self.assertEqual((result.done, result.failed), (1, 1))
+
+    def test_failed_chunk_reports_each_row_once(self):
+        rows = [self.row('Kept'), self.row('Unknown', category=0), self.row('Also kept')]
+        body = '\n'.join(json.dumps(row) for row in rows).encode()
+        with mock.patch('product.models.Product.objects.bulk_create', side_effect=DatabaseError('disk full')):
+            result = ingest_products(BytesIO(body), self.vendors[0].id)
+        self.assertEqual((result.done, result.failed), (0, 3))
+        self.assertEqual([error['row'] for error in result.errors], [2, 1, 3])
+        self.assertEqual(result.errors[1]['errors'], {'non_field_errors': ['disk full']})
+
+    def test_repeated_patch_in_a_later_chunk(self):
+        product = self.products[0]
+        body = '\n'.join(json.dumps({'id': product.id, 'price': price}) for price in (11, 12)).encode()
+        result = update_products(BytesIO(body), product.vendor_id, chunk_size=1)
+        self.assertEqual((result.done, result.failed), (1, 1))
+        self.assertEqual((result.errors[0]['row'], result.errors[0]['conflict']), (2, True))
+        self.assertEqual(Product.objects.get(id=product.id).price, 11)
+        # Within one chunk as well, whether or not the product exists.
+        body = '\n'.join(json.dumps({'id': id, 'price': 13}) for id in (product.id, 10 ** 12, product.id, 10 ** 12))
+        result = update_products(BytesIO(body.encode()), product.vendor_id)
+        self.assertEqual((result.done, result.failed), (1, 3))
+        self.assertEqual([error.get('conflict', False) for error in result.errors], [True, True, False])
+
+
+class VendorStatsTests(QueryPlanTestCase):
+
+    def test_storefront(self):
+        vendor = self.vendors[1]
+        with self.settings(VENDOR_PRODUCTS_PAGE_SIZE=60):
+            response = self.assertNoFullScans('get', f'/api/user/vendor/profile/{vendor.id}')
+            # The vendor with its stats, then a page of its products.
+            with self.assertNumQueries(2):
+                self.client.get(f'/api/user/vendor/profile/{vendor.id}')
+            products = [product.id for product in self.products if product.vendor_id == vendor.id]
+            self.assertEqual(response.data['stats'], {
+                'product_count': 100, 'price_min': 0, 'price_max': 96, 'price_avg': 46.68,
+                'purchase_count': 33, 'comment_count': 68,
+            })
+            self.assertEqual([product['id'] for product in response.data['product']], products[:60])
+            response = self.assertNoFullScans('get', response.data['product_next'])
+            self.assertEqual([product['id'] for product in response.data['product']], products[60:])
+            self.assertIsNone(response.data['product_next'])
+        self.assertEqual(self.client.get(f'/api/user/vendor/profile/{vendor.id}?cursor=x').status_code, 404)
+
+    def test_vendor_without_products(self):
+        vendor = Vendor.objects.create(email='new-vendor@example.com', name='New', second_name='Vendor',
+                                       phone_number='0', description='new')
+        response = self.client.get(f'/api/user/vendor/profile/{vendor.id}')
+        self.assertEqual(response.data['stats'], {
+            'product_count': 0, 'price_min': None, 'price_max': None, 'price_avg': None,
+            'purchase_count': 0, 'comment_count': 0,
+        })
+        self.assertEqual(response.data['product'], [])
+        product = Product.objects.create(vendor=vendor, category=self.categories[0], name='First',
+                                         description='first', price=7)
+        self.assertEqual(VendorStats.objects.get(vendor=vendor).count, 1)
+        product.delete()
+        self.assertFalse(VendorStats.objects.filter(vendor=vendor).exists())
+
+    @mock.patch('stripe.PaymentIntent.create', return_value=SimpleNamespace(id='pi_1', client_secret='secret'))
+    def test_counts_follow_purchases_and_comments(self, create):
+        product = self.products[200]
+        customer = self.customers[0]
+        stats = VendorStats.objects.filter(vendor_id=product.vendor_id)
+        before = stats.values_list('purchase_count', 'comment_count').get()
+        # A pending purchase is counted once it is paid.
+        purchase = Purchase.objects.create(customer=customer, product=product, amount=1, status=Purchase.PENDING)
+        self.assertEqual(stats.get().purchase_count, before[0])
+        create_intent(purchase)
+        self.assertEqual(stats.get().purchase_count, before[0] + 1)
+        comment = Comment.objects.create(comment='Nice', customer=customer, product=product)
+        self.assertEqual(stats.values_list('purchase_count', 'comment_count').get(), (before[0] + 1, before[1] + 1))
+        comment.delete()
+        purchase.delete()
+        self.assertEqual(stats.values_list('purchase_count', 'comment_count').get(), before)
+
+    def test_product_moves_to_another_vendor(self):
+        product = self.products[0]
+        product.vendor = self.vendors[2]
+        product.save()
+        self.assertEqual(find_vendor_stats_drift(), {})
+        call_command('check_vendor_stats', stdout=StringIO())
+        VendorStats.objects.filter(vendor=self.vendors[2]).update(comment_count=0)
+        with self.assertRaises(CommandError):
+            call_command('check_vendor_stats', stdout=StringIO(), stderr=StringIO())
+        call_command('rebuild_vendor_stats', stdout=StringIO())
+        self.assertEqual(find_vendor_stats_drift(), {})
+
+
+class CommentCountTests(QueryPlanTestCase):
+
+    def test_signals_keep_counts(self):
+        product, customer = self.products[0], self.customers[0]
+        self.assertEqual(Product.objects.get(id=product.id).comment_count, 4)
+        comment = Comment.objects.create(comment='One more', customer=customer, product=product)
+        self.assertEqual(Product.objects.get(id=product.id).comment_count, 5)
+        comment.delete()
+        Comment.objects.filter(product=product)[:1].get().delete()
+        self.assertEqual(Product.objects.get(id=product.id).comment_count, 3)
+        self.assertEqual(find_comment_count_drift(), {})
+
+    def test_check_and_rebuild_commands(self):
+        product = self.products[60]
+        call_command('check_comment_counts', stdout=StringIO())
+        Comment.objects.bulk_create([Comment(comment='Bulk', customer=self.customers[1], product=product)
+                                     for _ in range(2)])
+        stderr = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('check_comment_counts', stdout=StringIO(), stderr=stderr)
+        self.assertEqual(stderr.getvalue(), f'product {product.id}: stored comment count = 0, expected 2\n')
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            call_command('rebuild_comment_counts', stdout=StringIO())
+        self.assertEqual(len(callbacks), 1)
+        call_command('check_comment_counts', stdout=StringIO())
+        self.assertEqual(Product.objects.get(id=product.id).comment_count, 2)
+
+
+class ProductListSerializerTests(QueryPlanTestCase):
+
+    def test_matches_model_serializer(self):
+        renderer = JSONRenderer()
+        queryset = Product.objects.filter(vendor=self.vendors[0]).order_by('-price', '-id')
+        expected = renderer.render(ListSerializer(queryset, child=ProductSerializer()).data)
+        with self.assertNumQueries(1):
+            self.assertEqual(renderer.render(ProductSerializer(queryset, many=True).data), expected)
+        self.assertEqual(renderer.render(ProductSerializer(list(queryset), many=True).data), expected)
+        cart = Cart.objects.get(customer=self.customers[0])
+        self.assertEqual(renderer.render(ProductSerializer(cart.product, many=True).data),
+                         renderer.render(ListSerializer(cart.product.all(), child=ProductSerializer()).data))
+
+
+class AsyncCatalogViewTests(QueryPlanTestCase):
+
+    def assertSameAsSync(self, path, user=None, **extra):
+        self.client.force_authenticate(user)
+        expected = self.client.get(f'/api/{path}', **extra)
+        response = self.client.get(f'/api/async/{path}', **extra)
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response.get('WWW-Authenticate'), expected.get('WWW-Authenticate'))
+        self.assertEqual(response.content.replace(b'/api/async/', b'/api/'), expected.content)
+
+    def test_product_list(self):
+        category = self.categories[1].id
+        for query in ('', '?page_size=3', f'?category={category}&price_max=50&ordering=-price&page_size=2',
+                      '?page_size=999', '?page_size=last', '?page_size=x', '?ordering=name',
+                      '?pagination=cursor&limit=3'):
+            self.assertSameAsSync(f'product/list/{query}')
+
+    def test_category_list(self):
+        self.assertSameAsSync('product/list/category')
+
+    def test_product_detail(self):
+        product = self.products[0]
+        self.assertSameAsSync(f'product/{product.id}/')
+        self.assertSameAsSync(f'product/{product.id}/', user=self.customers[0])
+        self.assertSameAsSync(f'product/{product.id}/', HTTP_AUTHORIZATION='Bearer not-a-token')
+        cache.clear()
+        self.assertSameAsSync('product/0/', user=self.customers[0])
+
+    def test_vendor_detail(self):
+        self.assertSameAsSync(f'user/vendor/profile/{self.vendors[0].id}')
+        self.assertSameAsSync('user/vendor/profile/0')
@@ -1,21 +1,30 @@
 from django.urls import path
 from .views import ProductListAPIView, ProductCreateAPIView, ProductDetailAPIView, CategoryCreateAPIView, \
     CategoryListAPIView, CategoryDeleteAPIView, CategoryUpdateAPIView, ProductDeleteAPIView, ProductUpdateAPIView, \
-    ProductFilter, PaymentAPIView, CommentCreateAPIView
+    ProductFilter, PaymentAPIView, CommentCreateAPIView, ProductSearchAPIView, CommentListAPIView, \
+    ProductDetailCacheStatsAPIView, ProductBulkCreateAPIView, ProductBulkUpdateAPIView, \
+    ProductExportAPIView, PurchaseStatusAPIView
 from .models import Product
 from django_filters.views import FilterView
 
 urlpatterns = [
     path('list/', ProductListAPIView.as_view(), name='product-list'),
     path('list/category', CategoryListAPIView.as_view(), name='category-list'),
+    path('export/', ProductExportAPIView.as_view(), name='product-export'),
+    path('search/', ProductSearchAPIView.as_view(), name='product-search'),
     path('create/', ProductCreateAPIView.as_view(), name='product-create'),
+    path('create/bulk/', ProductBulkCreateAPIView.as_view(), name='product-bulk-create'),
+    path('update/bulk/', ProductBulkUpdateAPIView.as_view(), name='product-bulk-update'),
     path('create/category', CategoryCreateAPIView.as_view(), name='category-create'),
     path('<int:id>/delete/category', CategoryDeleteAPIView.as_view(), name='category-delete'),
     path('<int:id>/delete/', ProductDeleteAPIView.as_view(), name='product-delete'),
     path('<int:id>/update/category', CategoryUpdateAPIView.as_view(), name='category-delete'),
     path('<int:id>/update/', ProductUpdateAPIView.as_view(), name='product-delete'),
     path('<int:id>/comment/', CommentCreateAPIView.as_view(), name='product-comment'),
+    path('<int:id>/comments/', CommentListAPIView.as_view(), name='product-comments'),
     path('<int:id>/', ProductDetailAPIView.as_view(), name='product-detail'),
+    path('cache/stats/', ProductDetailCacheStatsAPIView.as_view(), name='product-detail-cache-stats'),
     path('list/', FilterView.as_view(filterset_class=ProductFilter, queryset=Product.objects.all()), name='product-list'),
-    path('payment/<int:id>/', PaymentAPIView.as_view(), name='create-checkout-session')
+    path('payment/<int:id>/', PaymentAPIView.as_view(), name='create-checkout-session'),
+    path('purchase/<int:id>/', PurchaseStatusAPIView.as_view(), name='purchase-status'),
 ]
@@ -1,33 +1,187 @@
 from django.shortcuts import render
 from django.views import View
+from django import forms
 from user.models import Customer
 from django.conf import settings
 from rest_framework.generics import ListAPIView
-from django.http import Http404, JsonResponse
+from django.http import Http404, JsonResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import parse_etags
+from django.urls import reverse
+from django.db import router
 from rest_framework.views import APIView
 from rest_framework import permissions, status
+from rest_framework.throttling import ScopedRateThrottle
 from rest_framework.response import Response
+from market.db_router import ReplicaReadMixin
+from market.renderers import FastJSONRenderer
+from rest_framework.exceptions import NotFound, ValidationError
 from .models import Product, Category, Cart, Comment, Purchase
-from .serializers import ProductSerializer, CategorySerializer, CommentSerializer
+from .serializers import ProductSerializer, CategorySerializer, CommentSerializer, ProductSearchQuerySerializer, \
+    PaymentSerializer
+from .payments import GatewayBusy, IdempotencyConflict, claim, create_intent, start_purchase
 from user.permissions import IsVendorPermission, IsOwnerOrReadOnly
 from django_filters import rest_framework as filters
 from rest_framework.pagination import PageNumberPagination
+from .pagination import CachedCountPaginator, KeysetPagination, SearchPagination, cursor_next_link
+from .search import search_products
+from .ingest import ingest_products, update_products
+from .export import EXPORT_FORMATS, export_filename, export_products
+from . import detail_cache
+from market import metrics
+from .stats import price_summary
 from django.db.models import Avg, Min, Max
-import stripe
+from django.core.paginator import InvalidPage
+from io import BytesIO
+
+
+# Each ordering ends in the primary key so it is total, and is served by an index:
+# the rowid for id, (price, id) / (category, price, id) for price. A name filter is
+# only served in id order, by (name) / (category, name) and the rowid they end in.
+PRODUCT_ORDERINGS = {
+    'id': ('id',),
+    'price': ('price', 'id'),
+    '-price': ('-price', '-id'),
+}
+
+
+class ProductFilterForm(forms.Form):
+    max_categories = 20
+
+    def merges_categories(self):
+        """
+        Whether several categories are read as one index range each and merged,
+        which only cursor pagination does; otherwise they would be sorted together.
+        """
+        return self.data.get('pagination') == 'cursor'
+
+    def clean(self):
+        cleaned_data = super().clean()
+        price_range = cleaned_data.get('price_min') is not None or cleaned_data.get('price_max') is not None
+        name = cleaned_data.get('name')
+        ordering = cleaned_data.get('ordering')
+        if name and ordering in ('price', '-price'):
+            raise forms.ValidationError(
+                {'ordering': 'A name filter can only be ordered by id.'}
+            )
+        if price_range and ordering == 'id' and not name:
+            raise forms.ValidationError(
+                {'ordering': 'Price range filters can only be ordered by price or -price.'}
+            )
+        if not ordering:
+            cleaned_data['ordering'] = 'price' if price_range and not name else 'id'
+        categories = cleaned_data.get('category__in') or ()
+        if len(categories) > self.max_categories:
+            raise forms.ValidationError(
+                {'category__in': f'Filter on at most {self.max_categories} categories.'}
+            )
+        if len(set(categories)) > 1 and not cleaned_data.get('category') and not self.merges_categories():
+            raise forms.ValidationError(
+                {'category__in': 'Several categories can only be listed with pagination=cursor.'}
+            )
+        return cleaned_data
+
+
+class ProductExportFilterForm(ProductFilterForm):
+
+    def merges_categories(self):
+        # The export reads several categories one after the other; see ProductExportFilter.
+        return True
+
+
+class NumberInFilter(filters.BaseInFilter, filters.NumberFilter):
+    pass
 
 
 class ProductFilter(filters.FilterSet):
+    price_min = filters.NumberFilter(field_name='price', lookup_expr='gte')
+    price_max = filters.NumberFilter(field_name='price', lookup_expr='lte')
+    category__in = NumberInFilter(field_name='category', lookup_expr='in')
+    ordering = filters.ChoiceFilter(choices=[(name, name) for name in PRODUCT_ORDERINGS], method='order_products')
+
     class Meta:
         model = Product
         fields = ('category', 'name')
+        form = ProductFilterForm
+
+    def order_products(self, queryset, name, value):
+        return queryset.order_by(*PRODUCT_ORDERINGS[value])
+
+
+class ProductExportFilter(ProductFilter):
+
+    class Meta(ProductFilter.Meta):
+        fields = ProductFilter.Meta.fields + ('vendor',)
+        form = ProductExportFilterForm
+
+    def order_products(self, queryset, name, value):
+        # Category by category, so several categories are one (category, ...) index scan, not a sort.
+        ordering = PRODUCT_ORDERINGS[value]
+        if self.form.cleaned_data.get('category__in') and not self.form.cleaned_data.get('category'):
+            ordering = ('-category' if ordering[0].startswith('-') else 'category',) + ordering
+        return queryset.order_by(*ordering)
+
+
+def filters_used(filterset):
+    return {
+        name: value for name, value in filterset.form.cleaned_data.items()
+        if name != 'ordering' and value not in (None, '', [])
+    }
+
+
+def price_stats(filterset, queryset):
+    """
+    Max/min/avg price of the products a validated ProductFilter matches, from the
+    per-category stats table when the filters allow it.
+    """
+    used = filters_used(filterset)
+    if set(used) <= {'category'}:
+        category = used.get('category')
+        return price_summary([category.id] if category else None)
+    if set(used) == {'category__in'}:
+        return price_summary([int(category) for category in used['category__in']])
+    return queryset.aggregate(Max('price'), Min('price'), Avg('price'))
 
 
 class ProductListPagination(PageNumberPagination):
+    django_paginator_class = CachedCountPaginator
     page_size = 2
     page_query_param = 'page_size'
 
+    def paginate_queryset(self, queryset, request, view=None):
+        page = self.get_page(queryset, request)
+        return None if page is None else list(page)
+
+    def get_page(self, queryset, request):
+        """
+        paginate_queryset() without fetching the page's rows, for the async list
+        view, which fetches them with the async ORM.
+        """
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        paginator = self.django_paginator_class(queryset, page_size)
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+        self.request = request
+        return self.page
+
+
+class ProductCursorPagination(KeysetPagination):
+    page_size = 20
+    max_page_size = 100
+    partition_field = 'category'
+
+
+class CommentPagination(KeysetPagination):
+    ordering = ('-created', '-id')
+    page_size = 20
+    max_page_size = 100
+
 
-class ProductListAPIView(ListAPIView):
+class ProductListAPIView(ReplicaReadMixin, ListAPIView):
     permission_classes = [permissions.AllowAny]
 
     queryset = Product.objects.all()
@@ -36,18 +190,35 @@ class ProductListAPIView(ListAPIView):
     filterset_class = ProductFilter
     pagination_class = ProductListPagination
     page_size = 2
-    count = queryset.count()
 
     def get_queryset(self):
         queryset = super().get_queryset()
-        return self.filterset_class(self.request.GET, queryset=queryset).qs
+        self.filterset = self.filterset_class(self.request.GET, queryset=queryset)
+        if not self.filterset.is_valid():
+            raise ValidationError(self.filterset.errors)
+        return self.filterset.qs
+
+    def get_filters_used(self):
+        return filters_used(self.filterset)
+
+    def get_price_stats(self, queryset):
+        return price_stats(self.filterset, queryset)
+
+    def get_paginator(self):
+        if self.request.query_params.get('pagination') == 'cursor':
+            paginator = ProductCursorPagination()
+            categories = self.get_filters_used().get('category__in')
+            if categories and 'category' not in self.get_filters_used():
+                paginator.partitions = sorted({int(category) for category in categories})
+            return paginator
+        return ProductListPagination()
 
     def get(self, request):
         queryset = self.get_queryset()
-        paginator = ProductListPagination()
+        paginator = self.get_paginator()
         pagination = paginator.paginate_queryset(queryset, request)
         serializer = self.get_serializer(pagination, many=True)
-        price = queryset.aggregate(Max('price'), Min('price'), Avg('price'))
+        price = self.get_price_stats(queryset)
         data = {
             "products": serializer.data,
             "avg_price": price
@@ -55,7 +226,59 @@ class ProductListAPIView(ListAPIView):
         return paginator.get_paginated_response(data)
 
 
-class CategoryListAPIView(APIView):
+class ProductExportAPIView(ReplicaReadMixin, APIView):
+    """
+    Stream the catalog, or the part of it matched by ProductFilter plus `vendor`, as
+    `?output=csv` (default) or `?output=ndjson`; `?compress=gzip` gzips it on the fly.
+    The parameter is not called `format`, which DRF reserves for content negotiation.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = [ScopedRateThrottle]
+    throttle_scope = 'product_export'
+
+    def get(self, request):
+        output = request.query_params.get('output', 'csv')
+        if output not in EXPORT_FORMATS:
+            raise ValidationError({'output': [f'Choose one of: {", ".join(EXPORT_FORMATS)}.']})
+        compress = request.query_params.get('compress') == 'gzip'
+        filterset = ProductExportFilter(request.query_params, queryset=Product.objects.all())
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+        # The rows are read as the response streams, after the view has returned and
+        # replica routing has ended, so they are bound to the database chosen now.
+        queryset = filterset.qs.using(router.db_for_read(Product))
+        response = StreamingHttpResponse(
+            export_products(queryset, output, compress),
+            content_type='application/gzip' if compress else EXPORT_FORMATS[output],
+        )
+        response['Content-Disposition'] = f'attachment; filename="{export_filename(output, compress)}"'
+        return response
+
+
+class ProductSearchAPIView(ReplicaReadMixin, APIView):
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        query = ProductSearchQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        paginator = SearchPagination()
+        products = paginator.paginate_search(
+            lambda after, limit: search_products(
+                params['q'],
+                after=after,
+                limit=limit,
+                categories=params.get('category', ()),
+                price_min=params.get('price_min'),
+                price_max=params.get('price_max'),
+            ),
+            request
+        )
+        serializer = ProductSerializer(products, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+
+class CategoryListAPIView(ReplicaReadMixin, APIView):
     permission_classes = [permissions.AllowAny]
 
     def get(self, request):
@@ -82,6 +305,21 @@ class ProductCreateAPIView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class ProductBulkCreateAPIView(APIView):
+    """
+    Create many products for the authenticated vendor from an NDJSON or JSON-array
+    body. The body is read as a stream, so it is never parsed into request.data.
+    """
+    permission_classes = [permissions.IsAuthenticated, IsVendorPermission]
+
+    def post(self, request):
+        result = ingest_products(request.stream or BytesIO(), request.user.id)
+        # Rows that failed are listed in the body; the upload only fails when nothing was created.
+        if result.failed and not result.done:
+            return Response(result.as_dict(), status=status.HTTP_400_BAD_REQUEST)
+        return Response(result.as_dict(), status=status.HTTP_201_CREATED)
+
+
 class CommentCreateAPIView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
@@ -191,6 +429,20 @@ class ProductUpdateAPIView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class ProductBulkUpdateAPIView(APIView):
+    """
+    Patch many of the authenticated vendor's products from an NDJSON or JSON-array
+    body of objects with an "id" and the fields to change.
+    """
+    permission_classes = [permissions.IsAuthenticated, IsVendorPermission]
+
+    def patch(self, request):
+        result = update_products(request.stream or BytesIO(), request.user.id)
+        if result.failed and not result.done:
+            return Response(result.as_dict(), status=status.HTTP_400_BAD_REQUEST)
+        return Response(result.as_dict(), status=status.HTTP_200_OK)
+
+
 class CategoryUpdateAPIView(APIView):
     permission_classes = [permissions.AllowAny]
 
@@ -204,13 +456,34 @@ class CategoryUpdateAPIView(APIView):
         serializer = CategorySerializer(data=request.data)
         if serializer.is_valid():
             category = self.get_object(id)
-            category = Category.objects.update(
+            category = Category.objects.filter(id=category.id).update(
                 name=request.data['name'],
             )
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+def detail_comments(product_id):
+    # One comment more than is embedded, to tell whether there is a next page.
+    return Comment.objects.filter(product_id=product_id).order_by(*CommentPagination.ordering)[
+        :settings.PRODUCT_DETAIL_COMMENTS + 1
+    ]
+
+
+def detail_data(product_id, product, comments):
+    limit = settings.PRODUCT_DETAIL_COMMENTS
+    serializer = ProductSerializer(product)
+    serializer2 = CommentSerializer(comments[:limit], many=True)
+    # Relative, because the rendered body is cached and shared between hosts.
+    comments_next = cursor_next_link(reverse('product-comments', kwargs={'id': product_id}), comments,
+                                     CommentPagination.ordering, limit)
+    return {
+        "product": serializer.data,
+        "comments": serializer2.data,
+        "comments_next": comments_next
+    }
+
+
 class ProductDetailAPIView(APIView):
 
     def get_object(self, product_id):
@@ -219,23 +492,67 @@ class ProductDetailAPIView(APIView):
         except Product.DoesNotExist:
             raise Http404
 
-    def get(self, request, id):
-        product_id = request.data.get('id')
+    def get_data(self, request, id):
         product = self.get_object(id)
-        comments = Comment.objects.filter(product_id=id)
-        serializer = ProductSerializer(product)
-        serializer2 = CommentSerializer(comments, many=True)
-        data = {
-            "product": serializer.data,
-            "comments": serializer2.data
-        }
-        return Response(data, status=status.HTTP_200_OK)
+        comments = list(detail_comments(id))
+        return detail_data(id, product, comments)
+
+    def get(self, request, id):
+        version = detail_cache.product_version(id)
+        etag = detail_cache.product_etag(id, version)
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            metrics.incr('product_detail.not_modified')
+            response = HttpResponseNotModified()
+        else:
+            body = detail_cache.get_rendered(id, version)
+            if body is None:
+                body = FastJSONRenderer().render(self.get_data(request, id))
+                detail_cache.set_rendered(id, version, body)
+            response = HttpResponse(body, content_type='application/json', status=status.HTTP_200_OK)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+class ProductDetailCacheStatsAPIView(APIView):
+    permission_classes = [permissions.IsAdminUser]
 
+    def get(self, request):
+        return Response(detail_cache.cache_stats(), status=status.HTTP_200_OK)
+
+
+class CommentListAPIView(ReplicaReadMixin, APIView):
+
+    def get(self, request, id):
+        if not Product.objects.filter(id=id).exists():
+            raise Http404
+        paginator = CommentPagination()
+        comments = paginator.paginate_queryset(Comment.objects.filter(product_id=id), request, view=self)
+        serializer = CommentSerializer(comments, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
+
+def payment_response(purchase):
+    data = {'purchase': purchase.id, 'status': purchase.status}
+    if purchase.status == Purchase.CREATED:
+        data['client_secret'] = purchase.client_secret
+        return Response(data, status=status.HTTP_200_OK)
+    if purchase.status == Purchase.FAILED:
+        data['error'] = purchase.error
+        return Response(data, status=status.HTTP_502_BAD_GATEWAY)
+    response = Response(data, status=status.HTTP_202_ACCEPTED)
+    response['Location'] = reverse('purchase-status', kwargs={'id': purchase.id})
+    return response
 
 
 class PaymentAPIView(APIView):
+    """
+    Start a payment. A repeated request with the same Idempotency-Key header returns
+    the purchase of the first one instead of paying twice. The Stripe intent is
+    created within the request unless PAYMENTS_QUEUED is set, the client sends
+    "Prefer: respond-async", or every Stripe slot is busy; the purchase is then left
+    to the outbox worker (`manage.py process_outbox`) and the response is 202.
+    """
     permission_classes = [permissions.IsAuthenticated]
 
     def get_object(self, id):
@@ -251,32 +568,35 @@ class PaymentAPIView(APIView):
             raise Http404
 
     def post(self, request, id):
-        # try:
-            amount = int(request.data['amount'])
-            product = self.get_object(id)
-            customer = self.get_object_customer(id)
-            card_number = request.data['card_number']
-            payment_intent = stripe.PaymentIntent.create(
-                amount=amount,
-                currency='usd',
-                payment_method_types=['card'],
-                metadata={'integration_check': 'accept_a_payment',
-                          'product_name': product.name,
-                          'product_description': product.description,
-                          'card_number': card_number
-                          },
+        serializer = PaymentSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        product = self.get_object(id)
+        customer = self.get_object_customer(request.user.id)
+        try:
+            purchase, created = start_purchase(
+                customer, product,
+                serializer.validated_data['amount'],
+                serializer.validated_data['card_number'],
+                request.headers.get('Idempotency-Key'),
             )
+        except IdempotencyConflict:
+            return Response({'error': 'This Idempotency-Key was already used for a different payment.'},
+                            status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        queued = settings.PAYMENTS_QUEUED or 'respond-async' in request.headers.get('Prefer', '')
+        if not queued and claim(purchase):
+            try:
+                create_intent(purchase)
+            except GatewayBusy:
+                metrics.incr('payments.queued_busy')
+        return payment_response(purchase)
+
+
+class PurchaseStatusAPIView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
 
-            customer = customer
-            purchase = Purchase.objects.create(customer=customer, product=product)
-            purchase.save()
-            data = {
-                    'client_secret': payment_intent.client_secret
-            }
-            return Response(data, status=status.HTTP_200_OK)
-        # except Exception as e:
-        #     return Response({
-        #         'error': str(e)
-        #     }, status=status.HTTP_400_BAD_REQUEST)
-
-
+    def get(self, request, id):
+        try:
+            purchase = Purchase.objects.get(id=id, customer_id=request.user.id)
+        except Purchase.DoesNotExist:
+            raise Http404
+        return payment_response(purchase)
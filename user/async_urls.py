@@ -0,0 +1,7 @@
+from django.urls import path
+
+from .async_views import vendor_detail
+
+urlpatterns = [
+    path('vendor/profile/<int:id>', vendor_detail, name='async-vendor-detail'),
+]
@@ -0,0 +1,26 @@
+"""
+Async variant of the public vendor detail view; see product.async_views.
+"""
+from rest_framework import status
+from rest_framework.exceptions import NotFound
+
+from market.db_router import read_from_replicas
+from product.async_views import json_response, product_rows
+from .models import Vendor
+from .serializers import VendorRegisterSerializer
+from .views import vendor_data, vendor_products
+
+
+@read_from_replicas
+async def vendor_detail(request, id):
+    try:
+        products = vendor_products(request, id)
+    except NotFound as exc:
+        return json_response({'detail': exc.detail}, status.HTTP_404_NOT_FOUND)
+    # Django 4.2's async ORM runs every query on one shared thread, so the two do not overlap.
+    vendor = await Vendor.objects.select_related('stats').filter(id=id).afirst()
+    products = await product_rows(products)
+    if vendor is None:
+        return json_response({'detail': 'Not found.'}, status.HTTP_404_NOT_FOUND)
+    data = vendor_data(request, VendorRegisterSerializer(vendor).data, getattr(vendor, 'stats', None), products)
+    return json_response(data)
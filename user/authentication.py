@@ -0,0 +1,140 @@
+"""
+Authentication classes that avoid per-request work.
+
+JWT: tokens issued by MyTokenObtainPairSerializer carry the user's id, email,
+is_Vendor, is_staff, is_superuser and token_version. ClaimsJWTAuthentication
+turns them into a ClaimsUser, so views and permission checks such as
+IsVendorPermission need no query. It still refuses tokens of deleted or
+inactive users and tokens issued before the user's token_version was bumped
+(see revoke_tokens); those two columns are read by primary key and cached for
+JWT_USER_CACHE_TIMEOUT seconds, so a warm request makes no query at all.
+
+Tokens without a token_version claim, issued before this class existed, are
+authenticated the way JWTAuthentication does it, by loading the user.
+
+Basic: CachedBasicAuthentication runs the password hasher (PBKDF2, deliberately
+slow) only the first time it sees a pair of credentials. The pair is then
+remembered under a keyed hash for BASIC_AUTH_CACHE_TIMEOUT seconds, together with
+the user's password hash. Later requests load the user by primary key and accept
+it only while it is active and its password hash is unchanged, so changing the
+password or deactivating the user takes effect immediately.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import BasicAuthentication
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+from market import metrics
+from .models import CustomUser
+
+
+def _row_key(user_id):
+    return f'auth-user:{user_id}'
+
+
+def user_row(user_id):
+    """
+    (is_active, token_version) of a user, or None when there is no such user.
+    """
+    timeout = settings.JWT_USER_CACHE_TIMEOUT
+    row = cache.get(_row_key(user_id)) if timeout else None
+    if row is None:
+        row = CustomUser.objects.filter(id=user_id).values_list('is_active', 'token_version').first()
+        if row is not None and timeout:
+            cache.set(_row_key(user_id), row, timeout)
+    return row
+
+
+def forget_user(user_id):
+    cache.delete(_row_key(user_id))
+
+
+def revoke_tokens(user):
+    """
+    Invalidate every token issued to `user` so far.
+    """
+    CustomUser.objects.filter(pk=user.pk).update(token_version=F('token_version') + 1)
+    forget_user(user.pk)
+
+
+class ClaimsUser(TokenUser):
+    """
+    An authenticated user built from token claims. `instance` loads the model
+    instance for the rare code that needs more than the claims.
+    """
+
+    def __str__(self):
+        return self.email
+
+    @cached_property
+    def email(self):
+        return self.token.get('email', '')
+
+    @cached_property
+    def is_Vendor(self):
+        return self.token.get('is_Vendor', False)
+
+    @cached_property
+    def instance(self):
+        return CustomUser.objects.get(pk=self.id)
+
+    def get_username(self):
+        return self.email
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+
+    def get_user(self, validated_token):
+        if 'token_version' not in validated_token:
+            return super().get_user(validated_token)
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+        user = ClaimsUser(validated_token)
+        row = user_row(user.id)
+        if row is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        is_active, token_version = row
+        if not is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        if token_version != validated_token['token_version']:
+            raise AuthenticationFailed(_('Token has been revoked'), code='token_revoked')
+        return user
+
+
+def _credentials_key(userid, password):
+    digest = salted_hmac('user.authentication.basic', f'{userid}\0{password}', algorithm='sha256').hexdigest()
+    return f'basic-auth:{digest}'
+
+
+def basic_auth_stats():
+    counters = metrics.snapshot('basic_auth.hits', 'basic_auth.misses')
+    counters['hit_rate'] = metrics.hit_rate(counters['basic_auth.hits'], counters['basic_auth.misses'])
+    return counters
+
+
+class CachedBasicAuthentication(BasicAuthentication):
+
+    def authenticate_credentials(self, userid, password, request=None):
+        timeout = settings.BASIC_AUTH_CACHE_TIMEOUT
+        if not timeout:
+            return super().authenticate_credentials(userid, password, request)
+        key = _credentials_key(userid, password)
+        cached = cache.get(key)
+        if cached is not None:
+            user_id, password_hash = cached
+            user = CustomUser.objects.filter(pk=user_id).first()
+            if user is not None and user.is_active and constant_time_compare(user.password, password_hash):
+                metrics.incr('basic_auth.hits')
+                return (user, None)
+            cache.delete(key)
+        metrics.incr('basic_auth.misses')
+        user, auth = super().authenticate_credentials(userid, password, request)
+        cache.set(key, (user.pk, user.password), timeout)
+        return (user, auth)
@@ -0,0 +1,134 @@
+"""
+Bulk import of vendors and customers.
+
+Vendor and Customer extend CustomUser through multi-table inheritance, which
+bulk_create does not support. Each chunk of valid rows is therefore written as
+one bulk INSERT of parent rows, one batched INSERT of child rows pointing at
+them and, for customers, one bulk INSERT of their carts, all in one transaction.
+Emails are checked against the database once per chunk, not once per row.
+
+Plain-text passwords are hashed in a pool: Django's PBKDF2 hasher is deliberately
+slow and releases the GIL while it runs, so threads spread it over the CPUs as
+well as processes do. The import endpoint uses a few threads, since forking from a
+web server is unsafe; `manage.py import_users` uses a process pool. Rows may
+instead carry a `password_hash` already in Django's format, which is stored as is.
+"""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import DatabaseError, connections, router, transaction
+
+from product import counts
+from product.ingest import BulkResult, process_rows
+from product.models import Cart
+from .models import CustomUser, Customer, Vendor
+from .serializers import CustomerImportSerializer, VendorImportSerializer
+
+KINDS = {
+    'vendor': (Vendor, VendorImportSerializer),
+    'customer': (Customer, CustomerImportSerializer),
+}
+
+# Passwords handed to a pool worker at a time.
+HASH_BATCH_SIZE = 64
+
+
+def hash_passwords(passwords):
+    return [make_password(password) for password in passwords]
+
+
+@contextmanager
+def password_hasher(workers=0, processes=False):
+    """
+    Yield a function hashing a list of passwords, spread over `workers` threads,
+    or processes when `processes` is set. With no workers it hashes in the
+    calling thread.
+    """
+    if not workers:
+        yield hash_passwords
+        return
+    if processes:
+        pool = ProcessPoolExecutor(workers, initializer=django.setup)
+    else:
+        pool = ThreadPoolExecutor(workers, thread_name_prefix='password-hasher')
+    with pool:
+        def hash_in_pool(passwords):
+            batches = [passwords[start:start + HASH_BATCH_SIZE]
+                       for start in range(0, len(passwords), HASH_BATCH_SIZE)]
+            return [password for batch in pool.map(hash_passwords, batches) for password in batch]
+        yield hash_in_pool
+
+
+def _insert_children(model, users, using):
+    # The child table alone: its own columns, starting with the pointer to the parent row.
+    fields = model._meta.local_concrete_fields
+    connection = connections[using]
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        connection.ops.quote_name(model._meta.db_table),
+        ', '.join(connection.ops.quote_name(field.column) for field in fields),
+        ', '.join(['%s'] * len(fields)),
+    )
+    rows = [[field.get_db_prep_save(getattr(user, field.attname), connection) for field in fields] for user in users]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def _insert_chunk(chunk, model, hasher, result):
+    rows = {}
+    for row, data in chunk:
+        data['email'] = CustomUser.objects.normalize_email(data['email'])
+        if data['email'] in rows:
+            result.add_error(row, {'email': ['This email appears more than once in this import.']}, conflict=True)
+            continue
+        rows[data['email']] = (row, data)
+    taken = set(CustomUser.objects.filter(email__in=rows).values_list('email', flat=True))
+    for email in sorted(taken, key=lambda email: rows[email][0]):
+        row, _ = rows.pop(email)
+        result.add_error(row, {'email': ['A user with this email already exists.']}, conflict=True)
+    if not rows:
+        return
+
+    plain = [data for _, data in rows.values() if 'password' in data]
+    for data, password_hash in zip(plain, hasher([data['password'] for data in plain])):
+        data['password_hash'] = password_hash
+    users = []
+    for _, data in rows.values():
+        fields = {name: value for name, value in data.items() if name not in ('password', 'password_hash')}
+        users.append(model(password=data['password_hash'], is_Vendor=model is Vendor, **fields))
+
+    using = router.db_for_write(model)
+    parents = [CustomUser(**{field.attname: getattr(user, field.attname)
+                             for field in CustomUser._meta.concrete_fields}) for user in users]
+    try:
+        with transaction.atomic(using=using):
+            CustomUser.objects.using(using).bulk_create(parents)
+            for user, parent in zip(users, parents):
+                user.pk = user.customuser_ptr_id = parent.pk
+            _insert_children(model, users, using)
+            if model is Customer:
+                Cart.objects.using(using).bulk_create([Cart(customer_id=user.pk) for user in users])
+    except DatabaseError as error:
+        for row, _ in rows.values():
+            result.add_error(row, {'non_field_errors': [str(error)]})
+        return
+    result.done += len(users)
+
+
+def import_users(stream, kind, chunk_size=None, max_errors=None, hasher=hash_passwords):
+    """
+    Validate and create every vendor or customer (`kind`) in the NDJSON or
+    JSON-array `stream`. Invalid rows and emails that are taken are reported and
+    skipped; each chunk of valid rows is written in its own transaction. Rows are
+    numbered from 1. Plain-text passwords are hashed with `hasher`, e.g. one
+    yielded by password_hasher().
+    """
+    model, serializer_class = KINDS[kind]
+    result = BulkResult('created', settings.USER_IMPORT_MAX_ERRORS if max_errors is None else max_errors)
+    process_rows(stream, serializer_class(), lambda chunk, result: _insert_chunk(chunk, model, hasher, result),
+                 result, chunk_size or settings.USER_IMPORT_CHUNK_SIZE)
+    if result.done:
+        counts.invalidate(model)
+    return result
@@ -0,0 +1,34 @@
+import json
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from user.ingest import KINDS, import_users, password_hasher
+
+
+class Command(BaseCommand):
+    help = 'Import vendors or customers from an NDJSON or JSON-array file, in chunks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(KINDS))
+        parser.add_argument('file', help='Input path; "-" reads stdin.')
+        parser.add_argument('--chunk-size', type=int)
+        parser.add_argument('--hash-workers', type=int,
+                            help='Processes hashing plain-text passwords; 0 hashes in this process.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        workers = settings.USER_IMPORT_HASH_WORKERS if options['hash_workers'] is None else options['hash_workers']
+        with password_hasher(workers, processes=True) as hasher:
+            if options['file'] == '-':
+                result = import_users(sys.stdin.buffer, options['kind'], options['chunk_size'], hasher=hasher)
+            else:
+                with open(options['file'], 'rb') as stream:
+                    result = import_users(stream, options['kind'], options['chunk_size'], hasher=hasher)
+        seconds = time.perf_counter() - started
+        for error in result.errors:
+            self.stderr.write(json.dumps(error))
+        self.stdout.write(f'Created {result.done} {options["kind"]}s, {result.failed} rows failed, '
+                          f'in {seconds:.1f} s ({result.done / seconds:.0f} rows/s).')
@@ -16,6 +16,9 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
 
     is_Vendor = models.BooleanField(default=True)
 
+    # Part of every token issued to the user; bumping it revokes them all.
+    token_version = models.PositiveIntegerField(default=0)
+
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = []
 
@@ -1,3 +1,4 @@
+from django.contrib.auth.hashers import identify_hasher
 from django.contrib.auth.password_validation import validate_password
 from rest_framework import serializers
 from rest_framework.validators import UniqueValidator
@@ -12,6 +13,10 @@ class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
         token = super(MyTokenObtainPairSerializer, cls).get_token(user)
         token['email'] = user.email
         token['is_Vendor'] = user.is_Vendor
+        # Read by user.authentication.ClaimsJWTAuthentication instead of loading the user.
+        token['is_staff'] = user.is_staff
+        token['is_superuser'] = user.is_superuser
+        token['token_version'] = user.token_version
         return token
 
 
@@ -92,4 +97,93 @@ class CustomerRegisterSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 {'password': "Password fields didn`t match."}
             )
-        return attrs
\ No newline at end of file
+        return attrs
+
+
+class UserListSerializer(serializers.ModelSerializer):
+    """
+    A row of a user listing, limited to the `fields` the client asked for. `id`
+    reads the primary key of the child table, so listing it needs no join to
+    CustomUser.
+    """
+    id = serializers.IntegerField(source='pk', read_only=True)
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    @classmethod
+    def parse_fields(cls, value):
+        """
+        The field names in a comma-separated `?fields=` value, or None for all of them.
+        """
+        if not value:
+            return None
+        fields = [name.strip() for name in value.split(',') if name.strip()]
+        unknown = [name for name in fields if name not in cls.Meta.fields]
+        if unknown:
+            raise serializers.ValidationError(
+                {'fields': [f'Unknown field(s): {", ".join(unknown)}. Choose from: {", ".join(cls.Meta.fields)}.']}
+            )
+        return fields
+
+    @classmethod
+    def model_fields(cls, fields):
+        """
+        The model fields to load for `fields`, for QuerySet.only().
+        """
+        return [name for name in fields or cls.Meta.fields if name != 'id']
+
+
+class VendorListSerializer(UserListSerializer):
+    class Meta:
+        model = Vendor
+        fields = ['id', 'email', 'name', 'second_name', 'phone_number', 'description']
+        read_only_fields = fields
+
+
+class CustomerListSerializer(UserListSerializer):
+    class Meta:
+        model = Customer
+        fields = ['id', 'email', 'name', 'second_name', 'phone_number', 'address', 'post_code']
+        read_only_fields = fields
+
+
+class UserImportSerializer(serializers.ModelSerializer):
+    """
+    One row of a bulk user import. Email uniqueness is checked per chunk by
+    user.ingest rather than per row, and the password is either given in plain
+    text or already hashed in Django's format (e.g. by the system the accounts
+    come from).
+    """
+    email = serializers.EmailField(max_length=254)
+    password = serializers.CharField(write_only=True, required=False, max_length=128,
+                                     validators=[validate_password])
+    password_hash = serializers.CharField(write_only=True, required=False, max_length=128)
+
+    def validate_password_hash(self, value):
+        try:
+            identify_hasher(value)
+        except ValueError:
+            raise serializers.ValidationError('Unknown password hash format.')
+        return value
+
+    def validate(self, attrs):
+        if ('password' in attrs) == ('password_hash' in attrs):
+            raise serializers.ValidationError('Give either "password" or "password_hash".')
+        return attrs
+
+
+class VendorImportSerializer(UserImportSerializer):
+    class Meta:
+        model = Vendor
+        fields = ['email', 'name', 'second_name', 'phone_number', 'description', 'password', 'password_hash']
+
+
+class CustomerImportSerializer(UserImportSerializer):
+    class Meta:
+        model = Customer
+        fields = ['email', 'name', 'second_name', 'phone_number', 'card_number', 'address', 'post_code',
+                  'password', 'password_hash']
@@ -0,0 +1,22 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from product import counts
+from .authentication import forget_user
+from .models import CustomUser, Customer, Vendor
+
+
+@receiver(post_save, sender=Vendor)
+@receiver(post_delete, sender=Vendor)
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+def invalidate_counts(sender, **kwargs):
+    counts.invalidate(sender)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def forget_cached_user(sender, instance, **kwargs):
+    # Also fires for Vendor and Customer, which save through their CustomUser parent.
+    if isinstance(instance, CustomUser):
+        forget_user(instance.pk)
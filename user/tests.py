@@ -1,3 +1,366 @@
-from django.test import TestCase
+import json
+from base64 import b64encode
+from io import BytesIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.hashers import check_password, make_password
+from django.db import connection
+from django.test import RequestFactory
+from rest_framework.request import Request
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from product.cart import add_item
+from product.models import Cart, CartItem, Purchase
+from product.stats import rebuild_customer_stats
+from product.tests import QueryPlanTestCase
+from .authentication import ClaimsJWTAuthentication, ClaimsUser, basic_auth_stats, revoke_tokens
+from .ingest import import_users, password_hasher
+from .models import CustomUser, Customer, Vendor
+from .permissions import IsVendorPermission
+from .serializers import MyTokenObtainPairSerializer
+
+
+class UserViewQueryPlanTests(QueryPlanTestCase):
+
+    def test_login(self):
+        self.assertNoFullScans('post', '/api/user/login/', {
+            'email': 'vendor0@example.com', 'password': 'secret-password',
+        })
+
+    def test_vendor_register(self):
+        self.assertNoFullScans('post', '/api/user/vendor/register/', {
+            'email': 'new-vendor@example.com', 'name': 'New', 'second_name': 'Vendor', 'phone_number': '0',
+            'description': 'new', 'password': 'Str0ng-passw0rd', 'password2': 'Str0ng-passw0rd',
+        })
+
+    def test_customer_register(self):
+        self.assertNoFullScans('post', '/api/user/customer/register/', {
+            'email': 'new-customer@example.com', 'name': 'New', 'second_name': 'Customer', 'phone_number': '0',
+            'card_number': '4242', 'address': 'Street', 'post_code': '0',
+            'password': 'Str0ng-passw0rd', 'password2': 'Str0ng-passw0rd',
+        })
+
+    def test_vendor_list(self):
+        response = self.assertNoFullScans('get', '/api/user/vendor/list?limit=2&count=true')
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual([vendor['id'] for vendor in response.data['results']],
+                         [vendor.id for vendor in self.vendors[:2]])
+        response = self.assertNoFullScans('get', response.data['next'])
+        self.assertEqual([vendor['email'] for vendor in response.data['results']], ['vendor2@example.com'])
+        self.assertIsNone(response.data['next'])
+
+    def admin(self):
+        admin = self.vendors[2]
+        admin.is_staff = True
+        admin.save()
+        return admin
+
+    def test_customer_list(self):
+        self.assertEqual(self.client.get('/api/user/customer/list').status_code, 401)
+        self.client.force_authenticate(self.customers[0])
+        self.assertEqual(self.client.get('/api/user/customer/list?email=customer').status_code, 403)
+        response = self.assertNoFullScans('get', '/api/user/customer/list', user=self.admin())
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertNotIn('password', response.data['results'][0])
+        self.assertNotIn('card_number', response.data['results'][0])
+
+    def test_user_list_fields(self):
+        self.client.force_authenticate(self.admin())
+        with self.recordStatements() as statements:
+            response = self.client.get('/api/user/customer/list?fields=id,name')
+        self.assertEqual(response.data['results'][0], {'id': self.customers[0].id, 'name': 'Customer'})
+        # Neither field lives in the CustomUser table, so it is not joined.
+        self.assertEqual(len(statements), 1)
+        self.assertNotIn('user_customuser', statements[0][0])
+        response = self.client.get('/api/user/customer/list?fields=id,password')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('fields', response.data)
+
+    def test_user_list_email_prefix(self):
+        path = '/api/user/customer/list?email=customer1&fields=email'
+        response = self.assertNoFullScans('get', path, user=self.admin())
+        self.assertEqual(response.data['results'], [{'email': 'customer1@example.com'}])
+        response = self.assertNoFullScans('get', '/api/user/vendor/list?email=vendor&limit=2&fields=id')
+        self.assertEqual([vendor['id'] for vendor in response.data['results']],
+                         [vendor.id for vendor in self.vendors[:2]])
+        response = self.assertNoFullScans('get', response.data['next'])
+        self.assertEqual([vendor['id'] for vendor in response.data['results']], [self.vendors[2].id])
+        self.assertEqual(self.client.get('/api/user/vendor/list?email=customer').data['results'], [])
+
+    def test_customer_profile(self):
+        customer = self.customers[0]
+        self.assertNoFullScans('get', f'/api/user/customer/{customer.id}', user=customer)
+
+    def test_customer_purchase_history(self):
+        customer = self.customers[1]
+        Purchase.objects.bulk_create([
+            Purchase(customer=customer, product=self.products[index % 300], amount=10) for index in range(200)
+        ])
+        rebuild_customer_stats()
+        expected = list(Purchase.objects.filter(customer=customer).order_by('-created_at', '-id')
+                        .values_list('id', flat=True))
+        path = f'/api/user/customer/{customer.id}'
+        response = self.assertNoFullScans('get', path, user=customer)
+        # The 33 purchases of the fixtures have no amount.
+        self.assertEqual(response.data['summary'], {'purchase_count': 233, 'total_spent': 2000})
+        ids = [purchase['id'] for purchase in response.data['purchases']]
+        self.assertEqual(response.data['purchases'][0]['product']['id'], self.products[199].id)
+        while response.data['purchases_next']:
+            response = self.assertNoFullScans('get', response.data['purchases_next'], user=customer)
+            ids += [purchase['id'] for purchase in response.data['purchases']]
+        self.assertEqual(ids, expected)
+        # The customer with its summary, then a page of purchases joined to their products.
+        with self.assertNumQueries(2):
+            self.client.get(path)
+
+    def test_customer_cart(self):
+        customer = self.customers[0]
+        self.assertNoFullScans('get', f'/api/user/customer/cart/{customer.id}', user=customer)
+
+    def test_vendor_profile(self):
+        token = RefreshToken.for_user(self.vendors[0]).access_token
+        self.assertNoFullScans('get', f'/api/user/vendor/{token}')
+        self.assertNoFullScans('delete', f'/api/user/vendor/{token}')
+
+    def test_vendor_detail(self):
+        self.assertNoFullScans('get', f'/api/user/vendor/profile/{self.vendors[1].id}')
+
+
+class ClaimsJWTAuthenticationTests(QueryPlanTestCase):
+
+    def authenticate(self, token):
+        request = Request(RequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}'))
+        result = ClaimsJWTAuthentication().authenticate(request)
+        return request, result[0] if result else None
+
+    def token(self, user):
+        return MyTokenObtainPairSerializer.get_token(user).access_token
+
+    def test_warm_requests_make_no_queries(self):
+        vendor = self.vendors[0]
+        token = self.token(vendor)
+        self.authenticate(token)
+        with self.assertNumQueries(0):
+            request, user = self.authenticate(token)
+            request.user = user
+            self.assertTrue(IsVendorPermission().has_permission(request, None))
+        self.assertIsInstance(user, ClaimsUser)
+        self.assertEqual((user.id, user.email, user.is_Vendor), (vendor.id, vendor.email, True))
+        request.user = self.authenticate(self.token(self.customers[0]))[1]
+        self.assertFalse(IsVendorPermission().has_permission(request, None))
+
+    def test_endpoint_queries_only_its_own_data(self):
+        customer = self.customers[0]
+        purchase = Purchase.objects.filter(customer=customer).first()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token(customer)}')
+        self.client.get(f'/api/product/purchase/{purchase.id}/')
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/product/purchase/{purchase.id}/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_revoked_and_inactive_users_are_refused(self):
+        vendor = self.vendors[0]
+        token = self.token(vendor)
+        self.authenticate(token)
+        revoke_tokens(vendor)
+        with self.assertRaisesMessage(AuthenticationFailed, 'revoked'):
+            self.authenticate(token)
+        vendor.refresh_from_db()
+        token = self.token(vendor)
+        self.assertEqual(self.authenticate(token)[1].id, vendor.id)
+        vendor.is_active = False
+        vendor.save()
+        with self.assertRaisesMessage(AuthenticationFailed, 'inactive'):
+            self.authenticate(token)
+
+    def test_tokens_without_claims_load_the_user(self):
+        vendor = self.vendors[0]
+        request, user = self.authenticate(RefreshToken.for_user(vendor).access_token)
+        self.assertNotIsInstance(user, ClaimsUser)
+        self.assertEqual(user.pk, vendor.pk)
+
+
+class CachedBasicAuthenticationTests(QueryPlanTestCase):
+
+    def get(self, email, password):
+        credentials = b64encode(f'{email}:{password}'.encode()).decode()
+        purchase = Purchase.objects.filter(customer=self.customers[0]).first()
+        return self.client.get(f'/api/product/purchase/{purchase.id}/', HTTP_AUTHORIZATION=f'Basic {credentials}')
+
+    def test_password_is_hashed_once(self):
+        with mock.patch('django.contrib.auth.base_user.check_password', wraps=check_password) as check:
+            for _ in range(3):
+                self.assertEqual(self.get('customer0@example.com', 'secret-password').status_code, 200)
+        self.assertEqual(check.call_count, 1)
+        self.assertEqual(self.get('customer0@example.com', 'wrong-password').status_code, 401)
+        stats = basic_auth_stats()
+        self.assertEqual((stats['basic_auth.hits'], stats['basic_auth.misses']), (2, 2))
+
+    def test_password_and_active_changes_take_effect(self):
+        customer = self.customers[0]
+        self.assertEqual(self.get(customer.email, 'secret-password').status_code, 200)
+        customer.set_password('new-password')
+        customer.save()
+        self.assertEqual(self.get(customer.email, 'secret-password').status_code, 401)
+        self.assertEqual(self.get(customer.email, 'new-password').status_code, 200)
+        Customer.objects.filter(pk=customer.pk).update(is_active=False)
+        self.assertEqual(self.get(customer.email, 'new-password').status_code, 401)
+
+    def test_stats_endpoint(self):
+        admin = self.vendors[2]
+        admin.is_staff = True
+        admin.save()
+        response = self.assertNoFullScans('get', '/api/user/auth/cache/stats/', user=admin)
+        self.assertIn('hit_rate', response.data)
+
+
+class UserImportTests(QueryPlanTestCase):
+
+    def rows(self, kind, count, start=0, **extra):
+        fields = {'vendor': {'description': 'imported'},
+                  'customer': {'card_number': '4242', 'address': 'Street', 'post_code': '0'}}[kind]
+        return [dict(email=f'imported{index}@Example.com', name='Imported', second_name='User', phone_number='0',
+                     **fields, **extra) for index in range(start, start + count)]
+
+    def body(self, rows):
+        return '\n'.join(json.dumps(row) for row in rows)
+
+    def test_customers_with_carts(self):
+        rows = self.rows('customer', 5, password='first-password')
+        rows[1] = dict(rows[1], password_hash=make_password('hashed-password'))
+        del rows[1]['password']
+        rows.append(dict(rows[0]))
+        rows.append(dict(self.rows('customer', 1)[0], email='customer0@example.com', password='taken-password'))
+        rows.append({'email': 'not-an-email'})
+        # Emails, parents, children and carts, plus the savepoint of the chunk's transaction.
+        with self.recordStatements() as statements:
+            result = import_users(BytesIO(self.body(rows).encode()), 'customer')
+        self.assertStatementsUseIndexes(statements)
+        self.assertEqual(len(statements), 6, statements)
+        self.assertEqual((result.done, result.failed), (5, 3))
+        self.assertEqual([error['row'] for error in result.errors], [8, 6, 7])
+        customer = Customer.objects.get(email='imported0@example.com')
+        self.assertTrue(customer.check_password('first-password'))
+        self.assertFalse(customer.is_Vendor)
+        self.assertTrue(Cart.objects.filter(customer=customer).exists())
+        self.assertTrue(Customer.objects.get(email='imported1@example.com').check_password('hashed-password'))
+
+    def test_vendors_in_chunks_with_password_pools(self):
+        for start, processes in ((0, True), (5, False)):
+            rows = self.rows('vendor', 5, start=start, password='vendor-password')
+            with password_hasher(2, processes=processes) as hasher:
+                result = import_users(BytesIO(self.body(rows).encode()), 'vendor', chunk_size=2, hasher=hasher)
+            self.assertEqual((result.done, result.failed), (5, 0))
+            vendor = Vendor.objects.get(email=f'imported{start + 4}@example.com')
+            self.assertTrue(vendor.is_Vendor)
+            self.assertTrue(vendor.check_password('vendor-password'))
+        self.assertEqual(CustomUser.objects.filter(email__startswith='imported').count(), 10)
+
+    def test_passwords_are_validated(self):
+        rows = self.rows('vendor', 3, password='vendor-password')
+        rows[1]['password'] = 'password'
+        rows[2]['password'] = '12345678901'
+        result = import_users(BytesIO(self.body(rows).encode()), 'vendor')
+        self.assertEqual((result.done, result.failed), (1, 2))
+        self.assertEqual([error['row'] for error in result.errors], [2, 3])
+        self.assertIn('password', result.errors[0]['errors'])
+
+    def test_endpoint_is_admin_only(self):
+        body = self.body(self.rows('vendor', 2, password_hash=make_password('pw')))
+        self.client.force_authenticate(self.vendors[0])
+        response = self.client.post('/api/user/import/vendor/', body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 403)
+        admin = self.vendors[2]
+        admin.is_staff = True
+        admin.save()
+        self.client.force_authenticate(admin)
+        response = self.client.post('/api/user/import/vendor/', body, content_type='application/x-ndjson')
+        self.assertEqual((response.status_code, response.data['created']), (201, 2))
+        self.assertEqual(self.client.post('/api/user/import/admin/', body,
+                                          content_type='application/x-ndjson').status_code, 404)
+
+
+class CartTests(QueryPlanTestCase):
+
+    def items(self, customer):
+        return dict(CartItem.objects.filter(cart__customer=customer).values_list('product_id', 'quantity'))
+
+    def test_cart(self):
+        customer = self.customers[0]
+        CartItem.objects.filter(cart__customer=customer, product=self.products[0]).update(quantity=3)
+        response = self.assertNoFullScans('get', f'/api/user/customer/cart/{customer.id}', user=customer)
+        self.assertEqual(response.data['cart'][0]['product']['id'], self.products[0].id)
+        self.assertEqual([item['quantity'] for item in response.data['cart']], [3, 1, 1, 1, 1])
+        # Prices 0, 1, 2, 3 and 4.
+        self.assertEqual(response.data['totals'], {'products': 5, 'items': 7, 'total': 10})
+        # The customer, the cart, its items with their products and the totals, however full the cart is.
+        with self.assertNumQueries(4):
+            self.client.get(f'/api/user/customer/cart/{customer.id}')
+
+    def test_add(self):
+        customer = self.customers[1]
+        product = self.products[10]
+        response = self.assertNoFullScans('post', '/api/user/customer/cart/items/',
+                                          {'product': product.id, 'quantity': 2}, user=customer)
+        self.assertEqual(response.data, {'products': 6, 'items': 7, 'total': 30})
+        self.assertNoFullScans('post', '/api/user/customer/cart/items/', {'product': product.id}, user=customer)
+        self.assertEqual(self.items(customer)[product.id], 3)
+        # Another add of a product in the cart is one UPDATE between the cart and product lookups and the totals.
+        with self.recordStatements() as statements:
+            self.client.post('/api/user/customer/cart/items/', {'product': product.id}, format='json')
+        self.assertEqual(len(statements), 4, statements)
+        self.assertIn('"quantity" = MIN(("product_cartitem"."quantity" + ', statements[2][0])
+
+    def test_quantities_are_capped(self):
+        customer = self.customers[1]
+        product = self.products[10]
+        self.client.force_authenticate(customer)
+        for method, path in (('post', '/api/user/customer/cart/items/'),
+                             ('put', f'/api/user/customer/cart/items/{product.id}/')):
+            response = getattr(self.client, method)(path, {'product': product.id, 'quantity': 2 ** 63 - 1},
+                                                    format='json')
+            self.assertEqual(response.status_code, 400)
+        for _ in range(2):
+            self.client.post('/api/user/customer/cart/items/', {'product': product.id, 'quantity': 600}, format='json')
+        self.assertEqual(self.items(customer)[product.id], 1000)
+        add_item(Cart.objects.get(customer=customer).id, product.id, 5000)
+        self.assertEqual(self.items(customer)[product.id], 1000)
+
+    def test_concurrent_first_adds(self):
+        customer = self.customers[1]
+        product = self.products[10]
+        cart_id = Cart.objects.get(customer=customer).id
+        added = []
+
+        def another_tab_adds_after_update(execute, sql, params, many, context):
+            result = execute(sql, params, many, context)
+            if sql.startswith('UPDATE "product_cartitem"') and not added:
+                added.append(CartItem.objects.create(cart_id=cart_id, product_id=product.id, quantity=2))
+            return result
+
+        # The update finds no row, the other tab inserts it, so this insert fails and is retried as an update.
+        with connection.execute_wrapper(another_tab_adds_after_update):
+            add_item(cart_id, product.id, 2)
+        self.assertEqual(self.items(customer)[product.id], 4)
+
+    def test_set_quantity_and_remove(self):
+        customer = self.customers[2]
+        product, other = self.products[1], self.products[20]
+        path = f'/api/user/customer/cart/items/{product.id}/'
+        self.assertNoFullScans('put', path, {'quantity': 4}, user=customer)
+        self.assertNoFullScans('put', f'/api/user/customer/cart/items/{other.id}/', {'quantity': 2}, user=customer)
+        self.assertEqual((self.items(customer)[product.id], self.items(customer)[other.id]), (4, 2))
+        response = self.assertNoFullScans('put', path, {'quantity': 0}, user=customer)
+        self.assertNotIn(product.id, self.items(customer))
+        self.assertEqual(response.data['products'], 5)
+        self.assertNoFullScans('delete', f'/api/user/customer/cart/items/{other.id}/', user=customer)
+        self.assertEqual(self.client.delete(f'/api/user/customer/cart/items/{other.id}/').status_code, 404)
+        self.assertEqual(self.client.put(path, {'quantity': -1}, format='json').status_code, 400)
+        self.assertEqual(self.client.put('/api/user/customer/cart/items/0/', {'quantity': 1},
+                                         format='json').status_code, 400)
+
+    def test_vendor_has_no_cart(self):
+        self.client.force_authenticate(self.vendors[0])
+        response = self.client.post('/api/user/customer/cart/items/', {'product': self.products[0].id}, format='json')
+        self.assertEqual(response.status_code, 404)
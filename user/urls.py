@@ -1,9 +1,12 @@
 from django.urls import path
 from .views import LoginView, VendorRegisterView, CustomerRegisterView, VendorListView, CustomerProfileView, \
-    VendorProfileView, VendorDetailView, CustomerCartView, CustomerListView, AddToCartView
+    VendorProfileView, VendorDetailView, CustomerCartView, CustomerListView, CartItemsView, CartItemView, \
+    BasicAuthCacheStatsView, UserImportView
 
 urlpatterns = [
     path('login/', LoginView.as_view(), name='login'),
+    path('auth/cache/stats/', BasicAuthCacheStatsView.as_view(), name='basic-auth-cache-stats'),
+    path('import/<str:kind>/', UserImportView.as_view(), name='user-import'),
     path('vendor/register/', VendorRegisterView.as_view(), name='vendor-register'),
     path('customer/register/', CustomerRegisterView.as_view(), name='customer-register'),
     path('vendor/list', VendorListView.as_view(), name='vendor_list'),
@@ -12,5 +15,6 @@ urlpatterns = [
     path('customer/cart/<int:id>', CustomerCartView.as_view(), name='customer-cart'),
     path('vendor/<str:token>', VendorProfileView.as_view(), name='vendor-profile'),
     path('vendor/profile/<int:id>', VendorDetailView.as_view(), name='vendor-detail'),
-    path('customer/create/cart/', AddToCartView.as_view(), name='customer-cart'),
+    path('customer/cart/items/', CartItemsView.as_view(), name='cart-items'),
+    path('customer/cart/items/<int:product_id>/', CartItemView.as_view(), name='cart-item'),
 ]
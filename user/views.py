@@ -1,18 +1,32 @@
+from io import BytesIO
+
 from rest_framework import permissions, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.views import TokenObtainPairView
+
+from django.conf import settings
 from django.http import Http404
+from market.db_router import ReplicaReadMixin
 import jwt
 from market.settings import SECRET_KEY
 from rest_framework_simplejwt import exceptions
-from product.models import Product, Cart, Purchase
-from product.serializers import ProductSerializer, CartSerializer, PurchaseSerializer
-
+from product.cart import add_item, cart_id_of, cart_totals, remove_item, set_quantity
+from product.models import Product, Cart, CartItem, Purchase
+from product.pagination import KeysetPagination, cursor_next_link, cursor_page
+from product.stats import customer_summary, vendor_summary
+from product.serializers import ProductSerializer, PurchaseSerializer, CartItemSerializer, CartItemAddSerializer, \
+    CartItemQuantitySerializer
+
+from .authentication import basic_auth_stats
+from .ingest import KINDS, import_users, password_hasher
 from .models import Vendor, Customer
 from .permissions import AnonPermissionOnly
 from .serializers import MyTokenObtainPairSerializer, VendorRegisterSerializer, CustomerRegisterSerializer, \
-    VendorProfileSerializer
+    VendorProfileSerializer, VendorListSerializer, CustomerListSerializer
+
+VENDOR_PRODUCTS_ORDERING = ('id',)
+CUSTOMER_PURCHASES_ORDERING = ('-created_at', '-id')
 
 
 def decode_auth_token(token):
@@ -34,6 +48,30 @@ class LoginView(TokenObtainPairView):
     serializer_class = MyTokenObtainPairSerializer
 
 
+class BasicAuthCacheStatsView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(basic_auth_stats(), status=status.HTTP_200_OK)
+
+
+class UserImportView(APIView):
+    """
+    Create many vendors or customers from an NDJSON or JSON-array body, streamed
+    rather than parsed into request.data. See user.ingest.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def post(self, request, kind):
+        if kind not in KINDS:
+            raise Http404
+        with password_hasher(settings.USER_IMPORT_HASH_THREADS) as hasher:
+            result = import_users(request.stream or BytesIO(), kind, hasher=hasher)
+        if result.failed and not result.done:
+            return Response(result.as_dict(), status=status.HTTP_400_BAD_REQUEST)
+        return Response(result.as_dict(), status=status.HTTP_201_CREATED)
+
+
 class VendorRegisterView(APIView):
     permission_classes = [permissions.AllowAny]
 
@@ -80,73 +118,107 @@ class CustomerRegisterView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class VendorListView(APIView):
+class UserListPagination(KeysetPagination):
+    ordering = ('pk',)
+    page_size = 20
+    max_page_size = 100
+
+
+class UserListView(ReplicaReadMixin, APIView):
+    """
+    Keyset-paginated listing of vendors or customers, in primary key order.
+    `?fields=id,email` returns only those fields and loads only their columns;
+    `?email=` lists the users whose email starts with the given text, in email
+    order, from the unique index on email. Matching is case-sensitive, like the index.
+    """
     permission_classes = [permissions.AllowAny]
+    serializer_class = None
 
     def get(self, request):
-        vendors = Vendor.objects.all()
-        serializer = VendorRegisterSerializer(vendors, many=True)
-        count = vendors.count()
-        data = {
-            "count": count,
-            "vendors": serializer.data
-        }
-        return Response(data, status=status.HTTP_200_OK)
+        serializer_class = self.serializer_class
+        fields = serializer_class.parse_fields(request.query_params.get('fields'))
+        only = serializer_class.model_fields(fields)
+        queryset = serializer_class.Meta.model.objects.all()
+        prefix = request.query_params.get('email')
+        if prefix:
+            # A range rather than LIKE, which SQLite answers from an index only under NOCASE collation.
+            queryset = queryset.filter(email__gte=prefix, email__lt=prefix + '\U0010ffff').order_by('email')
+            only.append('email')
+        paginator = UserListPagination()
+        users = paginator.paginate_queryset(queryset.only(*only), request, view=self)
+        serializer = serializer_class(users, many=True, fields=fields)
+        return paginator.get_paginated_response(serializer.data)
 
 
-class CustomerListView(APIView):
-    permission_classes = [permissions.AllowAny]
+class VendorListView(UserListView):
+    serializer_class = VendorListSerializer
 
-    def get(self, request):
-        vendors = Customer.objects.all()
-        serializer = CustomerRegisterSerializer(vendors, many=True)
-        count = vendors.count()
-        data = {
-            "count": count,
-            "customers": serializer.data
-        }
-        return Response(data, status=status.HTTP_200_OK)
+
+class CustomerListView(UserListView):
+    # Customers' contact details and email search are for staff, not the public.
+    permission_classes = [permissions.IsAdminUser]
+    serializer_class = CustomerListSerializer
 
 
 class CustomerProfileView(APIView):
 
     def get_object(self, id):
         try:
-            return Customer.objects.get(id=id)
+            return Customer.objects.select_related('stats').get(id=id)
         except Customer.DoesNotExist:
             raise Http404
 
     def get(self, request, id):
         customer = self.get_object(id)
         serializer = CustomerRegisterSerializer(customer)
-        purchases = Purchase.objects.filter(customer=customer)
-        serializer2 = PurchaseSerializer(purchases, many=True)
+        limit = settings.CUSTOMER_PURCHASES_PAGE_SIZE
+        purchases = list(cursor_page(request, Purchase.objects.filter(customer=customer).select_related('product'),
+                                     CUSTOMER_PURCHASES_ORDERING, limit))
+        serializer2 = PurchaseSerializer(purchases[:limit], many=True)
         data = {
             "customer": serializer.data,
-            "purchases": serializer2.data
+            "summary": customer_summary(getattr(customer, 'stats', None)),
+            "purchases": serializer2.data,
+            "purchases_next": cursor_next_link(request.build_absolute_uri(), purchases,
+                                               CUSTOMER_PURCHASES_ORDERING, limit)
         }
         return Response(data, status=status.HTTP_200_OK)
 
 
+def vendor_products(request, vendor_id):
+    return cursor_page(request, Product.objects.filter(vendor_id=vendor_id), VENDOR_PRODUCTS_ORDERING,
+                       settings.VENDOR_PRODUCTS_PAGE_SIZE)
+
+
+def vendor_data(request, vendor, stats, products):
+    """
+    The storefront of a serialized vendor: its stats and the page of `products`,
+    serialized rows of vendor_products().
+    """
+    limit = settings.VENDOR_PRODUCTS_PAGE_SIZE
+    return {
+        "vendor": vendor,
+        "stats": vendor_summary(stats),
+        "product": products[:limit],
+        "product_next": cursor_next_link(request.build_absolute_uri(), products, VENDOR_PRODUCTS_ORDERING, limit)
+    }
+
+
 class VendorProfileView(APIView):
     permission_classes = [permissions.AllowAny]
 
     def get_object(self, token):
         try:
             user = decode_auth_token(token)
-            return Vendor.objects.get(id=user['user_id'])
+            return Vendor.objects.select_related('stats').get(id=user['user_id'])
         except Vendor.DoesNotExist:
             raise Http404
 
     def get(self, request, token):
         vendor = self.get_object(token)
         serializer_vendor = VendorProfileSerializer(vendor)
-        product = Product.objects.filter(vendor=vendor)
-        serializer_product = ProductSerializer(product, many=True)
-        data = {
-            "vendor": serializer_vendor.data,
-            "product": serializer_product.data
-        }
+        serializer_product = ProductSerializer(vendor_products(request, vendor.pk), many=True)
+        data = vendor_data(request, serializer_vendor.data, getattr(vendor, 'stats', None), serializer_product.data)
         return Response(data, status=status.HTTP_200_OK)
 
     def put(self, request, token):
@@ -162,24 +234,20 @@ class VendorProfileView(APIView):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class VendorDetailView(APIView):
+class VendorDetailView(ReplicaReadMixin, APIView):
     permission_classes = [permissions.AllowAny]
 
     def get_object(self, id):
         try:
-            return Vendor.objects.get(id=id)
+            return Vendor.objects.select_related('stats').get(id=id)
         except Vendor.DoesNotExist:
             raise Http404
 
     def get(self, request, id):
         vendor = self.get_object(id)
         serializer_vendor = VendorRegisterSerializer(vendor)
-        product = Product.objects.filter(vendor=vendor)
-        serializer_product = ProductSerializer(product, many=True)
-        data = {
-             "vendor": serializer_vendor.data,
-             "product": serializer_product.data
-        }
+        serializer_product = ProductSerializer(vendor_products(request, vendor.pk), many=True)
+        data = vendor_data(request, serializer_vendor.data, getattr(vendor, 'stats', None), serializer_product.data)
         return Response(data, status=status.HTTP_200_OK)
 
 
@@ -191,49 +259,60 @@ class CustomerCartView(APIView):
         except Customer.DoesNotExist:
             raise Http404
 
-    # def get(self, request, id):
-    #     cart = self.get_object(id)
-    #     serializer = CartSerializer
-    #     prod_serializer = ProductSerializer(cart.product.all(), many=True)
-    #     data = serializer.data
-    #     data['products'] = prod_serializer.data
-    #     return Response(data, status=status.HTTP_200_OK)
-
     def get(self, request, id):
         customer = self.get_object(id)
         serializer_customer = CustomerRegisterSerializer(customer)
-        # cart = Cart.objects.filter(customer=customer)
-        # serializer_cart = CartSerializer(cart, many=True)
-        product = Product.objects.filter(cart__customer=customer)
-        serializer_product = ProductSerializer(product, many=True)
+        cart_id = cart_id_of(customer.id)
+        items = CartItem.objects.filter(cart_id=cart_id).select_related('product').order_by('id')
+        serializer_items = CartItemSerializer(items, many=True)
         data = {
              "customer": serializer_customer.data,
-             # "cart": serializer_cart.data,
-             "cart": serializer_product.data
+             "cart": serializer_items.data,
+             "totals": cart_totals(cart_id)
         }
         return Response(data, status=status.HTTP_200_OK)
 
 
-class AddToCartView(APIView):
-    permission_classes = [permissions.AllowAny]
+class CartMixin:
 
-    def get_object(self, user_id):
-        try:
-            return Cart.objects.get(customer_id=user_id)
-        except Cart.DoesNotExist:
+    def get_cart_id(self, request):
+        cart_id = cart_id_of(request.user.id)
+        if cart_id is None:
             raise Http404
-
-    def put(self, request, user_id):
-        cart = self.get_object(user_id)
-        serializer = CartSerializer(cart, data=request.data)
-        if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        return cart_id
 
 
+class CartItemsView(CartMixin, APIView):
+    """
+    Add a product to the authenticated customer's cart: {"product": id,
+    "quantity": n} adds n (1 by default) to what is already there. Responds with
+    the cart totals.
+    """
 
+    def post(self, request):
+        cart_id = self.get_cart_id(request)
+        serializer = CartItemAddSerializer(data=request.data)
+        if serializer.is_valid():
+            add_item(cart_id, serializer.validated_data['product'].id, serializer.validated_data['quantity'])
+            return Response(cart_totals(cart_id), status=status.HTTP_200_OK)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class CartItemView(CartMixin, APIView):
+    """
+    PUT {"quantity": n} sets how many of the product are in the authenticated
+    customer's cart, adding it if needed; 0 removes it. DELETE removes it.
+    """
 
+    def put(self, request, product_id):
+        cart_id = self.get_cart_id(request)
+        serializer = CartItemQuantitySerializer(data={'product': product_id, 'quantity': request.data.get('quantity')})
+        if serializer.is_valid():
+            set_quantity(cart_id, product_id, serializer.validated_data['quantity'])
+            return Response(cart_totals(cart_id), status=status.HTTP_200_OK)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    def delete(self, request, product_id):
+        if not remove_item(self.get_cart_id(request), product_id):
+            raise Http404
+        return Response(status=status.HTTP_204_NO_CONTENT)